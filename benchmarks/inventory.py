@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Synthetic inventories for the benchmarks: resources with owners, states and cleaner tag
+# histories drawn from configurable distributions, seeded into (moto) EC2, RDS and autoscaling.
+#
+import random
+import datetime
+
+
+INVENTORY_DEFAULTS = {
+    # Share of resources per type
+    "types": {"ec2": 0.85, "rds": 0.05, "asg": 0.10},
+    # Share of resources per state, for each type
+    "states": {
+        "ec2": {"running": 0.7, "stopped": 0.3},
+        "rds": {"standalone:available": 0.7, "standalone:stopped": 0.3},
+        "asg": {"standalone:running": 0.5, "standalone:scaledtozero": 0.5},
+    },
+    # Share of resources per cleaner tag history:
+    # * new: no cleaner tags yet
+    # * scheduled: action date within default_days, with the notifications due so far already sent
+    # * pending: action date within default_days, no notification sent yet
+    # * due: action date reached, every notification sent
+    # * over_max: action date further than max_days away
+    # * exception: has an exception tag
+    "histories": {"new": 0.35, "scheduled": 0.3, "pending": 0.1, "due": 0.1, "over_max": 0.05, "exception": 0.1},
+    # Share of resources with an owner email tag, and the number of distinct owners
+    "email_share": 0.9,
+    "owners": 50,
+}
+
+
+def weighted_choice(
+    rng: random.Random,
+    weights: dict,
+):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def history_tags(
+    rng: random.Random,
+    history: str,
+    state_config: dict,
+    exception_tag: str,
+    run_date: datetime.date,
+):
+    """
+    Cleaner tags of a resource with the given history, relative to run_date
+    """
+    if history == "new" or not state_config:
+        return dict()
+    if history == "exception":
+        return {exception_tag: str(run_date + datetime.timedelta(days=rng.randint(1, 365)))}
+
+    notifications = state_config.get("notifications") or dict()
+    if history == "over_max":
+        days = state_config["max_days"] + rng.randint(1, 30)
+    elif history == "due":
+        days = -rng.randint(0, 5)
+    else:
+        days = rng.randint(1, state_config["default_days"])
+    action_date = run_date + datetime.timedelta(days=days)
+    tags = {state_config["action_tag"]: str(action_date)}
+    if history in ("scheduled", "due"):
+        # Notifications whose threshold was crossed before today
+        for tag, notification_days in notifications.items():
+            if days < notification_days:
+                tags[tag] = str(action_date - datetime.timedelta(days=notification_days))
+    return tags
+
+
+def generate_inventory(
+    count: int,
+    instances_config: dict,
+    run_date: datetime.date,
+    seed: int = 0,
+    inventory_config: dict = None,
+):
+    """
+    Returns `count` resources: {"type", "state", "history", "name", "tags"}.
+    The same count, seed and configuration always give the same inventory.
+    """
+    inventory_config = INVENTORY_DEFAULTS | (inventory_config or dict())
+    rng = random.Random(seed)
+    owners = ["owner{}@example.com".format(n) for n in range(inventory_config["owners"])]
+
+    inventory = list()
+    for n in range(count):
+        type = weighted_choice(rng, inventory_config["types"])
+        state = weighted_choice(rng, inventory_config["states"][type])
+        history = weighted_choice(rng, inventory_config["histories"])
+        type_config = instances_config.get("autoscaling" if type == "asg" else type) or dict()
+        exception_tag = ((type_config.get("config") or dict()).get("exceptions") or ["aws_cleaner/exception"])[0]
+
+        tags = {"Name": "bench-{}-{}".format(type, n)}
+        if rng.random() < inventory_config["email_share"]:
+            tags["email"] = rng.choice(owners)
+        tags.update(
+            history_tags(
+                rng,
+                history,
+                (type_config.get("states") or dict()).get(state),
+                exception_tag,
+                run_date,
+            )
+        )
+        inventory.append(
+            {
+                "type": type,
+                "state": state,
+                "history": history,
+                "name": "bench-{}-{}".format(type, n),
+                "tags": tags,
+            }
+        )
+    return inventory
+
+
+def chunks(
+    items: list,
+    size: int,
+):
+    for n in range(0, len(items), size):
+        yield items[n:n + size]
+
+
+def seed_ec2(
+    session,
+    region: str,
+    resources: list,
+    ami: str = "ami-12c6146b",
+):
+    client = session.client("ec2", region_name=region)
+    ids = list()
+    for batch in chunks(resources, 1000):
+        response = client.run_instances(ImageId=ami, InstanceType="t3.micro", MinCount=len(batch), MaxCount=len(batch))
+        ids += [instance["InstanceId"] for instance in response["Instances"]]
+
+    # Instances with identical tags are tagged together
+    by_tags = dict()
+    for instance_id, resource in zip(ids, resources):
+        by_tags.setdefault(tuple(sorted(resource["tags"].items())), list()).append(instance_id)
+    for tags, instance_ids in by_tags.items():
+        for batch in chunks(instance_ids, 1000):
+            client.create_tags(Resources=batch, Tags=[{"Key": k, "Value": v} for k, v in tags])
+
+    stopped = [instance_id for instance_id, resource in zip(ids, resources) if resource["state"] == "stopped"]
+    for batch in chunks(stopped, 1000):
+        client.stop_instances(InstanceIds=batch)
+
+
+def seed_rds(
+    session,
+    region: str,
+    resources: list,
+):
+    client = session.client("rds", region_name=region)
+    for resource in resources:
+        client.create_db_instance(
+            DBInstanceIdentifier=resource["name"],
+            DBInstanceClass="db.t3.micro",
+            Engine="postgres",
+            MasterUsername="bench",
+            MasterUserPassword="benchmark",
+            AllocatedStorage=20,
+            Tags=[{"Key": k, "Value": v} for k, v in resource["tags"].items()],
+        )
+        if resource["state"] == "standalone:stopped":
+            client.stop_db_instance(DBInstanceIdentifier=resource["name"])
+
+
+def seed_asg(
+    session,
+    region: str,
+    resources: list,
+):
+    client = session.client("autoscaling", region_name=region)
+    if resources:
+        client.create_launch_configuration(
+            LaunchConfigurationName="bench",
+            ImageId="ami-12c6146b",
+            InstanceType="t3.micro",
+        )
+    for resource in resources:
+        capacity = 1 if resource["state"] == "standalone:running" else 0
+        client.create_auto_scaling_group(
+            AutoScalingGroupName=resource["name"],
+            LaunchConfigurationName="bench",
+            MinSize=0,
+            MaxSize=1,
+            DesiredCapacity=capacity,
+            AvailabilityZones=["{}a".format(region)],
+            Tags=[
+                {
+                    "ResourceId": resource["name"],
+                    "ResourceType": "auto-scaling-group",
+                    "Key": k,
+                    "Value": v,
+                    "PropagateAtLaunch": False,
+                }
+                for k, v in resource["tags"].items()
+            ],
+        )
+
+
+def seed_inventory(
+    session,
+    region: str,
+    inventory: list,
+):
+    """
+    Create the inventory's resources through the AWS APIs (meant for moto)
+    """
+    seed_ec2(session, region, [r for r in inventory if r["type"] == "ec2"])
+    seed_rds(session, region, [r for r in inventory if r["type"] == "rds"])
+    seed_asg(session, region, [r for r in inventory if r["type"] == "asg"])
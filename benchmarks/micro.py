@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Microbenchmarks of the per-instance CPU work: determine_action (every Result branch),
+# date_or_none, GenericInstance construction, message rendering and decide_instance.
+# Each case is timed relative to a calibration loop run alongside it (see measure()), and that relative cost
+# is what is compared with the baseline.
+#
+#   python -m benchmarks.micro                   # compare with benchmarks/baselines/micro.json
+#   python -m benchmarks.micro --save-baseline
+#   python -m pytest tests/test_microbenchmarks.py --benchmark
+#
+import os
+import sys
+import json
+import yaml
+import timeit
+import argparse
+import platform
+import datetime
+import statistics
+
+from utils import determine_action, date_or_none
+from utils.result import Result
+from utils.aws.generic_instance import GenericInstance
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines", "micro.json")
+DEFAULT_THRESHOLD = 0.3
+REPEAT = 15
+
+RUN_DATE = datetime.date(2020, 12, 1)
+T_N1 = "aws_cleaner/stop/notifications/1"
+T_N2 = "aws_cleaner/stop/notifications/2"
+T_N3 = "aws_cleaner/stop/notifications/3"
+
+
+def days(
+    n: int,
+):
+    return RUN_DATE + datetime.timedelta(days=n)
+
+
+def notifications(
+    *sent,
+):
+    """
+    Notification state with the first len(sent) notifications sent on the given dates
+    """
+    sent = list(sent) + [None] * (3 - len(sent))
+    return {
+        T_N1: {"old": sent[0], "days": 15},
+        T_N2: {"old": sent[1], "days": 7},
+        T_N3: {"old": sent[2], "days": 2},
+    }
+
+
+# Result -> (action date, notifications), one per determine_action branch
+DETERMINE_ACTION_CASES = {
+    Result.ADD_ACTION_DATE: (None, notifications()),
+    Result.RESET_ACTION_DATE: (days(80), notifications()),
+    Result.PAST_BUMP_NOTIFICATION: (days(-1), notifications(days(-10))),
+    Result.COMPLETE_ACTION: (RUN_DATE, notifications(days(-15), days(-7), days(-2))),
+    Result.SEND_NOTIFICATION: (days(5), notifications(days(-10))),
+    Result.RESET_NOTIFICATIONS: (days(40), notifications(days(-10))),
+    Result.LOG_NO_NOTIFICATION: (days(31), notifications()),
+}
+
+
+def load_config(
+    config_file: str = os.path.join("config", "default_config.yaml"),
+):
+    with open(config_file, "r") as f:
+        return yaml.safe_load(f)
+
+
+def sample_instance(
+    tags: dict = None,
+):
+    return GenericInstance(
+        type="ec2",
+        id="i-0123456789abcdef0",
+        region="us-east-1",
+        name="benchmark",
+        email="owner@example.com",
+        state="running",
+        exceptions=list(),
+        tags=tags or dict(),
+    )
+
+
+def cases(
+    config: dict,
+):
+    """
+    Benchmark name -> function taking no argument
+    """
+    notify_messages_config = config.get("notify_messages", dict())
+    state_map = config["instances"]["ec2"]["states"]
+    benchmarks = dict()
+
+    for result, (action_date, idn_notification) in DETERMINE_ACTION_CASES.items():
+        benchmarks["determine_action[{}]".format(result.value)] = (
+            lambda action_date=action_date, idn_notification=idn_notification: determine_action(
+                d_run_date=RUN_DATE,
+                idn_action_date=action_date,
+                i_default_days=31,
+                i_max_days=62,
+                idn_notification=idn_notification,
+                notify_messages_config=notify_messages_config,
+            )
+        )
+
+    tags = {"aws_cleaner/stop/date": str(days(10)), "Name": "benchmark", "email": "owner@example.com"}
+    benchmarks["date_or_none[present]"] = lambda: date_or_none(tags, "aws_cleaner/stop/date")
+    benchmarks["date_or_none[missing]"] = lambda: date_or_none(tags, T_N1)
+
+    raw_tags = [{"Key": k, "Value": v} for k, v in tags.items()]
+    benchmarks["GenericInstance"] = lambda: sample_instance({tag["Key"]: tag["Value"] for tag in raw_tags})
+
+    instance = sample_instance(tags)
+    for result in (Result.ADD_ACTION_DATE, Result.SEND_NOTIFICATION, Result.COMPLETE_ACTION):
+        template = notify_messages_config[result].replace("__N__", "1")
+        details = {
+            **instance,
+            "action": "stop",
+            "tag": "aws_cleaner/stop/date",
+            "old_date": RUN_DATE,
+            "new_date": days(10),
+            "state": instance.state,
+            "result": result,
+        }
+        benchmarks["render_message[{}]".format(result.value)] = lambda template=template, details=details: template.format(**details)
+
+    import main
+
+    for name, tags in (
+        ("new", dict()),
+        ("notify", {"aws_cleaner/stop/date": str(days(5)), T_N1: str(days(-10))}),
+        ("complete", {"aws_cleaner/stop/date": str(RUN_DATE), T_N1: str(days(-15)), T_N2: str(days(-7)), T_N3: str(days(-2))}),
+    ):
+        instance = sample_instance(tags)
+        benchmarks["decide_instance[{}]".format(name)] = lambda instance=instance: main.decide_instance(
+            instance,
+            state_map,
+            notify_messages_config,
+            RUN_DATE,
+        )
+
+    return benchmarks
+
+
+def calibration_loop():
+    total = 0
+    for i in range(1000):
+        total += i % 7
+    return total
+
+
+def measure(
+    func,
+    repeat: int = REPEAT,
+):
+    """
+    Returns (nanoseconds per call, cost relative to calibration_loop), medians of `repeat` rounds.
+    Each round times calibration_loop right before func, so load on the machine slows both down alike and the
+    relative cost stays comparable across runs and machines.
+    """
+    timer = timeit.Timer(func)
+    calibration = timeit.Timer(calibration_loop)
+    # autorange() is the number of calls taking at least 0.2 seconds; rounds are a quarter of that
+    number = max(1, timer.autorange()[0] // 4)
+    calibration_number = max(1, calibration.autorange()[0] // 4)
+    ns = list()
+    relative = list()
+    for _ in range(repeat):
+        calibration_seconds = calibration.timeit(calibration_number) / calibration_number
+        seconds = timer.timeit(number) / number
+        ns.append(seconds * 1e9)
+        relative.append(seconds / calibration_seconds)
+    return statistics.median(ns), statistics.median(relative)
+
+
+def compare(
+    name: str,
+    relative: float,
+    baseline: dict,
+    threshold: float,
+):
+    """
+    Returns (baseline relative cost or None, True if slower than baseline * (1 + threshold))
+    """
+    base = baseline.get("relative", dict()).get(name)
+    if base is None:
+        return None, False
+    return base, relative > base * (1 + threshold)
+
+
+def load_baseline(
+    path: str = BASELINE_FILE,
+):
+    if not os.path.exists(path):
+        return dict()
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_baseline(
+    results: dict,
+    path: str = BASELINE_FILE,
+):
+    """
+    results: name -> (ns, relative) as returned by measure(); only the relative costs are compared
+    """
+    baseline = load_baseline(path)
+    baseline["python"] = platform.python_version()
+    baseline["machine"] = "{} {} ({} CPU)".format(platform.system(), platform.machine(), os.cpu_count())
+    baseline.setdefault("benchmarks", dict()).update({name: round(ns, 1) for name, (ns, _) in results.items()})
+    baseline.setdefault("relative", dict()).update({name: float("{:.4g}".format(relative)) for name, (_, relative) in results.items()})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=3, sort_keys=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AWS Cleaner microbenchmarks")
+    parser.add_argument("--baseline", help="Baseline file (default is {})".format(BASELINE_FILE), default=BASELINE_FILE, dest="baseline")
+    parser.add_argument("--save-baseline", help="Store the results as the new baseline", action="store_true", dest="save_baseline")
+    parser.add_argument("--threshold", help="Allowed slowdown over the baseline (default is {})".format(DEFAULT_THRESHOLD), type=float, default=DEFAULT_THRESHOLD, dest="threshold")
+    parser.add_argument("--filter", help="Only run benchmarks whose name contains this", dest="filter")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    results = dict()
+    regressions = list()
+    for name, func in cases(load_config()).items():
+        if args.filter and args.filter not in name:
+            continue
+        ns, relative = results[name] = measure(func)
+        base, regressed = compare(name, relative, baseline, args.threshold)
+        print(
+            "{:<45} {:>10.1f} ns {:>8.4g}x calibration{}{}".format(
+                name,
+                ns,
+                relative,
+                " (baseline {:.4g}x, {:+.1%})".format(base, relative / base - 1) if base else "",
+                "  REGRESSION" if regressed else "",
+            )
+        )
+        if regressed:
+            regressions.append(name)
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print("Baseline saved to {}".format(args.baseline))
+    elif regressions:
+        sys.exit(1)
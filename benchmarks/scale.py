@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# End-to-end scale benchmark: a synthetic inventory is seeded into moto, then the cleaner runs
+# against it (Slack is a local stand-in). Each size runs in its own process, so peak RSS is per size.
+#
+#   python -m benchmarks.scale --sizes 1000 10000 100000
+#   python -m benchmarks.scale --save-baseline
+#
+import os
+import sys
+import json
+import copy
+import time
+import yaml
+import logging
+import argparse
+import platform
+import resource
+import datetime
+import subprocess
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines", "scale.json")
+REGION = "us-east-1"
+
+# Compared with the baseline: (metric, allowed increase, as a share of the baseline value; None is --tolerance)
+# Slack messages are deterministic for a given inventory; API calls vary a little with how actuation batches fill up
+GATES = (
+    ("wall_seconds", None),
+    ("peak_rss_mb", None),
+    ("api_calls", 0.05),
+    ("slack_messages", 0),
+)
+
+
+def benchmark_config(
+    config: dict,
+    slack,
+):
+    config = copy.deepcopy(config)
+    config["global"] = config.get("global") or dict()
+    config["global"]["regions"] = [REGION]
+    config["slack"].update(
+        {
+            "chat_post_message_endpoint": slack.url("chat.postMessage"),
+            "user_lookup_endpoint": slack.url("users.lookupByEmail"),
+            "post_interval_seconds": 0,
+        }
+    )
+    for type in ("ec2", "rds", "autoscaling"):
+        config["instances"][type]["enabled"] = True
+        config["instances"][type]["config"]["filters"] = None
+    # ASG actions terminate the groups' EC2 instances, so discover units one at a time (ec2 before autoscaling)
+    # to keep the EC2 results from depending on how the two overlap
+    config["global"]["pipeline"] = (config["global"].get("pipeline") or dict()) | {"discovery_workers": 1}
+    return config
+
+
+def rss_mb():
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_size(
+    size: int,
+    config_file: str,
+    seed: int,
+):
+    """
+    Seed an inventory of `size` resources and time one run against it (in this process)
+    """
+    os.environ.update(
+        {
+            "AWS_ACCESS_KEY_ID": "testing",
+            "AWS_SECRET_ACCESS_KEY": "testing",
+            "AWS_DEFAULT_REGION": REGION,
+        }
+    )
+    import boto3
+    from moto import mock_aws
+
+    import main
+    from benchmarks.inventory import generate_inventory, seed_inventory
+    from tests.slack_standin import SlackStandIn
+
+    with open(config_file, "r") as f:
+        config = yaml.safe_load(f)
+
+    # No rate limits: this measures the cleaner, not Slack's limits
+    slack = SlackStandIn(channel_rate=None, method_rates=dict()).start()
+    config = benchmark_config(config, slack)
+    run_date = datetime.date.today()
+
+    with mock_aws():
+        session = boto3.Session(region_name=REGION)
+        session.client("secretsmanager").create_secret(
+            Name=config["slack"]["token_secret_name"],
+            SecretString=json.dumps(
+                {
+                    config["slack"]["token_secret_key"]: "xoxb-benchmark",
+                    config["slack"]["channel_key"]: "C0BENCH",
+                    config["slack"]["log_channel_key"]: "C0BENCHLOG",
+                }
+            ),
+        )
+        seed_start = time.perf_counter()
+        seed_inventory(session, REGION, generate_inventory(size, config["instances"], run_date, seed=seed))
+        seed_seconds = time.perf_counter() - seed_start
+
+        rss_before_run = rss_mb()
+        start = time.perf_counter()
+        run_summary = main.run(config, run_date=run_date)
+        wall_seconds = time.perf_counter() - start
+
+    slack.stop()
+    return {
+        "resources": size,
+        "seed_seconds": round(seed_seconds, 2),
+        "wall_seconds": round(wall_seconds, 2),
+        "rss_before_run_mb": rss_before_run,
+        "peak_rss_mb": rss_mb(),
+        "api_calls": run_summary.data["api_calls"]["total"],
+        "api_calls_by_operation": {
+            key: values["calls"] for key, values in run_summary.data["api_calls"]["operations"].items()
+        },
+        "slack_messages": sum(slack.calls.values()),
+        "results": run_summary.data["results"],
+    }
+
+
+def compare(
+    results: dict,
+    baseline: dict,
+    tolerance: float,
+):
+    """
+    Returns the list of regressions against the baseline
+    """
+    regressions = list()
+    for size, result in results.items():
+        base = baseline.get("sizes", dict()).get(size)
+        if not base:
+            print("{:>8} resources: no baseline".format(size))
+            continue
+        for metric, allowed in GATES:
+            allowed = tolerance if allowed is None else allowed
+            change = (result[metric] - base[metric]) / base[metric] if base[metric] else 0
+            regressed = result[metric] > base[metric] * (1 + allowed)
+            print(
+                "{:>8} resources: {:<15} {:>10} (baseline {}, {:+.1%}){}".format(
+                    size,
+                    metric,
+                    result[metric],
+                    base[metric],
+                    change,
+                    "  REGRESSION" if regressed else "",
+                )
+            )
+            if regressed:
+                regressions.append((size, metric))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AWS Cleaner scale benchmark (moto)")
+    parser.add_argument("--sizes", help="Inventory sizes (default is 1000)", nargs="+", type=int, default=[1000], dest="sizes")
+    parser.add_argument("--config", help="Cleaner configuration (default is config/default_config.yaml)", default=os.path.join("config", "default_config.yaml"), dest="config")
+    parser.add_argument("--seed", help="Inventory random seed", type=int, default=1, dest="seed")
+    parser.add_argument("--baseline", help="Baseline file (default is {})".format(BASELINE_FILE), default=BASELINE_FILE, dest="baseline")
+    parser.add_argument("--save-baseline", help="Store the results as the new baseline", action="store_true", dest="save_baseline")
+    parser.add_argument("--tolerance", help="Allowed wall time / RSS increase over the baseline (default is 0.25)", type=float, default=0.25, dest="tolerance")
+    parser.add_argument("--output", help="Also write the results (JSON) to this file", dest="output")
+    parser.add_argument("--worker", help=argparse.SUPPRESS, type=int, dest="worker")
+    args = parser.parse_args()
+
+    if args.worker:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_size(args.worker, args.config, args.seed)))
+        sys.exit(0)
+
+    results = dict()
+    for size in args.sizes:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.scale", "--worker", str(size), "--config", args.config, "--seed", str(args.seed)],
+            check=True,
+            stdout=subprocess.PIPE,
+            text=True,
+        ).stdout
+        results[str(size)] = json.loads(output.strip().splitlines()[-1])
+        print(
+            "{:>8} resources: {wall_seconds}s, peak RSS {peak_rss_mb}MB, {api_calls} API calls, {slack_messages} Slack messages (seeding {seed_seconds}s)".format(
+                size,
+                **results[str(size)],
+            )
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=3)
+
+    if args.save_baseline:
+        baseline = dict()
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+        baseline["seed"] = args.seed
+        baseline["python"] = platform.python_version()
+        baseline["machine"] = "{} {} ({} CPU)".format(platform.system(), platform.machine(), os.cpu_count())
+        baseline.setdefault("sizes", dict()).update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=3)
+        print("Baseline saved to {}".format(args.baseline))
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# AWS Lambda entry point, handler: lambda_function.lambda_handler
+#
+# Environment:
+# * AWS_CLEANER_CONFIG: YAML configuration file (default is config/default_config.yaml)
+#
+# Event (all optional):
+# {"run_date": "yyyy-mm-dd", "dry_run": true, "regions": ["us-east-1"]}
+#
+# Nothing heavy is imported at module load; main (and through it boto3/requests) is imported on
+# the first invocation, and config and clients are kept at module scope for warm invocations.
+#
+import os
+import logging
+import datetime
+import threading
+
+
+LAMBDA_DEFAULTS = {
+    # Stop starting new work this long before the Lambda timeout
+    "safety_margin_seconds": 60,
+    # Local path or s3://bucket/key; completed work units are recorded here so a re-invocation skips them
+    "checkpoint": None,
+}
+
+# Reused across warm invocations
+_config = None
+_cache = dict()
+
+
+def load_config():
+    global _config
+    if _config is None:
+        import yaml
+
+        with open(os.environ.get("AWS_CLEANER_CONFIG", os.path.join("config", "default_config.yaml")), "r") as f:
+            _config = yaml.safe_load(f)
+    return _config
+
+
+def lambda_handler(event, context):
+    import main
+    from utils import iso_format
+    from utils.checkpoint import load_checkpoint, save_checkpoint
+
+    logging.getLogger().setLevel(logging.INFO)
+    event = event or dict()
+    config = load_config()
+    lambda_config = LAMBDA_DEFAULTS | (config.get("lambda") or dict())
+
+    run_date = iso_format(event.get("run_date")) or datetime.date.today()
+    margin_ms = lambda_config["safety_margin_seconds"] * 1000
+    stopped_early = list()
+
+    def should_stop():
+        if context is None or context.get_remaining_time_in_millis() > margin_ms:
+            return False
+        if not stopped_early:
+            logging.warning("Less than {}s left before the Lambda timeout, not starting new work".format(lambda_config["safety_margin_seconds"]))
+            stopped_early.append(True)
+        return True
+
+    completed_units = list()
+    if lambda_config["checkpoint"]:
+        completed_units = load_checkpoint(lambda_config["checkpoint"], str(run_date))
+    skip_units = list(completed_units)
+    checkpoint_lock = threading.Lock()
+
+    def unit_completed(key):
+        # Saved as each unit completes: the Lambda may time out before main.run returns
+        with checkpoint_lock:
+            completed_units.append(key)
+            if lambda_config["checkpoint"]:
+                try:
+                    save_checkpoint(lambda_config["checkpoint"], str(run_date), completed_units)
+                except Exception as e:
+                    logging.warning("Unable to save checkpoint {}: {}".format(lambda_config["checkpoint"], e))
+
+    run_summary = main.run(
+        config,
+        run_date=run_date,
+        dry_run=event.get("dry_run", False),
+        regions=event.get("regions"),
+        cache=_cache,
+        should_stop=should_stop,
+        skip_units=skip_units,
+        on_unit_completed=unit_completed,
+    )
+
+    return {
+        "run_date": str(run_date),
+        "results": run_summary.data["results"],
+        "completed_units": len(completed_units),
+        "stopped_early": bool(stopped_early),
+        "deferred": run_summary.data.get("deferred", 0),
+    }
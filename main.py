@@ -27,6 +27,7 @@ import sys
 import json
 import yaml
 import logging
+import time
 import argparse
 import datetime
 
@@ -39,21 +40,1758 @@ from utils import (
     log_item,
 )
 
-# from utils.aws.generic_instance import GenericInstance
-from utils.aws import *
-from utils.aws.aws_client import AWSClient
-from utils.aws.rds_client import RDSClient
-from utils.aws.ec2_client import EC2Client
-from utils.aws.asg_client import ASGClient
-# I don't know why I have to explicitly import ASGClient, but not RDSClient or EC2Client
-from utils.slack_client import SlackClient
-from utils.result import Result
+# AWS and Slack clients (boto3, requests) are imported where they are used, so importing this
+# module stays cheap (e.g. Lambda cold start, see lambda_function.py)
+from utils.result import Result, URGENCY, LEAST_URGENT
+from utils.pipeline import Pipeline
+from utils.summary import RunSummary
+from utils.shard import unit_key, parse_shard, in_shard, LeaseManager, LEASE_TTL_SECONDS
+from utils.daemon import run_daemon
+from utils.cron import parse_deadline
+from utils.metrics import METRICS
+from utils.profiling import Profiler, PROFILE_MODES, profile_path
 
 
 ###############################
 # Global and System Variables #
 ###############################
-D_TODAY = datetime.date.today()
+
+
+# Default pipeline sizing (overridden by global.pipeline in the YAML config)
+PIPELINE_DEFAULTS = {
+    "queue_size": 100,
+    "discovery_workers": 4,
+    "decision_workers": 2,
+    "actuation_workers": 4,
+    "actuation_batch_size": 50,
+    "notification_workers": 1,
+}
+
+
+#############
+# Functions #
+#############
+def get_aws_client(
+    instance_type: str,
+    region: str,
+    dry_run: bool,
+    notify_messages_config: dict,
+    email_tags_config: list,
+    session=None,
+    account: str = None,
+    tag_writer: str = None,
+):
+    if instance_type == 'ec2':
+        from utils.aws.ec2_client import EC2Client as client_class
+    elif instance_type == 'rds':
+        from utils.aws.rds_client import RDSClient as client_class
+    elif instance_type == 'autoscaling':
+        from utils.aws.asg_client import ASGClient as client_class
+    else:
+        from utils.aws.aws_client import AWSClient as client_class
+
+    return client_class(
+        region,
+        dry_run=dry_run,
+        service_name=instance_type,
+        notify_messages_config=notify_messages_config,
+        email_tags=email_tags_config,
+        session=session,
+        account=account,
+        tag_writer=tag_writer,
+    )
+
+
+def account_label(
+    account: str,
+):
+    return "[{}] ".format(account) if account else ""
+
+
+def slack_text(
+    message_details: dict,
+    dry_run: bool,
+):
+    return "{}{}{} [{}]: {}{}".format(
+        "[DRY RUN] " if dry_run else "",
+        account_label(message_details.get("account")),
+        message_details["email"],
+        message_details["result"],
+        message_details["message"],
+        " (confirmed)" if message_details.get("confirmed") else "",
+    )
+
+
+def decide_instance(
+    instance,
+    state_map: dict,
+    notify_messages_config: dict,
+    d_run_date: datetime.date,
+    leveller=None,
+):
+    """
+    Work out everything that has to happen to a single instance, without doing any of it.
+    With an ActionLeveller, the action date of a newly seen instance is spread to keep daily actions under budget.
+    Returns a decision record:
+    {
+        "instance" (GenericInstance): the instance,
+        "action" (str): action to perform (stop/terminate/...), or None,
+        "updated_tags" (dict): tags to update, {<tag>: {"old": <value>, "new": <value>}},
+        "messages" (list): [{"details": <message_details>, "log": bool, "dm": bool}, ...],
+    }
+    Messages are in the order they have to be sent (a transition notification follows the action it belongs to).
+    """
+    record = {
+        "instance": instance,
+        "action": None,
+        "updated_tags": dict(),
+        "messages": list(),
+    }
+
+    if instance.state not in state_map:
+        message_details = {
+            **instance,
+            "action": "ignore",
+            "tag": instance.state,  # again, this is a hack
+            "result": Result.IGNORE_OTHER_STATES,
+            "old_date": d_run_date,
+            "new_date": d_run_date,
+            "state": instance.state,
+        }
+        message_details["message"] = notify_messages_config.get(Result.IGNORE_OTHER_STATES).format(**message_details)
+        record["messages"].append({"details": message_details, "log": False, "dm": False})
+        return record
+
+    if len(instance.exceptions) > 0:
+        message_details = {
+            **instance,
+            "action": Result.SKIP_EXCEPTION,
+            "tag": instance.exceptions[0][0],  # TODO verify this is right, I think this is wrong
+            "result": Result.SKIP_EXCEPTION,
+            "old_date": d_run_date,
+            "new_date": instance.exceptions[0][1],
+            "state": instance.state,
+        }
+        message_details["message"] = notify_messages_config.get(Result.SKIP_EXCEPTION).format(**message_details)
+        record["messages"].append({"details": message_details, "log": True, "dm": False})
+        return record
+
+    state_config = state_map[instance.state]
+
+    action = state_config["action"]
+    action_tag = state_config["action_tag"]
+    complete_logs_tag = state_config["action_log_tag"]
+    action_default_days = state_config["default_days"]
+    action_max_days = state_config["max_days"]
+
+    next_state = state_config.get("next_state")
+
+    state_notification_tags = state_config.get("notifications")
+    # Results in list of tuples:
+    # [
+    #   ("aws_cleaner/notifications/1": 15),
+    #   (tag_name_2: days_2),
+    #   ...,
+    #   (tag_name_n: days_n)
+    # ]
+    # (sorted by days, in descending order)
+    state_notifications = sorted(
+        state_notification_tags.items(),
+        key=lambda n: n[1],
+        reverse=True
+    )
+
+    # Current value of action date
+    action_current_date = date_or_none(
+        instance.tags, action_tag
+    )
+
+    dn_notification = dict()
+    for notification_tag, days in state_notifications:
+        dn_notification[notification_tag] = {
+            "old": date_or_none(instance.tags, notification_tag),
+            "days": days,
+        }
+    # dn_notification = {
+    #     <tag>: {"old": <current tag value>, "days": >notification days>},
+    #     'aws_cleaner/terminate/notifications/1': {"old": datetime.date(2024, 7, 22),"days": 15},
+    #     'aws_cleaner/terminate/notifications/2': {"old": None, "days": 8},
+    #     'aws_cleaner/terminate/notifications/3': {"old": None, "days": 2}
+    # }
+
+    r = determine_action(
+        idn_action_date=action_current_date,
+        idn_notification=dn_notification,
+        i_default_days=action_default_days,
+        i_max_days=action_max_days,
+        notify_messages_config=notify_messages_config,
+        d_run_date=d_run_date,
+    )
+    if leveller and r["result"] == Result.ADD_ACTION_DATE:
+        r["odn_action_date"] = leveller.assign(d_run_date, action_default_days, action_max_days)
+
+    # Update all tags that have changed
+    tags = {
+        action_tag: {
+            "old": action_current_date,
+            "new": r["odn_action_date"],
+        }
+    }
+    tags |= r["odn_notification"]
+
+    transition_message_details = None
+    if r["result"] == Result.COMPLETE_ACTION:
+        # If we have a 'complete' action, do all of the following (before tag updates and Slack notification)
+        # * Perform the action (stop/terminate)
+        # * Add an action complete log (including notifications) tag
+        # * If there's a next action:
+            # * Add a next action date tag - done
+            # * Send a transition notification
+        record["action"] = action
+
+        tags[complete_logs_tag] = {
+            "old": None,
+            "new": "/".join(
+                ["notified:{}".format(v["new"]) for k,v in r["odn_notification"].items()]
+                + ["{}:{}".format(action, d_run_date)]
+            )
+        }
+
+        if next_state:
+            next_state_config = state_map[next_state]
+
+            tags[next_state_config["action_tag"]] = {
+                "old": None,
+                "new": d_run_date + datetime.timedelta(days=next_state_config["default_days"]),
+            }
+
+            transition_message_details = dict(instance)
+            transition_message_details["action"] = next_state_config["action"]
+            transition_message_details["tag"] = next_state_config["action_tag"]
+            transition_message_details["old_date"] = None
+            transition_message_details["new_date"] = d_run_date + datetime.timedelta(days=next_state_config["default_days"])
+            transition_message_details["state"] = "stopped" # TODO FIX
+            transition_message_details["result"] = Result.TRANSITION_ACTION
+            transition_message_details["message"] = notify_messages_config.get(Result.TRANSITION_ACTION).format(**transition_message_details)
+            # transition_message_details is populated here, but used later so transition notification occurs after action complete action
+
+            for tag in next_state_config["notifications"]:
+                tags[tag] = {
+                    "old": date_or_none(instance.tags, tag),
+                    "new": None,
+                }
+
+    # Filter by tags that have new values
+    record["updated_tags"] = {
+        tag: values for tag,values in tags.items() if values["old"] != values["new"]
+    }
+
+    message_details = {
+        **instance,
+        "action": action,
+        "tag": action_tag,
+        "old_date": action_current_date,
+        "new_date": r["odn_action_date"],
+        "state": instance.state,
+        "result": r["result"],
+    }
+
+    # Add message to message_details
+    message_details["message"] = r["message"].format(**message_details)
+
+    record["messages"].append(
+        {
+            "details": message_details,
+            "log": message_details["result"] in (Result.LOG_NO_NOTIFICATION, Result.SKIP_EXCEPTION),
+            "dm": message_details["result"] not in (Result.LOG_NO_NOTIFICATION,),
+        }
+    )
+
+    if transition_message_details:
+        record["messages"].append({"details": transition_message_details, "log": False, "dm": True})
+
+    return record
+
+
+def open_state_store(
+    global_config: dict,
+    run_date: datetime.date,
+    state_store_file: str = None,
+):
+    """
+    StateStore of state_store_file (or global.state_store_file), or None if there is none
+    """
+    state_store_file = state_store_file or global_config.get("state_store_file")
+    if not state_store_file:
+        return None
+    from utils.state_store import StateStore
+
+    return StateStore(
+        state_store_file,
+        run_date,
+        retention_days=global_config.get("state_store_retention_days", 90),
+    )
+
+
+def unit_client(
+    unit: dict,
+    session_cache,
+    aws_clients: dict,
+    dry_run: bool,
+    notify_messages_config: dict,
+    email_tags_config: list,
+):
+    """
+    AWS client of a work unit; clients are kept (in aws_clients) between daemon runs
+    """
+    client_key = (unit["key"], dry_run)
+    aws_client = aws_clients.get(client_key)
+    if aws_client is None:
+        aws_client = get_aws_client(
+            unit["instance_type"],
+            unit["region"],
+            dry_run=dry_run,
+            notify_messages_config=notify_messages_config,
+            email_tags_config=email_tags_config,
+            session=session_cache.get_session(unit["account"]["role_arn"]),
+            account=unit["account"]["name"],
+            # "tagging_api": batched tag writes with the Resource Groups Tagging API (ARN-addressed types)
+            tag_writer=((unit.get("type_config") or dict()).get("config") or dict()).get("tag_writer"),
+        )
+        aws_clients[client_key] = aws_client
+    return aws_client
+
+
+def discover(
+    unit: dict,
+    slack_client,
+    session_cache,
+    aws_clients: dict,
+    run_summary: RunSummary,
+    lease_manager: LeaseManager,
+    sharded: bool,
+    dry_run: bool,
+    notify_messages_config: dict,
+    email_tags_config: list,
+    should_stop=None,
+    journal=None,
+):
+    """
+    Pipeline stage: list the instances of one (account, region, instance type) unit, one page at a time
+    """
+    if should_stop and should_stop():
+        return
+    if lease_manager and not lease_manager.acquire(unit["key"]):
+        return
+
+    account = unit["account"]
+    region = unit["region"]
+    instance_type = unit["instance_type"]
+    type_config = unit["type_config"]
+    state_map = type_config.get("states")
+    label = account_label(account["name"])
+
+    retrieving_text = "{}Retrieving {} instances from region {}".format(label, instance_type, region)
+    if sharded:
+        logging.info(retrieving_text)
+    else:
+        slack_client.dlog_and_send_text(retrieving_text)
+
+    aws_client = unit_client(
+        unit,
+        session_cache=session_cache,
+        aws_clients=aws_clients,
+        dry_run=dry_run,
+        notify_messages_config=notify_messages_config,
+        email_tags_config=email_tags_config,
+    )
+
+    included_state_counts = dict()
+    excluded_state_counts = dict()
+    pages = aws_client.get_instance_pages(instance_config=type_config.get("config"))
+    while True:
+        start = time.perf_counter()
+        instances = next(pages, None)
+        if instances is None:
+            break
+        METRICS.observe("get_instances", time.perf_counter() - start, items=len(instances), region=region, type=instance_type)
+
+        for instance in instances:
+            counts = included_state_counts if instance.state in state_map else excluded_state_counts
+            counts[instance.state] = counts.get(instance.state, 0) + 1
+
+        yield {
+            "unit": unit,
+            "aws_client": aws_client,
+            "instances": instances,
+        }
+
+        if should_stop and should_stop():
+            # Unit stays incomplete (not in the summary's completed_units), so it is picked up again next time
+            logging.info("{}Stopping discovery of {} instances in region {} early".format(label, instance_type, region))
+            return
+        if lease_manager and not lease_manager.renew(unit["key"]):
+            # Another process took the unit over; leave the rest of it to that process
+            logging.warning("{}Stopping discovery of {} instances in region {}: lease lost".format(label, instance_type, region))
+            return
+
+    completed = run_summary.add_unit(
+        unit["key"],
+        account=account["name"],
+        region=region,
+        instance_type=instance_type,
+        included=included_state_counts,
+        excluded=excluded_state_counts,
+    )
+    if completed and journal:
+        journal.unit_done(unit["key"])
+    for line in run_summary.unit_lines(unit["key"]):
+        if sharded:
+            # Sharded runs only log; the merged summary goes to Slack
+            logging.info(line)
+        else:
+            slack_client.dlog_and_send_text(line)
+
+
+def count_action_dates(
+    unit: dict,
+    session_cache,
+    aws_clients: dict,
+    dry_run: bool,
+    notify_messages_config: dict,
+    email_tags_config: list,
+    leveller,
+    should_stop=None,
+):
+    """
+    Pipeline stage of a levelled run's first pass: count the action dates already scheduled in one work unit
+    (see ActionLeveller.observe), one page at a time, keeping nothing else
+    """
+    if should_stop and should_stop():
+        return
+    state_map = unit["type_config"].get("states")
+    aws_client = unit_client(
+        unit,
+        session_cache=session_cache,
+        aws_clients=aws_clients,
+        dry_run=dry_run,
+        notify_messages_config=notify_messages_config,
+        email_tags_config=email_tags_config,
+    )
+    for instances in aws_client.get_instance_pages(instance_config=unit["type_config"].get("config")):
+        for instance in instances:
+            if instance.state in state_map:
+                leveller.observe(date_or_none(instance.tags, state_map[instance.state]["action_tag"]))
+        if should_stop and should_stop():
+            return
+
+
+def decide(
+    page: dict,
+    notify_messages_config: dict,
+    d_run_date: datetime.date,
+    completed: set = None,
+    leveller=None,
+):
+    """
+    Pipeline stage: run determine_action over a page of instances
+    Instances in `completed` (journal entry IDs finished by an earlier, interrupted run) get an empty record.
+    """
+    state_map = page["unit"]["type_config"].get("states")
+    state_order = {state: n for n, state in enumerate(state_map)}
+
+    # Decide on the whole page before handing records on, so the timing excludes waits on the next stage
+    records = list()
+    with METRICS.timer("decision", items=len(page["instances"]), type=page["unit"]["instance_type"]):
+        # Process in order by state (exceptions are processed with their state rather than separate),
+        # then instances in states the script doesn't handle
+        for instance in sorted(page["instances"], key=lambda i: state_order.get(i.state, len(state_order))):
+            journal_id = "{}|{}".format(page["unit"]["key"], instance.id)
+            if completed and journal_id in completed:
+                logging.info("{}Already processed {type} instance {id} in region {region}".format(account_label(instance.account), **instance))
+                record = {"instance": instance, "action": None, "updated_tags": dict(), "messages": list()}
+            else:
+                logging.info(
+                    "{}Processing {state} {type} instance {id} in region {region}".format(account_label(instance.account), **instance)
+                )
+                record = decide_instance(
+                    instance,
+                    state_map=state_map,
+                    notify_messages_config=notify_messages_config,
+                    d_run_date=d_run_date,
+                    leveller=leveller,
+                )
+            record["aws_client"] = page["aws_client"]
+            record["unit"] = page["unit"]
+            record["unit_key"] = page["unit"]["key"]
+            record["journal_id"] = journal_id
+            records.append(record)
+    return records
+
+
+def urgency(
+    record: dict,
+):
+    """
+    Sort key of a decision record in a prioritised run: its most urgent result (see URGENCY)
+    """
+    return min(
+        [URGENCY.get(message["details"]["result"], LEAST_URGENT) for message in record["messages"]],
+        default=LEAST_URGENT,
+    )
+
+
+def journal_messages(
+    record: dict,
+):
+    """
+    The Slack messages of a decision record, as the journal stores them (enough to send them again)
+    """
+    return [
+        {
+            "text": slack_text(message["details"], dry_run=False),
+            "log": message["log"],
+            "dm": message["dm"],
+            "dm_text": message["details"]["message"],
+            "email": message["details"]["email"],
+            "result": message["details"]["result"],
+        }
+        for message in record["messages"]
+    ]
+
+
+def confirm_actions(
+    actions: dict,
+    clients: dict,
+    timeout: float,
+    interval: float,
+):
+    """
+    Poll every `interval` seconds, for up to `timeout` seconds, until the actions took effect.
+    actions is {(client key, action): [instance, ...]}; each poll is one batched state lookup per client and action.
+    Returns {(client key, instance id): state} of the instances still unconfirmed.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        unconfirmed = dict()
+        for (client_key, action), instances in actions.items():
+            for instance_id, state in clients[client_key].unconfirmed(action, instances).items():
+                unconfirmed[(client_key, instance_id)] = state
+        actions = {
+            (client_key, action): [instance for instance in instances if (client_key, instance.id) in unconfirmed]
+            for (client_key, action), instances in actions.items()
+        }
+        if not unconfirmed or time.monotonic() + interval > deadline:
+            return unconfirmed
+        time.sleep(interval)
+
+
+def actuate(
+    records: list,
+    journal=None,
+    confirmation: dict = None,
+    idle_check: dict = None,
+    state_store=None,
+):
+    """
+    Pipeline stage: perform actions, then tag updates, for a batch of decision records
+    Records are grouped per client (i.e. per region and type) and action, so clients can use multi-resource calls
+    With a journal, the batch's intents are written (one fsync) before anything is changed.
+    With a confirmation config ({"timeout_seconds", "interval_seconds"}), the instances actioned are polled until
+    their state shows the action took effect; those that don't in time count as failed actions.
+    With an idle check config, actions on instances whose recent metrics show they are in use are deferred to a later
+    run (the record's "busy" is the reason), and nothing else is done to them.
+    With a StateStore, the records' resources (as they now are) and decisions are stored.
+    """
+    if journal:
+        for record in records:
+            if record["action"] or record["updated_tags"] or record["messages"]:
+                journal.intent(
+                    record["journal_id"],
+                    unit=record["unit"],
+                    instance=record["instance"],
+                    action=record["action"],
+                    updated_tags=record["updated_tags"],
+                    messages=journal_messages(record),
+                )
+        journal.sync()
+
+    # Clients that capture errors per instance report failures, which are kept in the record's "errors"
+    # ({"action" | "tags": error message}); tags of an instance whose action failed aren't written
+    actions = dict()
+    clients = dict()
+    by_instance = dict()
+    for record in records:
+        client_key = id(record["aws_client"])
+        clients[client_key] = record["aws_client"]
+        by_instance[(client_key, record["instance"].id)] = record
+        record["errors"] = dict()
+        if record["action"]:
+            actions.setdefault((client_key, record["action"]), list()).append(record["instance"])
+
+    if idle_check:
+        for (client_key, action), instances in actions.items():
+            if action not in clients[client_key].IDLE_METRICS:
+                continue
+            with METRICS.timer("idle_checks", items=len(instances), region=instances[0].region, type=instances[0].type, action=action):
+                busy = clients[client_key].busy(action, instances, idle_check)
+            for instance_id, reason in busy.items():
+                by_instance[(client_key, instance_id)]["busy"] = reason
+            actions[(client_key, action)] = [instance for instance in instances if instance.id not in busy]
+        actions = {key: instances for key, instances in actions.items() if instances}
+
+    for (client_key, action), instances in actions.items():
+        with METRICS.timer("actions", items=len(instances), region=instances[0].region, type=instances[0].type, action=action):
+            failed = clients[client_key].do_actions(action, instances) or dict()
+        for instance_id, error in failed.items():
+            by_instance[(client_key, instance_id)]["errors"]["action"] = error
+
+    if confirmation and actions:
+        actioned = {
+            (client_key, action): [instance for instance in instances if "action" not in by_instance[(client_key, instance.id)]["errors"]]
+            for (client_key, action), instances in actions.items()
+        }
+        with METRICS.timer("confirmations", items=sum(len(instances) for instances in actioned.values())):
+            unconfirmed = confirm_actions(
+                actioned,
+                clients,
+                timeout=confirmation.get("timeout_seconds", 300),
+                interval=confirmation.get("interval_seconds", 15),
+            )
+        for (client_key, action), instances in actioned.items():
+            for instance in instances:
+                record = by_instance[(client_key, instance.id)]
+                if (client_key, instance.id) in unconfirmed:
+                    record["errors"]["action"] = "{} not confirmed, state is {}".format(
+                        action,
+                        unconfirmed[(client_key, instance.id)] or "not found",
+                    )
+                elif action in clients[client_key].CONFIRMED_STATES:
+                    record["confirmed"] = True
+
+    tag_updates = dict()
+    for (client_key, instance_id), record in by_instance.items():
+        if len(record["updated_tags"]) > 0 and "action" not in record["errors"] and not record.get("busy"):
+            tag_updates.setdefault(client_key, list()).append((record["instance"], record["updated_tags"]))
+
+    for client_key, items in tag_updates.items():
+        with METRICS.timer("tag_writes", items=len(items), region=items[0][0].region, type=items[0][0].type):
+            failed = clients[client_key].update_tags_batch(items) or dict()
+        for instance_id, error in failed.items():
+            by_instance[(client_key, instance_id)]["errors"]["tags"] = error
+
+    if journal:
+        for record in records:
+            if record.get("busy"):
+                # Deferred to a later run, which decides again: nothing to redo on resume
+                for part in ["action", "tags"] + ["message:{}".format(n) for n in range(len(record["messages"]))]:
+                    journal.done(record["journal_id"], part)
+                continue
+            if record["action"] and "action" not in record["errors"]:
+                journal.done(record["journal_id"], "action")
+            if record["updated_tags"] and "action" not in record["errors"] and "tags" not in record["errors"]:
+                journal.done(record["journal_id"], "tags")
+
+    if state_store:
+        state_store.observe(records)
+
+    return records
+
+
+def plan_records(
+    records: list,
+    plan,
+):
+    """
+    Pipeline stage replacing actuation while planning: write the records' intents to the plan, change nothing
+    """
+    for record in records:
+        if record["action"] or record["updated_tags"] or record["messages"]:
+            plan.add(record, messages=journal_messages(record))
+    return records
+
+
+def report_errors(
+    record: dict,
+    slack_client,
+    run_summary: RunSummary,
+    send: bool = True,
+):
+    """
+    Count and report the parts of a decision record that failed during actuation. Returns its errors.
+    """
+    errors = record.get("errors") or dict()
+    if errors:
+        run_summary.add_errors(errors)
+        error_text = "{}Failed to update {type} instance {id} in region {region}: {}".format(
+            account_label(record["instance"].account),
+            "; ".join("{} {}".format(part, error) for part, error in errors.items()),
+            **record["instance"],
+        )
+        logging.warning(error_text)
+        if send:
+            slack_client.send_text(error_text, log=True)
+    return errors
+
+
+def report_busy(
+    record: dict,
+    slack_client,
+    run_summary: RunSummary,
+    dry_run: bool,
+    send: bool = True,
+):
+    """
+    Count and report a decision record whose action was deferred because the instance is in use. Returns True if it was.
+    """
+    if not record.get("busy"):
+        return False
+    run_summary.add_result(Result.DEFER_BUSY)
+    busy_text = "{}{}Deferred {} of {type} instance {id} in region {region}: {}".format(
+        "[DRY RUN] " if dry_run else "",
+        account_label(record["instance"].account),
+        record["action"],
+        record["busy"],
+        **record["instance"],
+    )
+    logging.info(busy_text)
+    if send:
+        slack_client.send_text(busy_text, log=True)
+    return True
+
+
+def notify(
+    record: dict,
+    slack_client,
+    run_summary: RunSummary,
+    dry_run: bool,
+    journal=None,
+    send: bool = True,
+    state_store=None,
+):
+    """
+    Pipeline stage: log and send the Slack messages of a decision record
+    While planning (send is False) messages are only logged; --apply sends them from the plan.
+    If the record's action failed, its messages are replaced by an error in the log channel; if it was deferred
+    (the instance is busy), by a note in the log channel.
+    """
+    errors = report_errors(record, slack_client, run_summary, send=send)
+    busy = report_busy(record, slack_client, run_summary, dry_run=dry_run, send=send)
+    for n, message in enumerate(record["messages"] if "action" not in errors and not busy else list()):
+        message_details = message["details"]
+        if record.get("confirmed") and message_details["result"] == Result.COMPLETE_ACTION:
+            message_details["confirmed"] = True
+        run_summary.add_result(message_details["result"])
+
+        # detailed_log.append(message_details)
+        log_item(message_details)
+        if not send:
+            continue
+
+        # With a delivery ledger, messages already sent for this instance and result today are skipped
+        dedupe = (message_details["id"], message_details["result"])
+        slack_client.send_text(
+            slack_text(message_details, dry_run),
+            log=message["log"],
+            dedupe=dedupe,
+        )
+
+        if message["dm"] and message_details["email"] and not dry_run:
+            slack_client.send_dm(
+                email = message_details["email"],
+                text = message_details["message"],
+                dedupe=dedupe,
+            )
+
+        if state_store:
+            state_store.notified(
+                message_details["id"],
+                message_details["result"],
+                email=message_details["email"],
+                dm=bool(message["dm"] and message_details["email"] and not dry_run),
+            )
+
+        if journal:
+            journal.done(record["journal_id"], "message:{}".format(n))
+
+    if run_summary.add_processed(record["unit_key"]) and journal:
+        journal.unit_done(record["unit_key"])
+
+
+def intent_unit(
+    intent: dict,
+    accounts_by_id: dict,
+    instances_config: dict = None,
+):
+    """
+    Work unit of a journal (or plan) intent
+    """
+    return {
+        "key": intent["unit"],
+        "account": accounts_by_id.get(intent["account"]["id"], intent["account"]),
+        "region": intent["region"],
+        "instance_type": intent["instance_type"],
+        "type_config": (instances_config or dict()).get(intent["instance_type"]),
+    }
+
+
+def intent_client(
+    intent: dict,
+    accounts_by_id: dict,
+    session_cache,
+    aws_clients: dict,
+    dry_run: bool,
+    notify_messages_config: dict,
+    email_tags_config: list,
+    instances_config: dict = None,
+):
+    """
+    AWS client of the work unit of a journal (or plan) intent
+    """
+    return unit_client(
+        intent_unit(intent, accounts_by_id, instances_config),
+        session_cache=session_cache,
+        aws_clients=aws_clients,
+        dry_run=dry_run,
+        notify_messages_config=notify_messages_config,
+        email_tags_config=email_tags_config,
+    )
+
+
+def send_intent_messages(
+    intent: dict,
+    slack_client,
+    dry_run: bool = False,
+    journal=None,
+    remaining: list = None,
+    confirmed: bool = False,
+):
+    """
+    Send the Slack messages of a journal (or plan) intent; with `remaining`, only those still pending
+    """
+    for n, message in enumerate(intent["messages"]):
+        if remaining is not None and "message:{}".format(n) not in remaining:
+            continue
+        dedupe = (intent["instance"]["id"], message["result"])
+        slack_client.send_text(
+            "{}{}{}".format(
+                "[DRY RUN] " if dry_run else "",
+                message["text"],
+                " (confirmed)" if confirmed and message["result"] == Result.COMPLETE_ACTION else "",
+            ),
+            log=message["log"],
+            dedupe=dedupe,
+        )
+        if message["dm"] and message["email"] and not dry_run:
+            slack_client.send_dm(email=message["email"], text=message["dm_text"], dedupe=dedupe)
+        if journal:
+            journal.done(intent["id"], "message:{}".format(n))
+
+
+def replay_journal(
+    pending: list,
+    accounts: list,
+    slack_client,
+    session_cache,
+    aws_clients: dict,
+    journal,
+    notify_messages_config: dict,
+    email_tags_config: list,
+    run_summary: RunSummary,
+    instances_config: dict = None,
+):
+    """
+    Finish the intents an interrupted run wrote but didn't complete (--resume), in their original order:
+    action, tag writes, then Slack messages. Only the parts that succeeded are marked done in the journal;
+    failures are reported like those of actuation.
+    """
+    from utils.aws.generic_instance import GenericInstance
+
+    accounts_by_id = {account["id"]: account for account in accounts}
+    for intent in pending:
+        logging.info("Resuming {} for {} instance {} in region {}".format(
+            ", ".join(intent["remaining"]),
+            intent["instance_type"],
+            intent["instance"]["id"],
+            intent["region"],
+        ))
+        instance = GenericInstance(exceptions=list(), tags=dict(), **intent["instance"])
+        errors = dict()
+        if "action" in intent["remaining"] or "tags" in intent["remaining"]:
+            aws_client = intent_client(
+                intent,
+                accounts_by_id=accounts_by_id,
+                session_cache=session_cache,
+                aws_clients=aws_clients,
+                dry_run=False,
+                notify_messages_config=notify_messages_config,
+                email_tags_config=email_tags_config,
+                instances_config=instances_config,
+            )
+            if "action" in intent["remaining"]:
+                failed = aws_client.do_actions(intent["action"], [instance]) or dict()
+                if instance.id in failed:
+                    errors["action"] = failed[instance.id]
+                else:
+                    journal.done(intent["id"], "action")
+            if "tags" in intent["remaining"] and "action" not in errors:
+                failed = aws_client.update_tags_batch([(instance, intent["updated_tags"])]) or dict()
+                if instance.id in failed:
+                    errors["tags"] = failed[instance.id]
+                else:
+                    journal.done(intent["id"], "tags")
+
+        # As in actuate and notify: tags and messages of an instance whose action failed are left pending
+        report_errors({"instance": instance, "errors": errors}, slack_client, run_summary)
+        if "action" not in errors:
+            send_intent_messages(intent, slack_client, journal=journal, remaining=intent["remaining"])
+    journal.sync()
+
+
+def verify_planned(
+    unit_intents: list,
+    accounts_by_id: dict,
+    session_cache,
+    aws_clients: dict,
+    dry_run: bool,
+    notify_messages_config: dict,
+    email_tags_config: list,
+    stale: list,
+    instances_config: dict = None,
+):
+    """
+    Pipeline stage of --apply: look up the current tags of one work unit's planned instances (batched),
+    and yield a decision record for each whose tags are unchanged since planning.
+    Intents of changed or deleted instances are added to `stale` and not applied.
+    """
+    from utils.aws.generic_instance import GenericInstance
+    from utils.plan import tags_fingerprint
+
+    aws_client = intent_client(
+        unit_intents[0],
+        accounts_by_id=accounts_by_id,
+        session_cache=session_cache,
+        aws_clients=aws_clients,
+        dry_run=dry_run,
+        notify_messages_config=notify_messages_config,
+        email_tags_config=email_tags_config,
+        instances_config=instances_config,
+    )
+    instances = [GenericInstance(exceptions=list(), tags=dict(), **intent["instance"]) for intent in unit_intents]
+    with METRICS.timer("plan_verification", items=len(instances), type=unit_intents[0]["instance_type"]):
+        # Compared with the tags discovery saw when planning
+        current_tags = aws_client.get_tags(
+            instances,
+            (((instances_config or dict()).get(unit_intents[0]["instance_type"]) or dict()).get("config") or dict()),
+        )
+    if current_tags is None:
+        logging.warning("Can't check the tags of {} instances in region {}, applying their plan as is".format(
+            unit_intents[0]["instance_type"],
+            unit_intents[0]["region"],
+        ))
+
+    for intent, instance in zip(unit_intents, instances):
+        if current_tags is not None:
+            if instance.id not in current_tags:
+                logging.info("Not applying plan of {type} instance {id} in region {region}: no longer exists".format(**instance))
+                stale.append(intent["id"])
+                continue
+            if tags_fingerprint(current_tags[instance.id]) != intent["fingerprint"]:
+                logging.info("Not applying plan of {type} instance {id} in region {region}: tags changed since planning".format(**instance))
+                stale.append(intent["id"])
+                continue
+            instance.tags = current_tags[instance.id]
+        yield {
+            "instance": instance,
+            "action": intent["action"],
+            "updated_tags": intent["updated_tags"],
+            "intent": intent,
+            "unit": intent_unit(intent, accounts_by_id, instances_config),
+            "aws_client": aws_client,
+        }
+
+
+def get_slack_client(
+    slack_config: dict,
+    cache: dict,
+):
+    """
+    Reuse the Slack client (token from Secrets Manager, user lookups) across runs unless its config changed
+    """
+    from utils.slack_client import SlackClient
+
+    cached = cache.get("slack")
+    if cached is None or cached[0] != slack_config:
+        cache["slack"] = (slack_config, SlackClient(slack_config))
+    return cache["slack"][1]
+
+
+def run(
+    config: dict,
+    run_date: datetime.date = None,
+    dry_run: bool = False,
+    regions: list = None,
+    shard: tuple = None,
+    lease_dir: str = None,
+    summary_file: str = None,
+    cache: dict = None,
+    should_stop=None,
+    skip_units: list = None,
+    journal_file: str = None,
+    resume: bool = False,
+    ledger_file: str = None,
+    plan_file: str = None,
+    prioritise: bool = False,
+    deadline: datetime.datetime = None,
+    state_store_file: str = None,
+    on_unit_completed=None,
+):
+    """
+    Run the cleaner once. Returns the RunSummary.
+    - config (dict): parsed YAML configuration
+    - run_date (datetime.date): evaluation date (default is today)
+    - regions (list): overrides global.regions
+    - shard (tuple): (K, N), only process shard K of N
+    - lease_dir (str): overrides global.lease_dir
+    - summary_file (str): write the run summary (JSON) to this file
+    - cache (dict): clients kept between runs (Slack client, assumed-role sessions, AWS clients); pass the same dict to reuse them
+    - should_stop (callable): checked between work units and describe pages, and before each actuation batch and
+      notification; once it returns True no new work is started, and instances already queued are left for the next run
+    - skip_units (list): work unit keys to skip (e.g. completed_units of an earlier, interrupted run)
+    - journal_file (str): overrides global.journal_file, the write-ahead journal of mutations (not used in dry runs)
+    - resume (bool): finish what the journal's interrupted run of the same run date left pending, and skip what it completed
+    - ledger_file (str): overrides global.slack_ledger_file, the Slack messages delivered so far (not used in dry runs)
+    - plan_file (str): only discover and decide, writing every tag write, action and message to this plan (see apply_plan)
+    - prioritise (bool): overrides global.prioritise; decide on every instance first, then act on and notify them
+      most urgent first across all work units (due actions, then notifications, then the rest)
+    - deadline (datetime.datetime): implies prioritise; no instance is acted on or notified after it, only summaries are sent
+    - state_store_file (str): overrides global.state_store_file, the SQLite store of resources, decisions and notifications
+      (not used in dry runs)
+    - on_unit_completed (function): called with the key of each work unit as soon as it is completed
+    """
+    if cache is None:
+        cache = dict()
+    # The ledger file is rewritten, and the state store written, by this run: polls between runs reopen them after it
+    close_events_cache(cache)
+
+    slack_config = config.get("slack", dict())
+    global_config = config.get("global", dict()) or dict()
+    instances_config = config.get("instances", dict())
+    tags_config = config.get("tags", dict())
+    notify_messages_config = config.get("notify_messages", dict())
+    email_tags_config = config.get("email_tags", list())
+    pipeline_config = PIPELINE_DEFAULTS | (global_config.get("pipeline") or dict())
+    accounts_config = config.get("accounts") or dict()
+
+    metrics_config = global_config.get("metrics") or dict()
+
+    d_today = datetime.date.today()
+    d_run_date = run_date or d_today
+    regions = regions or global_config.get("regions", list())
+
+    METRICS.reset()
+    run_start = time.perf_counter()
+
+    slack_client = get_slack_client(slack_config, cache)
+    plan = None
+    if plan_file:
+        from utils.plan import Plan
+
+        plan = Plan(plan_file, str(d_run_date))
+    ledger_file = ledger_file or global_config.get("slack_ledger_file")
+    if ledger_file and not dry_run and not plan:
+        from utils.ledger import DeliveryLedger
+
+        slack_client.ledger = DeliveryLedger(
+            ledger_file,
+            d_run_date,
+            retention_days=global_config.get("slack_ledger_retention_days", 7),
+        )
+
+    state_store = open_state_store(global_config, d_run_date, state_store_file) if not dry_run and not plan else None
+
+    run_summary = RunSummary(
+        run_date=d_run_date,
+        dry_run=dry_run,
+        shard="{}/{}".format(*shard) if shard else None,
+        on_unit_completed=on_unit_completed,
+    )
+    lease_dir = lease_dir or global_config.get("lease_dir")
+    lease_manager = LeaseManager(lease_dir, ttl=global_config.get("lease_ttl_seconds", LEASE_TTL_SECONDS)) if lease_dir else None
+
+    journal_file = journal_file or global_config.get("journal_file")
+    journal = None
+    journal_state = {"resumable": False, "completed_units": list(), "completed": set(), "pending": list()}
+    if journal_file and not dry_run and not plan:
+        from utils.journal import Journal, load_journal
+
+        if resume:
+            journal_state = load_journal(journal_file, str(d_run_date))
+        journal = Journal(journal_file, str(d_run_date), resume=journal_state["resumable"])
+        skip_units = list(skip_units or list()) + journal_state["completed_units"]
+
+    # We won't send most stuff to Slack, but use this to validate that connection is okay and indicate the script is starting
+    start_text = (
+        "Running cleaner on {}".format(d_run_date)
+        if d_run_date == d_today
+        else "Running cleaner on simulated run date of {}".format(d_run_date)
+    )
+    if shard:
+        start_text += " (shard {}/{})".format(*shard)
+    if plan:
+        start_text += " (planning only)"
+    slack_client.dlog_and_send_text(start_text)
+
+    from utils.aws.aws_client import AWSClient
+    from utils.aws.accounts import SessionCache, get_accounts
+    from utils.aws.throttle import THROTTLES
+    from utils.aws.api_calls import API_CALLS
+
+    THROTTLES.configure(global_config.get("throttle"))
+    API_CALLS.configure(
+        budget=global_config.get("api_call_budget"),
+        headroom=global_config.get("api_call_budget_headroom"),
+    )
+    API_CALLS.reset()
+    caller_should_stop = should_stop
+
+    def should_stop():
+        # Stop starting new work when the caller asks (e.g. Lambda deadline), the run's deadline has passed,
+        # or the API call budget is nearly used
+        return (
+            bool(caller_should_stop and caller_should_stop())
+            or bool(deadline and datetime.datetime.now() >= deadline)
+            or API_CALLS.should_stop()
+        )
+
+    # Assumed-role sessions are shared by every client of an account, and only refreshed before they expire
+    if cache.get("session_cache") is None:
+        cache["session_cache"] = SessionCache(
+            session_name=accounts_config.get("session_name", "aws-cleaner"),
+            external_id=accounts_config.get("external_id"),
+        )
+    session_cache = cache["session_cache"]
+    aws_clients = cache.setdefault("aws_clients", dict())
+    for aws_client in aws_clients.values():
+        aws_client.reset()
+
+    accounts = get_accounts(accounts_config, session_cache)
+    if accounts_config:
+        slack_client.dlog_and_send_text("Using accounts: {}".format(", ".join([account["name"] for account in accounts])))
+
+    if journal_state["pending"]:
+        slack_client.dlog_and_send_text("Resuming {} instances left pending by the interrupted run".format(len(journal_state["pending"])))
+        replay_journal(
+            journal_state["pending"],
+            accounts=accounts,
+            slack_client=slack_client,
+            session_cache=session_cache,
+            aws_clients=aws_clients,
+            journal=journal,
+            notify_messages_config=notify_messages_config,
+            email_tags_config=email_tags_config,
+            run_summary=run_summary,
+            instances_config=instances_config,
+        )
+        journal_state["completed"] |= {intent["id"] for intent in journal_state["pending"]}
+
+    if regions:
+        # use test region filter
+        logging.info("Using regions provided in global.regions")
+
+    # Work units: one per account, region and (enabled) instance type
+    # Instance type is EC2, RDS, etc.
+    units = list()
+    for account in accounts:
+        account_regions = regions
+        if not account_regions:
+            aws_client = AWSClient("us-east-1", session=session_cache.get_session(account["role_arn"]))
+            with METRICS.timer("region_discovery"):
+                account_regions = aws_client.get_regions()
+
+        slack_client.dlog_and_send_text("{}Using regions: {}".format(account_label(account["name"]), ", ".join(account_regions)))
+
+        for region in account_regions:
+            for instance_type, type_config in instances_config.items():
+                if type_config.get("enabled"):
+                    key = unit_key(account["id"], region, instance_type)
+                    if not in_shard(key, shard):
+                        continue
+                    if skip_units and key in skip_units:
+                        logging.info("Skipping already completed work unit {}".format(key))
+                        continue
+                    units.append(
+                        {
+                            "key": key,
+                            "account": account,
+                            "region": region,
+                            "instance_type": instance_type,
+                            "type_config": type_config,
+                        }
+                    )
+                else:
+                    logging.info("Skipping {} instances in region {}".format(instance_type, region))
+
+    slack_client.dlog_and_send_text("Processing {} ({} work units)".format(
+        ", ".join([instance_type for instance_type, type_config in instances_config.items() if type_config.get("enabled")]),
+        len(units),
+        ))
+
+    # discovery -> decision -> actuation -> notification, connected by bounded queues
+    # Levelling action dates needs every scheduled date before the first decision, so a first pass lists every
+    # unit only to count them (twice the describe calls, but no page is kept). Prioritised, the decision stage
+    # collects every record (memory grows with the fleet), and the most urgent are fed to actuation -> notification
+    # first.
+    prioritise = prioritise or bool(deadline) or global_config.get("prioritise", False)
+    levelling_config = global_config.get("action_levelling") or dict()
+    leveller = None
+    if levelling_config.get("daily_budget"):
+        from utils.levelling import ActionLeveller
+
+        leveller = ActionLeveller(
+            daily_budget=levelling_config["daily_budget"],
+            window_days=levelling_config.get("window_days", 14),
+        )
+    # Nothing changes in dry run mode (or while planning), so there's nothing to confirm
+    confirmation = None if dry_run or plan else global_config.get("action_confirmation")
+    decided = list()
+    counting_pipeline = Pipeline(queue_size=pipeline_config["queue_size"])
+    pipeline = Pipeline(queue_size=pipeline_config["queue_size"])
+    actuation_pipeline = Pipeline(queue_size=pipeline_config["queue_size"]) if prioritise else pipeline
+
+    counting_pipeline.add_stage(
+        "counting",
+        lambda unit: count_action_dates(
+            unit,
+            session_cache=session_cache,
+            aws_clients=aws_clients,
+            dry_run=dry_run or bool(plan),
+            notify_messages_config=notify_messages_config,
+            email_tags_config=email_tags_config,
+            leveller=leveller,
+            should_stop=should_stop,
+        ),
+        workers=pipeline_config["discovery_workers"],
+    )
+
+    def discovery(unit):
+        return discover(
+            unit,
+            slack_client=slack_client,
+            session_cache=session_cache,
+            aws_clients=aws_clients,
+            run_summary=run_summary,
+            lease_manager=lease_manager,
+            sharded=bool(shard),
+            # Planning changes nothing
+            dry_run=dry_run or bool(plan),
+            notify_messages_config=notify_messages_config,
+            email_tags_config=email_tags_config,
+            should_stop=should_stop,
+            journal=journal,
+        )
+
+    def decision(page):
+        records = decide(
+            page,
+            notify_messages_config=notify_messages_config,
+            d_run_date=d_run_date,
+            completed=journal_state["completed"],
+            leveller=leveller,
+        )
+        if not prioritise:
+            return records
+        decided.extend(records)
+
+    pipeline.add_stage(
+        "discovery",
+        discovery,
+        workers=pipeline_config["discovery_workers"],
+    )
+    pipeline.add_stage(
+        "decision",
+        decision,
+        workers=pipeline_config["decision_workers"],
+    )
+    def actuation(records):
+        if should_stop():
+            # Records already queued aren't drained once the run has to stop: their units stay incomplete (so they
+            # aren't checkpointed) and are processed again by the next run
+            run_summary.add_deferred(len(records))
+            return
+        if plan:
+            return plan_records(records, plan=plan)
+        return actuate(
+            records,
+            journal=journal,
+            confirmation=confirmation,
+            idle_check=global_config.get("idle_check"),
+            state_store=state_store,
+        )
+
+    def notification(record):
+        if should_stop():
+            # Already acted on: with a journal, its messages stay pending and are sent when the run is resumed
+            run_summary.add_deferred()
+            return
+        notify(
+            record,
+            slack_client=slack_client,
+            run_summary=run_summary,
+            dry_run=dry_run,
+            journal=journal,
+            send=not plan,
+            state_store=state_store,
+        )
+
+    actuation_pipeline.add_stage(
+        "actuation",
+        actuation,
+        workers=pipeline_config["actuation_workers"],
+        batch_size=pipeline_config["actuation_batch_size"],
+    )
+    actuation_pipeline.add_stage(
+        "notification",
+        notification,
+        workers=pipeline_config["notification_workers"],
+    )
+    try:
+        with METRICS.timer("pipeline", items=len(units)):
+            if leveller:
+                with METRICS.timer("action_date_counts", items=len(units)):
+                    counting_pipeline.run(units, should_stop=should_stop)
+            pipeline.run(units, should_stop=should_stop)
+            if prioritise:
+                decided.sort(key=urgency)
+                processed = actuation_pipeline.run(decided, should_stop=should_stop)
+                if processed < len(decided):
+                    deferred = decided[processed:]
+                    run_summary.add_deferred(len(deferred))
+                    slack_client.dlog_and_send_text(
+                        "Stopped before processing {} instances ({} with a due action, {} with a notification)".format(
+                            len(deferred),
+                            len([record for record in deferred if urgency(record) == 0]),
+                            len([record for record in deferred if urgency(record) == 1]),
+                        )
+                    )
+    finally:
+        if lease_manager:
+            lease_manager.release_all()
+        if journal:
+            journal.close()
+        if plan:
+            plan.close()
+            logging.info("Plan written to {}".format(plan_file))
+        if state_store:
+            state_store.close()
+        if leveller and leveller.levelled:
+            logging.info("{} new action dates were moved later to stay under {} actions a day".format(
+                leveller.levelled,
+                leveller.daily_budget,
+            ))
+        if slack_client.ledger:
+            if slack_client.ledger.skipped:
+                logging.info("{} Slack messages already delivered today were not sent again".format(slack_client.ledger.skipped))
+            slack_client.ledger.close()
+            slack_client.ledger = None
+
+    run_summary.finish()
+    METRICS.observe("run", time.perf_counter() - run_start)
+    run_summary.data["metrics"] = METRICS.to_dict()
+    run_summary.data["api_calls"] = API_CALLS.to_dict()
+    API_CALLS.log_report()
+    METRICS.write(
+        prometheus_file=metrics_config.get("prometheus_file"),
+        json_file=metrics_config.get("json_file"),
+    )
+    if summary_file:
+        run_summary.save(summary_file)
+    if shard:
+        logging.info(run_summary.results_line())
+    else:
+        slack_client.dlog_and_send_text(run_summary.results_line())
+        slack_client.dlog_and_send_text(API_CALLS.totals_line())
+
+    # We won't send most stuff to Slack, but use this to validate that connection is okay and indicate the script is starting
+    end_text = (
+        "Finished running cleaner on {}".format(d_run_date)
+        if d_run_date == d_today
+        else "Finished running cleaner on simulated run date of {}".format(d_run_date)
+    )
+    slack_client.dlog_and_send_text(end_text)
+
+    return run_summary
+
+
+def apply_plan(
+    config: dict,
+    plan_file: str,
+    dry_run: bool = False,
+    summary_file: str = None,
+    ledger_file: str = None,
+    cache: dict = None,
+    state_store_file: str = None,
+):
+    """
+    Apply a plan written by run(plan_file=...), without discovering again. Returns the RunSummary.
+    Per work unit, the planned instances' current tags are looked up in batches; instances whose tags changed
+    since planning (or which were deleted) are left alone. The rest go through the actuation stage (batched,
+    multi-resource calls) and then the notification stage.
+    """
+    from utils.plan import load_plan
+    from utils.aws.accounts import SessionCache, get_accounts
+    from utils.aws.throttle import THROTTLES
+    from utils.aws.api_calls import API_CALLS
+
+    if cache is None:
+        cache = dict()
+
+    global_config = config.get("global", dict()) or dict()
+    accounts_config = config.get("accounts") or dict()
+    notify_messages_config = config.get("notify_messages", dict())
+    email_tags_config = config.get("email_tags", list())
+    pipeline_config = PIPELINE_DEFAULTS | (global_config.get("pipeline") or dict())
+
+    run_date, intents = load_plan(plan_file)
+    run_summary = RunSummary(run_date=run_date, dry_run=dry_run)
+    METRICS.reset()
+
+    slack_client = get_slack_client(config.get("slack", dict()), cache)
+    ledger_file = ledger_file or global_config.get("slack_ledger_file")
+    if ledger_file and not dry_run:
+        from utils.ledger import DeliveryLedger
+
+        slack_client.ledger = DeliveryLedger(
+            ledger_file,
+            datetime.date.fromisoformat(run_date),
+            retention_days=global_config.get("slack_ledger_retention_days", 7),
+        )
+    slack_client.dlog_and_send_text("Applying plan of cleaner run on {} ({} instances)".format(run_date, len(intents)))
+
+    THROTTLES.configure(global_config.get("throttle"))
+    API_CALLS.configure(
+        budget=global_config.get("api_call_budget"),
+        headroom=global_config.get("api_call_budget_headroom"),
+    )
+    API_CALLS.reset()
+    if cache.get("session_cache") is None:
+        cache["session_cache"] = SessionCache(
+            session_name=accounts_config.get("session_name", "aws-cleaner"),
+            external_id=accounts_config.get("external_id"),
+        )
+    session_cache = cache["session_cache"]
+    aws_clients = cache.setdefault("aws_clients", dict())
+    for aws_client in aws_clients.values():
+        aws_client.reset()
+    accounts_by_id = {account["id"]: account for account in get_accounts(accounts_config, session_cache)}
+
+    # One verification item per work unit, so tag lookups are batched
+    units = dict()
+    for intent in intents:
+        units.setdefault(intent["unit"], list()).append(intent)
+
+    def notify_planned(record):
+        if "action" in report_errors(record, slack_client, run_summary):
+            return
+        if report_busy(record, slack_client, run_summary, dry_run=dry_run):
+            return
+        for message in record["intent"]["messages"]:
+            run_summary.add_result(message["result"])
+        send_intent_messages(record["intent"], slack_client, dry_run=dry_run, confirmed=record.get("confirmed", False))
+        if state_store:
+            for message in record["intent"]["messages"]:
+                state_store.notified(
+                    record["instance"].id,
+                    message["result"],
+                    email=message["email"],
+                    dm=bool(message["dm"] and message["email"]),
+                )
+
+    # Nothing changes in dry run mode, so there's nothing to confirm (or store)
+    confirmation = None if dry_run else global_config.get("action_confirmation")
+    state_store = None if dry_run else open_state_store(global_config, datetime.date.fromisoformat(run_date), state_store_file)
+    stale = list()
+    pipeline = Pipeline(queue_size=pipeline_config["queue_size"])
+    pipeline.add_stage(
+        "verification",
+        lambda unit_intents: verify_planned(
+            unit_intents,
+            accounts_by_id=accounts_by_id,
+            session_cache=session_cache,
+            aws_clients=aws_clients,
+            dry_run=dry_run,
+            notify_messages_config=notify_messages_config,
+            email_tags_config=email_tags_config,
+            stale=stale,
+            instances_config=config.get("instances", dict()),
+        ),
+        workers=pipeline_config["discovery_workers"],
+    )
+    pipeline.add_stage(
+        "actuation",
+        lambda records: actuate(
+            records,
+            confirmation=confirmation,
+            idle_check=global_config.get("idle_check"),
+            state_store=state_store,
+        ),
+        workers=pipeline_config["actuation_workers"],
+        batch_size=pipeline_config["actuation_batch_size"],
+    )
+    pipeline.add_stage(
+        "notification",
+        notify_planned,
+        workers=pipeline_config["notification_workers"],
+    )
+    try:
+        with METRICS.timer("pipeline", items=len(units)):
+            pipeline.run(units.values(), should_stop=API_CALLS.should_stop)
+    finally:
+        if slack_client.ledger:
+            slack_client.ledger.close()
+            slack_client.ledger = None
+        if state_store:
+            state_store.close()
+
+    run_summary.finish()
+    run_summary.data["plan"] = {"file": plan_file, "instances": len(intents), "stale": len(stale)}
+    run_summary.data["metrics"] = METRICS.to_dict()
+    run_summary.data["api_calls"] = API_CALLS.to_dict()
+    API_CALLS.log_report()
+    if summary_file:
+        run_summary.save(summary_file)
+    if stale:
+        slack_client.dlog_and_send_text("Not applied: {} instances changed or deleted since planning".format(len(stale)))
+    slack_client.dlog_and_send_text(run_summary.results_line())
+    slack_client.dlog_and_send_text("Finished applying plan of cleaner run on {}".format(run_date))
+    return run_summary
+
+
+def close_events_cache(
+    cache: dict,
+):
+    """
+    Close the delivery ledger and state store that process_events keeps open between polls (in cache["events"])
+    """
+    events_cache = cache.pop("events", None)
+    if events_cache is None:
+        return
+    if events_cache["state_store"]:
+        events_cache["state_store"].close()
+    if events_cache["ledger"]:
+        events_cache["ledger"].close()
+
+
+def process_events(
+    config: dict,
+    event_source: str,
+    run_date: datetime.date = None,
+    dry_run: bool = False,
+    regions: list = None,
+    cache: dict = None,
+    should_stop=None,
+    state_store_file: str = None,
+    ledger_file: str = None,
+):
+    """
+    Incremental run: decide on, act on and notify only the instances named by queued state-change and tagging events
+    (see utils.events), until the queue is empty. Returns the RunSummary.
+    Events are taken EVENTS_PER_BATCH at a time; each batch costs one describe call per work unit it touches, then
+    the usual (batched) tag writes and actions. Messages are deleted from the queue once processed (not in dry runs).
+    Full runs are still needed to move action dates along; this only keeps new and changed instances up to date in between.
+    Tag writes of the cleaner itself are ignored: those changing only aws_cleaner/* tags, and those made by the roles it
+    assumes (accounts.session_name) or by global.events_ignored_principals. With a delivery ledger, the messages the
+    events of its own actions would repeat aren't sent again.
+    - regions (list): overrides global.regions, events of other regions are ignored
+    - cache (dict): as for run(); polls passing the same dict (e.g. the daemon's) also keep the accounts, delivery ledger,
+      state store (until the run date changes or run() closes them) and event queue
+    In dry runs messages aren't deleted: a file queue only moves past them in memory (for as long as the queue is
+    cached), an SQS queue hands them out again once their visibility timeout has expired.
+    """
+    from utils.events import EVENTS_PER_BATCH, open_event_queue, receive_events
+    from utils.aws.accounts import SessionCache, get_accounts
+    from utils.aws.throttle import THROTTLES
+    from utils.aws.api_calls import API_CALLS
+
+    keep_open = cache is not None
+    if cache is None:
+        cache = dict()
+
+    global_config = config.get("global", dict()) or dict()
+    instances_config = config.get("instances", dict())
+    accounts_config = config.get("accounts") or dict()
+    notify_messages_config = config.get("notify_messages", dict())
+    email_tags_config = config.get("email_tags", list())
+    regions = regions or global_config.get("regions")
+    d_run_date = run_date or datetime.date.today()
+    run_summary = RunSummary(run_date=d_run_date, dry_run=dry_run)
+    run_summary.data["events"] = 0
+
+    slack_client = get_slack_client(config.get("slack", dict()), cache)
+    ledger_file = ledger_file or global_config.get("slack_ledger_file")
+    state_store_file = state_store_file or global_config.get("state_store_file")
+    THROTTLES.configure(global_config.get("throttle"))
+    API_CALLS.configure(
+        budget=global_config.get("api_call_budget"),
+        headroom=global_config.get("api_call_budget_headroom"),
+    )
+    API_CALLS.reset()
+    if cache.get("session_cache") is None:
+        cache["session_cache"] = SessionCache(
+            session_name=accounts_config.get("session_name", "aws-cleaner"),
+            external_id=accounts_config.get("external_id"),
+        )
+    session_cache = cache["session_cache"]
+    aws_clients = cache.setdefault("aws_clients", dict())
+    for aws_client in aws_clients.values():
+        aws_client.reset()
+
+    events_key = (str(d_run_date), dry_run, ledger_file, state_store_file, accounts_config)
+    events_cache = cache.get("events")
+    if events_cache is None or events_cache["key"] != events_key:
+        close_events_cache(cache)
+        ledger = None
+        if ledger_file and not dry_run:
+            from utils.ledger import DeliveryLedger
+
+            ledger = DeliveryLedger(
+                ledger_file,
+                d_run_date,
+                retention_days=global_config.get("slack_ledger_retention_days", 7),
+            )
+        events_cache = cache["events"] = {
+            "key": events_key,
+            # Without an accounts config, the single account (ID None) takes events of any account
+            "accounts_by_id": {account["id"]: account for account in get_accounts(accounts_config, session_cache)},
+            "ledger": ledger,
+            "state_store": None if dry_run else open_state_store(global_config, d_run_date, state_store_file),
+        }
+    accounts_by_id = events_cache["accounts_by_id"]
+    state_store = events_cache["state_store"]
+    slack_client.ledger = events_cache["ledger"]
+    skipped = slack_client.ledger.skipped if slack_client.ledger else 0
+
+    queue_key = (event_source, global_config.get("events_wait_seconds", 0))
+    if cache.get("event_queue") is None or cache["event_queue"][0] != queue_key:
+        cache["event_queue"] = (
+            queue_key,
+            open_event_queue(
+                event_source,
+                session=session_cache.default_session,
+                wait_seconds=global_config.get("events_wait_seconds", 0),
+            ),
+        )
+    queue = cache["event_queue"][1]
+    ignored_principals = list(global_config.get("events_ignored_principals") or list())
+    if accounts_config:
+        ignored_principals.append("arn:aws:sts::*:assumed-role/*/{}".format(accounts_config.get("session_name", "aws-cleaner")))
+
+    try:
+        while not (should_stop and should_stop()) and not API_CALLS.should_stop():
+            handles, refs = receive_events(queue, EVENTS_PER_BATCH, ignored_principals=ignored_principals)
+            if not handles:
+                break
+
+            # Instance IDs per work unit, without duplicates (an instance often has several events in a row)
+            units = dict()
+            for ref in refs:
+                account = accounts_by_id.get(ref["account"], accounts_by_id.get(None))
+                type_config = instances_config.get(ref["instance_type"]) or dict()
+                if account is None or not type_config.get("enabled") or (regions and ref["region"] not in regions):
+                    logging.info("Ignoring event about {instance_type} instance {id} in region {region} of account {account}".format(**ref))
+                    continue
+                key = unit_key(account["id"], ref["region"], ref["instance_type"])
+                unit, ids = units.setdefault(
+                    key,
+                    (
+                        {
+                            "key": key,
+                            "account": account,
+                            "region": ref["region"],
+                            "instance_type": ref["instance_type"],
+                            "type_config": type_config,
+                        },
+                        list(),
+                    ),
+                )
+                if ref["id"] not in ids:
+                    ids.append(ref["id"])
+
+            records = list()
+            for unit, ids in units.values():
+                aws_client = unit_client(
+                    unit,
+                    session_cache=session_cache,
+                    aws_clients=aws_clients,
+                    dry_run=dry_run,
+                    notify_messages_config=notify_messages_config,
+                    email_tags_config=email_tags_config,
+                )
+                with METRICS.timer("get_instances", items=len(ids), region=unit["region"], type=unit["instance_type"]):
+                    instances = aws_client.get_instances_by_id(ids, unit["type_config"].get("config") or dict())
+                if instances is None:
+                    logging.warning("Can't look up {} instances by ID, ignoring their events".format(unit["instance_type"]))
+                    continue
+                records += decide(
+                    {"unit": unit, "aws_client": aws_client, "instances": instances},
+                    notify_messages_config=notify_messages_config,
+                    d_run_date=d_run_date,
+                )
+
+            actuate(
+                records,
+                confirmation=None if dry_run else global_config.get("action_confirmation"),
+                idle_check=global_config.get("idle_check"),
+                state_store=state_store,
+            )
+            for record in records:
+                notify(record, slack_client=slack_client, run_summary=run_summary, dry_run=dry_run, state_store=state_store)
+            if not dry_run:
+                queue.delete(handles)
+            run_summary.data["events"] += len(handles)
+    finally:
+        if slack_client.ledger:
+            if slack_client.ledger.skipped > skipped:
+                logging.info("{} Slack messages already delivered today were not sent again".format(slack_client.ledger.skipped - skipped))
+            slack_client.ledger = None
+        if not keep_open:
+            close_events_cache(cache)
+        elif state_store:
+            # Left open for the next poll, but committed so a run in between sees (and isn't blocked by) its writes
+            state_store.commit()
+
+    run_summary.finish()
+    run_summary.data["api_calls"] = API_CALLS.to_dict()
+    if run_summary.data["events"]:
+        logging.info("Processed {} events: {}".format(run_summary.data["events"], run_summary.results_line()))
+    return run_summary
+
+
+def merge_summaries(
+    config: dict,
+    paths: list,
+    summary_file: str = None,
+):
+    """
+    Merge per-shard run summaries and send the combined summary to Slack
+    """
+    from utils.slack_client import SlackClient
+
+    slack_client = SlackClient(config.get("slack", dict()))
+    run_summary = RunSummary.merge([RunSummary.load(path) for path in paths])
+    slack_client.dlog_and_send_text(
+        "Summary of cleaner run on {} ({} shards)".format(
+            run_summary.data["run_date"],
+            len(run_summary.data["shards"]),
+        )
+    )
+    for key in sorted(run_summary.data["units"]):
+        for line in run_summary.unit_lines(key):
+            slack_client.dlog_and_send_text(line)
+    slack_client.dlog_and_send_text(run_summary.results_line())
+    if summary_file:
+        run_summary.save(summary_file)
+    return run_summary
 
 
 ###############
@@ -88,6 +1826,105 @@ if __name__ == "__main__":
         action="append",
         dest="region",
     )
+    parser.add_argument(
+        "--shard",
+        help="Only process shard K of N (e.g. 1/4); work units are split deterministically by account, region and type",
+        type=parse_shard,
+        dest="shard",
+    )
+    parser.add_argument(
+        "--lease-dir",
+        help="Directory for work unit leases, so concurrent shards never act on the same unit (default is global.lease_dir, if set)",
+        type=str,
+        dest="lease_dir",
+    )
+    parser.add_argument(
+        "--summary-file",
+        help="Write the run summary (JSON) to this file",
+        type=str,
+        dest="summary_file",
+    )
+    parser.add_argument(
+        "--merge-summaries",
+        help="Merge run summary files (from --summary-file of each shard), send the combined summary to Slack and exit",
+        nargs="+",
+        dest="merge_summaries",
+    )
+    parser.add_argument(
+        "--daemon",
+        help="Keep running, and run the cleaner on the schedule set in daemon.schedule (the YAML config is reloaded when it changes)",
+        action="store_true",
+        dest="daemon",
+    )
+    parser.add_argument(
+        "--journal",
+        help="Write-ahead journal of the run's tag writes, actions and Slack messages (default is global.journal_file, if set)",
+        type=str,
+        dest="journal",
+    )
+    parser.add_argument(
+        "--resume",
+        help="Resume an interrupted run of the same run date from its journal: finish pending changes, skip completed work",
+        action="store_true",
+        dest="resume",
+    )
+    parser.add_argument(
+        "--slack-ledger",
+        help="Record delivered Slack messages in this file and skip those already delivered today (overrides global.slack_ledger_file)",
+        type=str,
+        dest="slack_ledger",
+    )
+    parser.add_argument(
+        "--prioritise",
+        help="Decide on every instance first, then act on and notify them most urgent first (due actions, notifications, the rest); "
+        "every decision is held in memory until then, so memory grows with the number of instances",
+        action="store_true",
+        dest="prioritise",
+    )
+    parser.add_argument(
+        "--deadline",
+        help="Seconds from the start of a run, or a time of day (HH:MM), after which only summaries are sent; implies --prioritise",
+        type=str,
+        dest="deadline",
+    )
+    parser.add_argument(
+        "--plan",
+        help="Only discover and decide: write every planned tag write, action and Slack message to this file",
+        type=str,
+        dest="plan",
+    )
+    parser.add_argument(
+        "--apply",
+        help="Apply a plan written by --plan (no discovery); instances whose tags changed since planning are skipped",
+        type=str,
+        dest="apply",
+    )
+    parser.add_argument(
+        "--events",
+        help="Process the instances named by the EC2/RDS events queued in this SQS queue URL or local file, then exit; "
+        "with --daemon, between scheduled runs (default is global.events_queue, with --daemon)",
+        type=str,
+        dest="events",
+    )
+    parser.add_argument(
+        "--state-store",
+        help="SQLite store of resources, decisions and Slack notifications, updated by every run (overrides global.state_store_file)",
+        type=str,
+        dest="state_store",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile each run and write the result to this file (pstats, or collapsed stacks with --profile-mode sampling)",
+        type=str,
+        dest="profile",
+    )
+    parser.add_argument(
+        "--profile-mode",
+        help="Profiler used by --profile (default is deterministic)",
+        choices=PROFILE_MODES,
+        default="deterministic",
+        dest="profile_mode",
+    )
     parser.add_argument(
         "--debug",
         help="Set logging as DEBUG (default is INFO)",
@@ -98,7 +1935,7 @@ if __name__ == "__main__":
 
     # Set log level
     logging.basicConfig(
-        format=f"%(asctime)s.%(msecs)03d [%(levelname)s]: %(message)s",
+        format=f"%(asctime)s.%(msecs)03d [%(levelname)s] [%(threadName)s]: %(message)s",
         level=logging.DEBUG if args.debug else logging.INFO,
         datefmt="%Y-%m-%d %H:%M:%S",
     )
@@ -108,377 +1945,83 @@ if __name__ == "__main__":
         with open(args.config, "r") as f:
             config = yaml.safe_load(f)
 
-        slack_config = config.get("slack", dict())
-        global_config = config.get("global", dict()) or dict()
-        instances_config = config.get("instances", dict())
-        tags_config = config.get("tags", dict())
-        notify_messages_config = config.get("notify_messages", dict())
-        email_tags_config = config.get("email_tags", list())
-        regions = global_config.get("regions", list())
-
-        if args.run_date:
-            d_run_date = args.run_date
-        else:
-            d_run_date = D_TODAY
-
-        if args.region:
-            regions = args.region
-
-        slack_client = SlackClient(slack_config)
-
-        # We won't send most stuff to Slack, but use this to validate that connection is okay and indicate the script is starting
-        start_text = (
-            "Running cleaner on {}".format(d_run_date)
-            if d_run_date == D_TODAY
-            else "Running cleaner on simulated run date of {}".format(d_run_date)
-        )
-        slack_client.dlog_and_send_text(start_text)
-
-        if regions:
-            # use test region filter
-            logging.info("Using regions provided in global.regions")
-        else:
-            aws_client = AWSClient("us-east-1")
-            regions = aws_client.get_regions()
-
-        slack_client.dlog_and_send_text("Using regions: {}".format(", ".join(regions)))
-
-        for region in regions:
-            slack_client.dlog_and_send_text("Processing {} in region {}".format(
-                ", ".join([instance_type for instance_type, type_config in instances_config.items() if type_config.get("enabled")]),
-                region,
-                ))
-
-            # Instance type is EC2, RDS, etc.
-            for instance_type, type_config in instances_config.items():
-                if type_config.get("enabled"):
-                    slack_client.dlog_and_send_text("Retrieving {} instances from region {}".format(instance_type, region))
-                    instance_config = type_config.get("config")
-
-                    if instance_type == 'ec2':
-                        aws_client = EC2Client(
-                            region,
-                            dry_run=args.dry_run,
-                            service_name=instance_type,
-                            notify_messages_config=notify_messages_config,
-                            email_tags=email_tags_config,
-                        )
-                    elif instance_type == 'rds':
-                        aws_client = RDSClient(
-                            region,
-                            dry_run=args.dry_run,
-                            service_name=instance_type,
-                            notify_messages_config=notify_messages_config,
-                            email_tags=email_tags_config,
-                        )
-                    elif instance_type == 'autoscaling':
-                        aws_client = ASGClient(
-                            region,
-                            dry_run=args.dry_run,
-                            service_name=instance_type,
-                            notify_messages_config=notify_messages_config,
-                            email_tags=email_tags_config,
-                        )
-                    else:
-                        aws_client = AWSClient(
-                            region,
-                            dry_run=args.dry_run,
-                            service_name=instance_type,
-                            notify_messages_config=notify_messages_config,
-                            email_tags=email_tags_config,
-                        )
-
-                    instances = aws_client.get_instances(instance_config=instance_config)
-
-                    state_map = type_config.get("states")
-
-                    included = [instance["state"] for instance in instances if instance["state"] in state_map]
-                    excluded = [instance["state"] for instance in instances if instance["state"] not in state_map]
-                    included_states = set(included)
-                    excluded_states = set(excluded)
-
-                    included_state_counts = {
-                        state: sum([1 for instance in instances if state == instance.state])
-                        for state in included_states
-                    }
-                    excluded_state_counts = {
-                        state: sum([1 for instance in instances if state == instance.state])
-                        for state in excluded_states
-                    }
-
-                    total_text = "Total {type} instances found: {total}".format(
-                        total=len(instances),
-                        type=instance_type,
-                        )
-                    
-                    included_text = "{total} will be processed: {c}".format(
-                        total=len(included),
-                        c=", ".join(
-                            ["{} {}".format(v, k) for k,v in included_state_counts.items()]
-                        )
+        def profiled_run(*run_args, **run_kwargs):
+            if not args.profile:
+                return run(*run_args, **run_kwargs)
+            profiler = Profiler(args.profile_mode)
+            with profiler:
+                run_summary = run(*run_args, **run_kwargs)
+            profiler.write(profile_path(args.profile, daemon=args.daemon))
+            return run_summary
+
+        if args.merge_summaries:
+            merge_summaries(config, args.merge_summaries, summary_file=args.summary_file)
+        elif args.apply:
+            apply_plan(
+                config,
+                args.apply,
+                dry_run=args.dry_run,
+                summary_file=args.summary_file,
+                ledger_file=args.slack_ledger,
+                state_store_file=args.state_store,
+            )
+        elif args.events and not args.daemon:
+            process_events(
+                config,
+                args.events,
+                run_date=args.run_date,
+                dry_run=args.dry_run,
+                regions=args.region,
+                state_store_file=args.state_store,
+                ledger_file=args.slack_ledger,
+            )
+        elif args.daemon:
+            event_source = args.events or (config.get("global") or dict()).get("events_queue")
+            run_daemon(
+                config_path=args.config,
+                run=lambda config, cache: profiled_run(
+                    config,
+                    dry_run=args.dry_run,
+                    regions=args.region,
+                    shard=args.shard,
+                    lease_dir=args.lease_dir,
+                    summary_file=args.summary_file,
+                    journal_file=args.journal,
+                    ledger_file=args.slack_ledger,
+                    prioritise=args.prioritise,
+                    deadline=parse_deadline(args.deadline) if args.deadline else None,
+                    state_store_file=args.state_store,
+                    cache=cache,
+                ),
+                poll=(
+                    lambda config, cache: process_events(
+                        config,
+                        event_source,
+                        dry_run=args.dry_run,
+                        regions=args.region,
+                        cache=cache,
+                        state_store_file=args.state_store,
+                        ledger_file=args.slack_ledger,
                     )
-                    excluded_text = "{total} will not be processed (not currently handled by script): {c}".format(
-                        total=len(excluded),
-                        c=", ".join(
-                            ["{} {}".format(v, k) for k,v in excluded_state_counts.items()]
-                        )
-                    )
-
-                    slack_client.dlog_and_send_text(total_text)
-                    if len(included) > 0:
-                        slack_client.dlog_and_send_text(included_text)
-                    if len(excluded) > 0:
-                        slack_client.dlog_and_send_text(excluded_text)
-
-                    # States are started, stopped, scaled, etc.
-                    for state in state_map:
-                        state_config = state_map[state]
-
-                        action = state_config["action"]
-                        action_tag = state_config["action_tag"]
-                        complete_logs_tag = state_config["action_log_tag"]
-                        action_default_days = state_config["default_days"]
-                        action_max_days = state_config["max_days"]
-
-                        next_state = state_config.get("next_state")
-
-                        state_notification_tags = state_config.get("notifications")
-                        # Results in list of tuples:
-                        # [
-                        #   ("aws_cleaner/notifications/1": 15),
-                        #   (tag_name_2: days_2),
-                        #   ...,
-                        #   (tag_name_n: days_n)
-                        # ]
-                        # (sorted by days, in descending order)
-                        state_notifications = sorted(
-                            state_notification_tags.items(),
-                            key=lambda n: n[1],
-                            reverse=True
-                        )
-
-                        state_instances = [instance for instance in instances if state == instance.state]
-
-                        # Process in order by state; exceptions are processed with their state rather than separate
-                        for instance in state_instances:
-
-                            logging.info(
-                                "Processing {state} {type} instance {id} in region {region}".format(**instance)
-                            )
-
-                            if len(instance.exceptions) == 0:
-
-                                # Current value of action date
-                                action_current_date = date_or_none(
-                                    instance.tags, action_tag
-                                )
-
-                                dn_notification = dict()
-                                for notification_tag, days in state_notifications:
-                                    dn_notification[notification_tag] = {
-                                        "old": date_or_none(instance.tags, notification_tag),
-                                        "days": days,
-                                    }
-                                # dn_notification = {
-                                #     <tag>: {"old": <current tag value>, "days": >notification days>},
-                                #     'aws_cleaner/terminate/notifications/1': {"old": datetime.date(2024, 7, 22),"days": 15},
-                                #     'aws_cleaner/terminate/notifications/2': {"old": None, "days": 8},
-                                #     'aws_cleaner/terminate/notifications/3': {"old": None, "days": 2}
-                                # }
-
-                                r = determine_action(
-                                    idn_action_date=action_current_date,
-                                    idn_notification=dn_notification,
-                                    i_default_days=action_default_days,
-                                    i_max_days=action_max_days,
-                                    notify_messages_config=notify_messages_config,
-                                    d_run_date=d_run_date,
-                                )
-
-                                # Update all tags that have changed
-                                tags = {
-                                    action_tag: {
-                                        "old": action_current_date,
-                                        "new": r["odn_action_date"],
-                                    }
-                                }
-                                tags |= r["odn_notification"]
-
-                                if r["result"] == Result.COMPLETE_ACTION:
-                                    # If we have a 'complete' action, do all of the following (before tag updates and Slack notification)
-                                    # * Perform the action (stop/terminate)
-                                    # * Add an action complete log (including notifications) tag
-                                    # * If there's a next action:
-                                        # * Add a next action date tag - done
-                                        # * Send a transition notification
-
-                                    aws_client.do_action(
-                                        action=action,
-                                        **instance,
-                                    )
-
-                                    tags[complete_logs_tag] = {
-                                        "old": None,
-                                        "new": "/".join(
-                                            ["notified:{}".format(v["new"]) for k,v in r["odn_notification"].items()]
-                                            + ["{}:{}".format(action, d_run_date)]
-                                        )
-                                    }
-                                    
-                                    if next_state:
-                                        next_state_config = state_map[next_state]
-
-                                        tags[next_state_config["action_tag"]] = {
-                                            "old": None,
-                                            "new": d_run_date + datetime.timedelta(days=next_state_config["default_days"]),
-                                        }
-
-                                        transition_message_details = dict(instance)
-                                        transition_message_details["action"] = next_state_config["action"]
-                                        transition_message_details["tag"] = next_state_config["action_tag"]
-                                        transition_message_details["old_date"] = None
-                                        transition_message_details["new_date"] = d_run_date + datetime.timedelta(days=next_state_config["default_days"])
-                                        transition_message_details["state"] = "stopped" # TODO FIX
-                                        transition_message_details["result"] = Result.TRANSITION_ACTION
-                                        transition_message_details["message"] = notify_messages_config.get(Result.TRANSITION_ACTION).format(**transition_message_details)
-                                        # transition_message_details is populated here, but used later so transition notification occurs after action complete action
-
-                                        for tag in next_state_config["notifications"]:
-                                            tags[tag] = {
-                                                "old": date_or_none(instance.tags, tag),
-                                                "new": None,
-                                            }
-
-                                # Filter by tags that have new values
-                                updated_tags = {
-                                    tag: values for tag,values in tags.items() if values["old"] != values["new"]
-                                }
-                                
-                                if(len(updated_tags) > 0):
-                                    aws_client.update_tags(
-                                        **instance,
-                                        updated_tags=updated_tags,
-                                    )
-
-                                message_details = {
-                                    **instance,
-                                    "action": action,
-                                    "tag": action_tag,
-                                    "old_date": action_current_date,
-                                    "new_date": r["odn_action_date"],
-                                    "state": instance.state,
-                                    "result": r["result"],
-                                }
-
-                                # Add message to message_details
-                                message_details["message"] = r["message"].format(**message_details)
-
-                                # detailed_log.append(message_details)
-                                log_item(message_details)
-
-                                slack_client.send_text(
-                                    "{}{} [{}]: {}".format(
-                                        "[DRY RUN] " if args.dry_run else "",
-                                        message_details["email"],
-                                        message_details["result"],
-                                        message_details["message"],
-                                    ),
-                                    log=message_details["result"] in (Result.LOG_NO_NOTIFICATION, Result.SKIP_EXCEPTION),
-                                )
-
-                                if message_details["email"] and message_details["result"] not in (
-                                    Result.LOG_NO_NOTIFICATION,
-                                ) and not args.dry_run:
-                                    slack_client.send_dm(
-                                        email = message_details["email"],
-                                        text = message_details["message"],
-                                    )
-
-                                if r["result"] == Result.COMPLETE_ACTION and next_state:
-                                    # detailed_log.append(transition_message_details)
-                                    log_item(transition_message_details)
-
-                                    slack_client.send_text(
-                                        "{}{} [{}]: {}".format(
-                                            "[DRY RUN] " if args.dry_run else "",
-                                            transition_message_details["email"],
-                                            transition_message_details["result"],
-                                            transition_message_details["message"],
-                                        ),
-                                    )
-
-                                    if transition_message_details["email"] and not args.dry_run:
-                                        slack_client.send_dm(
-                                            email = transition_message_details["email"],
-                                            text = transition_message_details["message"],
-                                        )
-
-                            else: # Exception list is not empty
-                                message_details = {
-                                    **instance,
-                                    "action": Result.SKIP_EXCEPTION,
-                                    "tag": instance.exceptions[0][0],  # TODO verify this is right, I think this is wrong
-                                    "result": Result.SKIP_EXCEPTION,
-                                    "old_date": d_run_date,
-                                    "new_date": instance.exceptions[0][1],
-                                    "state": instance.state,
-                                }
-                                message_text = notify_messages_config.get(
-                                    Result.SKIP_EXCEPTION
-                                ).format(**message_details)
-
-                                message_details["message"] = message_text
-
-                                # detailed_log.append(message_details)
-                                log_item(message_details)
-
-                                slack_client.send_text(
-                                    "{}{} [{}]: {}".format(
-                                        "[DRY RUN] " if args.dry_run else "",
-                                        message_details["email"],
-                                        message_details["result"],
-                                        message_details["message"],
-                                    ),
-                                    log=message_details["result"] in (Result.LOG_NO_NOTIFICATION, Result.SKIP_EXCEPTION),
-                                )
-
-                    for instance in [i for i in instances if i.state not in state_map]:
-                        message_details = {
-                            **instance,
-                            "action": "ignore",
-                            "tag": instance.state,  # again, this is a hack
-                            "result": Result.IGNORE_OTHER_STATES,
-                            "old_date": d_run_date,
-                            "new_date": d_run_date,
-                            "state": instance.state,
-                        }
-
-                        message_text = notify_messages_config.get(Result.IGNORE_OTHER_STATES).format(**message_details)
-
-                        message_details["message"] = message_text
-
-                        # detailed_log.append(message_details)
-                        log_item(message_details)
-
-                        slack_client.send_text(
-                            "{}{} [{}]: {}".format(
-                                "[DRY RUN] " if args.dry_run else "",
-                                message_details["email"],
-                                message_details["result"],
-                                message_details["message"],
-                            ),
-                            log=message_details["result"] in (Result.LOG_NO_NOTIFICATION, Result.SKIP_EXCEPTION),
-                        )
-                else:
-                    logging.info("Skipping {} instances in region {}".format(instance_type, region))
-
-        # We won't send most stuff to Slack, but use this to validate that connection is okay and indicate the script is starting
-        end_text = (
-            "Finished running cleaner on {}".format(d_run_date)
-            if d_run_date == D_TODAY
-            else "Finished running cleaner on simulated run date of {}".format(d_run_date)
-        )
-        slack_client.dlog_and_send_text(end_text)
+                ) if event_source else None,
+            )
+        else:
+            profiled_run(
+                config,
+                run_date=args.run_date,
+                dry_run=args.dry_run,
+                regions=args.region,
+                shard=args.shard,
+                lease_dir=args.lease_dir,
+                summary_file=args.summary_file,
+                journal_file=args.journal,
+                resume=args.resume,
+                ledger_file=args.slack_ledger,
+                plan_file=args.plan,
+                prioritise=args.prioritise,
+                deadline=parse_deadline(args.deadline) if args.deadline else None,
+                state_store_file=args.state_store,
+            )
 
     except KeyboardInterrupt:
         logging.info("Aborted by user!")
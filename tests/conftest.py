@@ -27,6 +27,19 @@ def pytest_addoption(parser):
         type=str,
         default=os.path.join("config", "default_config.yaml"),
     )
+    parser.addoption(
+        "--benchmark",
+        help="Run the microbenchmarks (tests/test_microbenchmarks.py) and fail on regressions against their baselines",
+        action="store_true",
+        dest="benchmark",
+    )
+    parser.addoption(
+        "--benchmark-threshold",
+        help="Allowed slowdown over the microbenchmark baselines (default is 0.3)",
+        type=float,
+        default=0.3,
+        dest="benchmark_threshold",
+    )
 
 @fixture()
 def config(request):
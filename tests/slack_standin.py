@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Local stand-in for the Slack Web API methods used by SlackClient (chat.postMessage,
+# users.lookupByEmail, users.list), with Slack's rate limiting and injectable latency / errors.
+#
+#   with SlackStandIn(channel_rate=1, latency=0.05, error_rate=0.01) as slack:
+#       slack_config["chat_post_message_endpoint"] = slack.url("chat.postMessage")
+#       ...
+#       assert len(slack.messages) == 10
+#
+import math
+import json
+import time
+import random
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+STANDIN_DEFAULTS = {
+    # chat.postMessage: about one message per second per channel, with short bursts allowed (None: unlimited)
+    "channel_rate": 1.0,
+    "channel_burst": 3,
+    # Per method limits (requests per minute): users.lookupByEmail is Tier 3, users.list Tier 2
+    "method_rates": {"users.lookupByEmail": 50, "users.list": 20},
+    # Added to every response: latency + uniform(0, jitter) seconds
+    "latency": 0.0,
+    "jitter": 0.0,
+    # Share of requests failing with error_status (HTTP 500 by default) before any processing
+    "error_rate": 0.0,
+    "error_status": 500,
+    # Expected bearer token (None accepts any)
+    "token": None,
+    # Create a user for any looked up email; otherwise only emails in `users` are found
+    "auto_users": True,
+    "users": dict(),
+    "page_size": 100,
+    "seed": 0,
+}
+
+
+class Bucket:
+    """
+    Token bucket: take() returns 0 when a token was available, else the seconds until one is
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+    ) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+
+    def take(
+        self,
+    ):
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self._rate
+
+
+class SlackStandIn:
+    """
+    HTTP server on 127.0.0.1 (random port) answering like the Slack Web API.
+    Everything it accepted or refused is recorded: messages, calls per method, rate_limited per method.
+    """
+
+    def __init__(
+        self,
+        **standin_config,
+    ) -> None:
+        self.config = STANDIN_DEFAULTS | standin_config
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config["seed"])
+        self._channel_buckets = dict()
+        self._method_buckets = {
+            method: Bucket(rate / 60, max(1, rate / 10))
+            for method, rate in self.config["method_rates"].items()
+        }
+        self.users = dict(self.config["users"])
+        self.messages = list()
+        self.calls = dict()
+        self.rate_limited = dict()
+        self.errors = dict()
+        self._server = None
+
+    def url(
+        self,
+        method: str,
+    ):
+        return "http://127.0.0.1:{}/api/{}".format(self._server.server_port, method)
+
+    def start(
+        self,
+    ):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode()
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(body or "{}")
+                else:
+                    params = {k: v[0] for k, v in urllib.parse.parse_qs(body).items()}
+                status, headers, payload = standin.handle(
+                    self.path.rsplit("/", 1)[-1],
+                    params,
+                    self.headers.get("Authorization"),
+                )
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                for k, v in (headers | {"Content-Type": "application/json", "Content-Length": str(len(data))}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="slack-standin", daemon=True).start()
+        return self
+
+    def stop(
+        self,
+    ):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(
+        self,
+    ):
+        return self.start()
+
+    def __exit__(
+        self,
+        *args,
+    ):
+        self.stop()
+
+    def user_id(
+        self,
+        email: str,
+    ):
+        # Caller holds the lock
+        if email not in self.users and self.config["auto_users"]:
+            self.users[email] = "U{:08d}".format(len(self.users) + 1)
+        return self.users.get(email)
+
+    def handle(
+        self,
+        method: str,
+        params: dict,
+        authorization: str,
+    ):
+        """
+        Returns (HTTP status, headers, JSON body) for one API call
+        """
+        delay = self.config["latency"] + self._random.uniform(0, self.config["jitter"])
+        if delay:
+            time.sleep(delay)
+
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if self._random.random() < self.config["error_rate"]:
+                self.errors[method] = self.errors.get(method, 0) + 1
+                return self.config["error_status"], dict(), {"ok": False, "error": "internal_error"}
+            if self.config["token"] and authorization != "Bearer {}".format(self.config["token"]):
+                return 200, dict(), {"ok": False, "error": "invalid_auth"}
+
+            if method == "chat.postMessage":
+                channel = params.get("channel")
+                if not channel:
+                    return 200, dict(), {"ok": False, "error": "channel_not_found"}
+                bucket = None
+                if self.config["channel_rate"]:
+                    bucket = self._channel_buckets.setdefault(
+                        channel,
+                        Bucket(self.config["channel_rate"], self.config["channel_burst"]),
+                    )
+            else:
+                bucket = self._method_buckets.get(method)
+
+            retry_after = bucket.take() if bucket else 0
+            if retry_after:
+                self.rate_limited[method] = self.rate_limited.get(method, 0) + 1
+                return 429, {"Retry-After": str(math.ceil(retry_after))}, {"ok": False, "error": "ratelimited"}
+
+            if method == "chat.postMessage":
+                ts = "{:.6f}".format(time.time())
+                self.messages.append({"channel": channel, "text": params.get("text"), "ts": ts})
+                return 200, dict(), {"ok": True, "channel": channel, "ts": ts, "message": {"text": params.get("text")}}
+
+            if method == "users.lookupByEmail":
+                user_id = self.user_id(params.get("email"))
+                if not user_id:
+                    return 200, dict(), {"ok": False, "error": "users_not_found"}
+                return 200, dict(), {"ok": True, "user": {"id": user_id, "profile": {"email": params.get("email")}}}
+
+            if method == "users.list":
+                members = [{"id": user_id, "profile": {"email": email}} for email, user_id in sorted(self.users.items())]
+                start = int(params.get("cursor") or 0)
+                limit = int(params.get("limit") or self.config["page_size"])
+                end = start + limit
+                return 200, dict(), {
+                    "ok": True,
+                    "members": members[start:end],
+                    "response_metadata": {"next_cursor": str(end) if end < len(members) else ""},
+                }
+
+            return 200, dict(), {"ok": False, "error": "unknown_method"}
+
+
+class QuietSlack:
+    """
+    Stands in for the SlackClient itself (cached as main.get_slack_client would): keeps the texts instead of sending them
+    """
+
+    def __init__(self):
+        self.texts = list()
+        self.ledger = None
+
+    def dlog_and_send_text(self, text):
+        self.texts.append(text)
+
+    def send_text(self, text, log=False, dedupe=None):
+        self.texts.append(text)
+
+    def send_dm(self, email, text, dedupe=None):
+        self.texts.append(text)
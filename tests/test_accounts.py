@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+
+import pytest
+
+from utils.aws.accounts import SessionCache, get_accounts, arn_account_id
+from utils.shard import unit_key
+
+
+def test_arn_account_id():
+    assert arn_account_id("arn:aws:iam::111111111111:role/cleaner") == "111111111111"
+    assert arn_account_id("arn:aws:iam::222222222222:role/path/cleaner") == "222222222222"
+    assert arn_account_id("cleaner") is None
+    assert arn_account_id(None) is None
+
+
+def test_role_arn_only_accounts_get_distinct_ids():
+    accounts = get_accounts(
+        {
+            "list": [
+                {"role_arn": "arn:aws:iam::111111111111:role/cleaner"},
+                {"role_arn": "arn:aws:iam::222222222222:role/cleaner"},
+            ],
+        },
+        None,
+    )
+    assert [account["id"] for account in accounts] == ["111111111111", "222222222222"]
+    assert [account["name"] for account in accounts] == ["111111111111", "222222222222"]
+    assert [account["role_arn"] for account in accounts] == [
+        "arn:aws:iam::111111111111:role/cleaner",
+        "arn:aws:iam::222222222222:role/cleaner",
+    ]
+    keys = {unit_key(account["id"], "us-east-1", "ec2") for account in accounts}
+    assert len(keys) == 2
+
+
+def test_role_arn_account_merges_with_listed_id():
+    accounts = get_accounts(
+        {
+            "role_name": "cleaner",
+            "list": [
+                {"id": 111111111111},
+                {"role_arn": "arn:aws:iam::111111111111:role/other", "name": "prod"},
+            ],
+        },
+        None,
+    )
+    assert accounts == [
+        {"id": "111111111111", "name": "prod", "role_arn": "arn:aws:iam::111111111111:role/other"},
+    ]
+
+
+def test_sts_client_shared(monkeypatch):
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        session_cache = SessionCache()
+        created = list()
+        client = session_cache.default_session.client
+        monkeypatch.setattr(session_cache.default_session, "client", lambda *args, **kwargs: created.append(args) or client(*args, **kwargs))
+
+        threads = [
+            threading.Thread(target=session_cache.get_session, args=("arn:aws:iam::{}:role/cleaner".format(n * 111111111111),))
+            for n in range(1, 6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert created == [("sts",)]
+        assert len(session_cache._sessions) == 5
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from utils.aws.api_calls import ApiCallCounter, ApiBudgetExceeded
+
+
+def stubbed_client(counter):
+    client = boto3.client(
+        "ec2",
+        region_name="us-east-1",
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+    )
+    # Attach before the Stubber, whose before-call handler short-circuits the call
+    counter.attach(client)
+    stubber = Stubber(client)
+    stubber.activate()
+    return client, stubber
+
+
+def test_counts_per_operation():
+    counter = ApiCallCounter()
+    client, stubber = stubbed_client(counter)
+
+    stubber.add_response("describe_instances", {"Reservations": []})
+    stubber.add_response("describe_instances", {"Reservations": []})
+    stubber.add_response("create_tags", {})
+    stubber.add_client_error("stop_instances", service_error_code="IncorrectInstanceState")
+    client.describe_instances()
+    client.describe_instances()
+    client.create_tags(Resources=["i-1"], Tags=[])
+    with pytest.raises(Exception):
+        client.stop_instances(InstanceIds=["i-1"])
+
+    operations = counter.to_dict()["operations"]
+    assert counter.total == 4
+    assert operations["us-east-1/ec2/DescribeInstances"]["calls"] == 2
+    assert operations["us-east-1/ec2/CreateTags"]["calls"] == 1
+    assert operations["us-east-1/ec2/StopInstances"]["errors"] == 1
+
+
+def test_budget():
+    counter = ApiCallCounter()
+    counter.configure(budget=3, headroom=1)
+    client, stubber = stubbed_client(counter)
+
+    # The Stubber checks its queue before the call is made, so the refused call needs a response too
+    for _ in range(4):
+        stubber.add_response("describe_instances", {"Reservations": []})
+    client.describe_instances()
+    assert not counter.should_stop()
+    client.describe_instances()
+    assert counter.should_stop()
+    client.describe_instances()
+    with pytest.raises(ApiBudgetExceeded):
+        client.describe_instances()
+    assert counter.total == 3
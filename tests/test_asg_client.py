@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import boto3
+import pytest
+
+import utils.aws.asg_client as asg_client
+from utils.aws.api_calls import API_CALLS
+
+moto = pytest.importorskip("moto")
+
+instance_config = {"exceptions": list(), "filters": None, "prefixes": {"managed": ["eks"], "eks": ["kubernetes.io/cluster"]}}
+
+
+@pytest.fixture()
+def autoscaling(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(asg_client, "ASG_TAGS_PER_CALL", 4)
+    with moto.mock_aws():
+        autoscaling = boto3.client("autoscaling", region_name="us-east-1")
+        autoscaling.create_launch_configuration(LaunchConfigurationName="lc", ImageId="ami-12c6146b", InstanceType="t3.micro")
+        for n in range(5):
+            autoscaling.create_auto_scaling_group(
+                AutoScalingGroupName="asg{}".format(n),
+                LaunchConfigurationName="lc",
+                MinSize=1,
+                MaxSize=2,
+                DesiredCapacity=1,
+                AvailabilityZones=["us-east-1a"],
+            )
+        yield autoscaling
+
+
+def test_actions_and_tags(autoscaling):
+    client = asg_client.ASGClient("us-east-1", dry_run=False, service_name="autoscaling", email_tags=["email"])
+    groups = [instance for page in client.get_instance_pages(instance_config) for instance in page]
+    assert {group.state for group in groups} == {"standalone:running"}
+
+    calls = list()
+    create_or_update_tags = client.client.create_or_update_tags
+    client.client.create_or_update_tags = lambda **kwargs: calls.append(len(kwargs["Tags"])) or create_or_update_tags(**kwargs)
+    tags = {"aws_cleaner/scaletozero/date": {"old": None, "new": "2020-12-31"}, "aws_cleaner/scaletozero/log": {"old": None, "new": "x"}}
+    assert client.update_tags_batch([(group, tags) for group in groups]) == dict()
+    # Tags of several groups per call
+    assert calls == [4, 4, 2]
+    assert client.get_tags(groups)[groups[0].id]["aws_cleaner/scaletozero/date"] == "2020-12-31"
+
+    assert client.do_actions("scaletozero", groups[:3]) == dict()
+    states = {group.name: group.state for page in client.get_instance_pages(instance_config) for group in page}
+    assert [states[name] for name in ("asg0", "asg1", "asg2", "asg3")] == ["standalone:scaledtozero"] * 3 + ["standalone:running"]
+
+    assert client.do_actions("delete", groups[:2]) == dict()
+    assert sorted(client.get_tags(groups)) == sorted(group.id for group in groups[2:])
+    # Deleted groups are not tagged
+    assert client.update_tags_batch([(group, tags) for group in groups[:2]]) == dict()
+    # until the next run (a daemon keeps its clients)
+    client.reset()
+    calls.clear()
+    client.client.create_or_update_tags = lambda **kwargs: calls.append(len(kwargs["Tags"]))
+    client.update_tags_batch([(group, tags) for group in groups[:2]])
+    assert calls == [4]
+
+
+def test_api_budget_exceeded_fails_per_group(autoscaling, monkeypatch):
+    client = asg_client.ASGClient("us-east-1", dry_run=False, service_name="autoscaling", email_tags=["email"])
+    groups = [instance for page in client.get_instance_pages(instance_config) for instance in page]
+    # Every further call is refused
+    monkeypatch.setattr(API_CALLS, "budget", API_CALLS.total)
+
+    tags = {"aws_cleaner/scaletozero/date": {"old": None, "new": "2020-12-31"}}
+    failed = client.update_tags_batch([(group, tags) for group in groups])
+    assert sorted(failed) == sorted(group.id for group in groups)
+    assert all("budget" in error for error in failed.values())
+    assert sorted(client.do_actions("scaletozero", groups[:2])) == sorted(group.id for group in groups[:2])
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import boto3
+import pytest
+
+import main
+from utils.aws.aws_client import AWSClient
+from utils.aws.generic_instance import GenericInstance
+
+
+def instance(id):
+    return GenericInstance(
+        type="ec2",
+        id=id,
+        region="us-east-1",
+        name=id,
+        email=None,
+        state="running",
+        exceptions=list(),
+        tags=dict(),
+    )
+
+
+class SlowClient(AWSClient):
+    """
+    Client whose instances take `polls` state lookups to stop; "i-stuck" never does
+    """
+
+    CONFIRMED_STATES = {"stop": ("stopped",)}
+
+    def __init__(self, polls):
+        self._dry_run = False
+        self.polls = polls
+        self.lookups = list()
+
+    def do_actions(self, action, instances):
+        return dict()
+
+    def get_states(self, instances):
+        self.lookups.append(len(instances))
+        done = len(self.lookups) >= self.polls
+        return {i.id: "stopped" if done and i.id != "i-stuck" else "stopping" for i in instances}
+
+    def update_tags_batch(self, items):
+        self.tagged = [instance.id for instance, updated_tags in items]
+
+
+def test_actuate_confirms_actions():
+    client = SlowClient(polls=3)
+    records = [
+        {
+            "instance": instance(id),
+            "action": "stop",
+            "updated_tags": {"aws_cleaner/stop/log": {"old": None, "new": "stop"}},
+            "messages": list(),
+            "aws_client": client,
+        }
+        for id in ("i-1", "i-2", "i-stuck")
+    ]
+    main.actuate(records, confirmation={"timeout_seconds": 1, "interval_seconds": 0.01})
+
+    # One lookup per poll for every instance still pending
+    assert client.lookups[:3] == [3, 3, 3]
+    assert set(client.lookups[3:]) == {1}
+    assert [record.get("confirmed") for record in records] == [True, True, None]
+    assert records[2]["errors"] == {"action": "stop not confirmed, state is stopping"}
+    # The action log tag is only written once the action is confirmed
+    assert client.tagged == ["i-1", "i-2"]
+
+
+def test_ec2_confirm_actions(monkeypatch):
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    from utils.aws.ec2_client import EC2Client
+
+    with moto.mock_aws():
+        ec2 = boto3.client("ec2", region_name="us-east-1")
+        ids = [i["InstanceId"] for i in ec2.run_instances(ImageId="ami-12c6146b", MinCount=3, MaxCount=3)["Instances"]]
+        client = EC2Client("us-east-1", dry_run=False, email_tags=["email"])
+        instances = [instance(id) for id in ids]
+
+        clients = {"ec2": client}
+        assert client.do_actions("stop", instances[:2]) == dict()
+        assert main.confirm_actions({("ec2", "stop"): instances}, clients, timeout=0, interval=0) == {("ec2", ids[2]): "running"}
+        assert client.do_actions("terminate", instances[2:]) == dict()
+        # A terminated instance that is no longer found counts as confirmed too
+        terminated = instances[2:] + [instance("i-0123456789abcdef0")]
+        assert main.confirm_actions({("ec2", "terminate"): terminated}, clients, timeout=0, interval=0) == dict()
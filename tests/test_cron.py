@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pytest
+import datetime
+
+from utils.cron import CronSchedule, parse_deadline
+
+# Wednesday
+d_start = datetime.datetime(2024, 7, 17, 10, 30, 15)
+
+
+def test_daily():
+    schedule = CronSchedule("0 6 * * *")
+    assert schedule.next_after(d_start) == datetime.datetime(2024, 7, 18, 6, 0)
+
+
+def test_steps_and_ranges():
+    assert CronSchedule("*/15 * * * *").next_after(d_start) == datetime.datetime(2024, 7, 17, 10, 45)
+    assert CronSchedule("0 9-17/4 * * *").next_after(d_start) == datetime.datetime(2024, 7, 17, 13, 0)
+
+
+def test_weekday():
+    # Monday
+    assert CronSchedule("0 6 * * 1").next_after(d_start) == datetime.datetime(2024, 7, 22, 6, 0)
+    # Sunday, as 0 or 7
+    assert CronSchedule("0 6 * * 0").next_after(d_start) == datetime.datetime(2024, 7, 21, 6, 0)
+    assert CronSchedule("0 6 * * 7").next_after(d_start) == datetime.datetime(2024, 7, 21, 6, 0)
+
+
+def test_day_or_weekday():
+    # Both restricted: the 1st of the month or any Friday
+    assert CronSchedule("0 6 1 * 5").next_after(d_start) == datetime.datetime(2024, 7, 19, 6, 0)
+
+
+def test_month_rollover():
+    assert CronSchedule("0 0 1 1 *").next_after(d_start) == datetime.datetime(2025, 1, 1, 0, 0)
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        CronSchedule("0 6 * *")
+    with pytest.raises(ValueError):
+        CronSchedule("61 6 * * *")
+    with pytest.raises(ValueError):
+        CronSchedule("0 6 31 2 *").next_after(d_start)
+
+
+def test_deadline():
+    assert parse_deadline("900", now=d_start) == datetime.datetime(2024, 7, 17, 10, 45, 15)
+    assert parse_deadline("11:00", now=d_start) == datetime.datetime(2024, 7, 17, 11, 0)
+    # A time of day already past today is tomorrow's
+    assert parse_deadline("06:00", now=d_start) == datetime.datetime(2024, 7, 18, 6, 0)
+    with pytest.raises(ValueError):
+        parse_deadline("soon", now=d_start)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import boto3
+import pytest
+
+moto = pytest.importorskip("moto")
+
+instance_config = {"exceptions": ["aws_cleaner/exception"], "filters": None}
+
+
+@pytest.fixture()
+def ec2(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        ec2 = boto3.client("ec2", region_name="us-east-1")
+        tag_sets = [
+            dict(),
+            {"Name": "web", "email": "owner@example.com", "team": "web", "aws_cleaner/stop/date": "2020-12-31"},
+            {"Name": "db", "aws_cleaner/exception": "keep", "aws_cleaner/stop/notifications/1": "2020-12-01"},
+        ] * 3
+        for tags in tag_sets:
+            params = {"ImageId": "ami-12c6146b", "MinCount": 1, "MaxCount": 1}
+            if tags:
+                params["TagSpecifications"] = [{"ResourceType": "instance", "Tags": [{"Key": k, "Value": v} for k, v in tags.items()]}]
+            ec2.run_instances(**params)
+        ids = [i["InstanceId"] for r in ec2.describe_instances()["Reservations"] for i in r["Instances"]]
+        ec2.stop_instances(InstanceIds=ids[:3])
+        yield ec2
+
+
+def test_tag_discovery_matches_full_discovery(ec2):
+    from utils.aws.ec2_client import EC2Client
+
+    client = EC2Client("us-east-1", dry_run=True, max_results=5, email_tags=["email"])
+    full = {i.id: i for page in client.get_instance_pages(instance_config) for i in page}
+    pages = list(client.get_instance_pages(instance_config | {"discovery": "tags"}))
+    light = {i.id: i for page in pages for i in page}
+
+    assert light.keys() == full.keys()
+    for id, instance in light.items():
+        # Only the tags the cleaner reads are fetched
+        assert instance.tags == {k: v for k, v in full[id].tags.items() if k != "team"}
+        for field in ("name", "email", "state", "exceptions"):
+            assert instance[field] == full[id][field]
+
+
+def test_idle_check_defers_busy_instances(ec2, monkeypatch):
+    import main
+    import utils.aws.aws_client as aws_client
+    from utils.aws.ec2_client import EC2Client
+
+    monkeypatch.setattr(aws_client, "METRIC_QUERIES_PER_CALL", 2)
+    client = EC2Client("us-east-1", dry_run=False, email_tags=["email"])
+    instances = [i for page in client.get_instance_pages(instance_config) for i in page if i.state == "running"][:3]
+    cloudwatch = boto3.client("cloudwatch", region_name="us-east-1")
+    for instance, cpu in zip(instances, (80.0, 2.0)):
+        cloudwatch.put_metric_data(
+            Namespace="AWS/EC2",
+            MetricData=[{"MetricName": "CPUUtilization", "Dimensions": [{"Name": "InstanceId", "Value": instance.id}], "Value": cpu}],
+        )
+
+    calls = list()
+    get_metric_data = client.service_client("cloudwatch").get_metric_data
+    client.service_client("cloudwatch").get_metric_data = lambda **kwargs: calls.append(len(kwargs["MetricDataQueries"])) or get_metric_data(**kwargs)
+    records = [
+        {
+            "instance": instance,
+            "action": "stop",
+            "updated_tags": {"aws_cleaner/stop/log": {"old": None, "new": "stop"}},
+            "messages": list(),
+            "aws_client": client,
+        }
+        for instance in instances
+    ]
+    main.actuate(records, idle_check={"cpu_percent": 10})
+
+    # The third instance has no metrics, so it isn't busy
+    assert calls == [2, 1]
+    assert [bool(record.get("busy")) for record in records] == [True, False, False]
+    assert "CPUUtilization peaked at 80" in records[0]["busy"]
+    states = client.get_states(instances)
+    assert [states[instance.id] for instance in instances] == ["running", "stopped", "stopped"]
+    assert "aws_cleaner/stop/log" not in client.get_tags(instances[:1])[instances[0].id]
+
+
+def test_tag_writes_fall_back_to_one_call_per_instance(ec2):
+    from botocore.exceptions import ClientError
+    from utils.aws.ec2_client import EC2Client
+    from utils.aws.generic_instance import GenericInstance
+
+    client = EC2Client("us-east-1", dry_run=False, email_tags=["email"])
+    instances = [i for page in client.get_instance_pages(instance_config) for i in page][:2]
+    missing = GenericInstance(
+        type="ec2", id="i-0123456789abcdef0", region="us-east-1", name="gone", email=None, state="running", exceptions=list(), tags=dict(),
+    )
+    create_tags = client.client.create_tags
+
+    def failing_create_tags(**kwargs):
+        if missing.id in kwargs["Resources"]:
+            raise ClientError(
+                {"Error": {"Code": "InvalidInstanceID.NotFound", "Message": "not found"}, "ResponseMetadata": {"HTTPStatusCode": 400}},
+                "CreateTags",
+            )
+        return create_tags(**kwargs)
+
+    client.client.create_tags = failing_create_tags
+    tags = {"aws_cleaner/stop/date": {"old": None, "new": "2021-01-31"}}
+    failed = client.update_tags_batch([(instance, tags) for instance in instances + [missing]])
+    assert list(failed) == [missing.id]
+    assert {id: t["aws_cleaner/stop/date"] for id, t in client.get_tags(instances).items()} == {
+        instance.id: "2021-01-31" for instance in instances
+    }
+
+
+def test_actions_fall_back_to_one_call_per_instance_only_for_instance_errors(ec2, monkeypatch):
+    from botocore.exceptions import ClientError
+    import utils.aws.aws_client as aws_client
+    from utils.aws.ec2_client import EC2Client
+    from utils.aws.generic_instance import GenericInstance
+
+    monkeypatch.setattr(aws_client, "RETRY_BACKOFF_SECONDS", 0)
+    client = EC2Client("us-east-1", dry_run=False, email_tags=["email"])
+    running = [i for page in client.get_instance_pages(instance_config) for i in page if i.state == "running"]
+    missing = GenericInstance(
+        type="ec2", id="i-0123456789abcdef0", region="us-east-1", name="gone", email=None, state="running", exceptions=list(), tags=dict(),
+    )
+    # moto rejects the whole call because of the missing instance
+    assert list(client.do_actions("stop", running[:2] + [missing])) == [missing.id]
+    assert set(client.get_states(running[:2]).values()) == {"stopped"}
+
+    calls = list()
+
+    def throttled(**kwargs):
+        calls.append(kwargs["InstanceIds"])
+        raise ClientError({"Error": {"Code": "RequestLimitExceeded", "Message": "slow down"}, "ResponseMetadata": {"HTTPStatusCode": 503}}, "StopInstances")
+
+    client.client.stop_instances = throttled
+    failed = client.do_actions("stop", running[2:4])
+    assert sorted(failed) == sorted(instance.id for instance in running[2:4])
+    # Retried as a batch, never one instance at a time
+    assert calls == [[instance.id for instance in running[2:4]]] * aws_client.CALL_ATTEMPTS
+
+
+def test_plan_and_apply_with_tag_discovery(ec2, tmp_path):
+    import main
+    from utils.aws.ec2_client import EC2Client
+    from utils.plan import Plan, load_plan
+
+    config = instance_config | {"discovery": "tags"}
+    unit = {
+        "key": "default/us-east-1/ec2",
+        "account": {"id": None, "name": None, "role_arn": None},
+        "region": "us-east-1",
+        "instance_type": "ec2",
+    }
+    client = EC2Client("us-east-1", dry_run=False, email_tags=["email"])
+    instances = [i for page in client.get_instance_pages(config) for i in page if i.tags.get("Name") == "web"]
+    tags = {"aws_cleaner/stop/notifications/1": {"old": None, "new": "2020-12-01"}}
+
+    path = str(tmp_path / "out.plan")
+    plan = Plan(path, "2020-12-01")
+    for instance in instances:
+        plan.add(
+            {"journal_id": "{}|{}".format(unit["key"], instance.id), "unit": unit, "instance": instance, "action": None, "updated_tags": tags},
+            messages=list(),
+        )
+    plan.close()
+    # A tag the cleaner doesn't read changes between planning and applying; one it reads changes on one instance
+    ec2.create_tags(Resources=[instance.id for instance in instances], Tags=[{"Key": "team", "Value": "platform"}])
+    ec2.create_tags(Resources=[instances[0].id], Tags=[{"Key": "email", "Value": "new@example.com"}])
+
+    run_date, intents = load_plan(path)
+    stale = list()
+    records = list(
+        main.verify_planned(
+            intents,
+            accounts_by_id=dict(),
+            session_cache=None,
+            aws_clients={(unit["key"], False): client},
+            dry_run=False,
+            notify_messages_config=dict(),
+            email_tags_config=["email"],
+            stale=stale,
+            instances_config={"ec2": {"config": config}},
+        )
+    )
+    assert stale == [intents[0]["id"]]
+    assert [record["instance"].id for record in records] == [instance.id for instance in instances[1:]]
+
+    main.actuate(records)
+    assert all(not record["errors"] for record in records)
+    current = client.get_tags(instances)
+    assert [current[instance.id].get("aws_cleaner/stop/notifications/1") for instance in instances] == [None, "2020-12-01", "2020-12-01"]
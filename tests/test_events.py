@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import json
+
+import pytest
+
+from utils.events import FileEventQueue, parse_event, receive_events
+
+DB_ARN = "arn:aws:rds:us-east-1:123456789012:db:db1"
+
+
+def event(source, detail_type, detail):
+    return {"source": source, "detail-type": detail_type, "account": "123456789012", "region": "us-east-1", "detail": detail}
+
+
+def test_parse_event():
+    ref = {"account": "123456789012", "region": "us-east-1"}
+    assert parse_event(event("aws.ec2", "EC2 Instance State-change Notification", {"instance-id": "i-1", "state": "running"})) == [
+        ref | {"instance_type": "ec2", "id": "i-1"}
+    ]
+    create_tags = {"eventName": "CreateTags", "requestParameters": {"resourcesSet": {"items": [{"resourceId": "i-1"}, {"resourceId": "vol-1"}, {"resourceId": "i-2"}]}}}
+    assert [r["id"] for r in parse_event(event("aws.ec2", "AWS API Call via CloudTrail", create_tags))] == ["i-1", "i-2"]
+    assert parse_event(event("aws.rds", "RDS DB Instance Event", {"SourceArn": DB_ARN})) == [ref | {"instance_type": "rds", "id": DB_ARN}]
+    add_tags = {"eventName": "AddTagsToResource", "requestParameters": {"resourceName": DB_ARN}}
+    assert [r["id"] for r in parse_event(event("aws.rds", "AWS API Call via CloudTrail", add_tags))] == [DB_ARN]
+    assert parse_event(event("aws.ec2", "AWS API Call via CloudTrail", {"eventName": "RunInstances"})) == list()
+    assert parse_event(event("aws.s3", "Object Created", dict())) == list()
+
+
+def test_own_tag_writes_are_ignored():
+    resources = {"resourcesSet": {"items": [{"resourceId": "i-1"}]}}
+    own_tags = {"eventName": "CreateTags", "requestParameters": resources | {"tagSet": {"items": [{"key": "aws_cleaner/stop/date", "value": "2020-12-31"}]}}}
+    assert parse_event(event("aws.ec2", "AWS API Call via CloudTrail", own_tags)) == list()
+    other_tags = {"eventName": "CreateTags", "requestParameters": resources | {"tagSet": {"items": [{"key": "aws_cleaner/stop/date"}, {"key": "email"}]}}}
+    assert [r["id"] for r in parse_event(event("aws.ec2", "AWS API Call via CloudTrail", other_tags))] == ["i-1"]
+    remove_tags = {"eventName": "RemoveTagsFromResource", "requestParameters": {"resourceName": DB_ARN, "tagKeys": ["aws_cleaner/stop/log"]}}
+    assert parse_event(event("aws.rds", "AWS API Call via CloudTrail", remove_tags)) == list()
+    add_tags = {"eventName": "AddTagsToResource", "requestParameters": {"resourceName": DB_ARN, "tags": [{"key": "aws_cleaner/stop/log", "value": "x"}]}}
+    assert parse_event(event("aws.rds", "AWS API Call via CloudTrail", add_tags)) == list()
+
+    other_tags["userIdentity"] = {"arn": "arn:aws:sts::123456789012:assumed-role/cleaner/aws-cleaner"}
+    ignored = ["arn:aws:sts::*:assumed-role/*/aws-cleaner"]
+    assert parse_event(event("aws.ec2", "AWS API Call via CloudTrail", other_tags), ignored_principals=ignored) == list()
+    other_tags["userIdentity"] = {"arn": "arn:aws:sts::123456789012:assumed-role/admin/someone"}
+    assert len(parse_event(event("aws.ec2", "AWS API Call via CloudTrail", other_tags), ignored_principals=ignored)) == 1
+
+
+def test_file_event_queue(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    state_change = event("aws.ec2", "EC2 Instance State-change Notification", {"instance-id": "i-1"})
+    with open(path, "w") as f:
+        f.write(json.dumps(state_change) + "\n")
+        f.write("not json\n")
+        f.write(json.dumps(state_change | {"detail": {"instance-id": "i-2"}}) + "\n")
+        # Still being written
+        f.write('{"source": ')
+
+    queue = FileEventQueue(path)
+    handles, refs = receive_events(queue, 2)
+    assert len(handles) == 2 and [r["id"] for r in refs] == ["i-1"]
+    queue.delete(handles)
+    handles, refs = receive_events(queue, 10)
+    assert [r["id"] for r in refs] == ["i-2"]
+    assert receive_events(queue, 10) == (list(), list())
+
+    # Events not deleted are received again by the next reader
+    handles, refs = receive_events(FileEventQueue(path), 10)
+    assert [r["id"] for r in refs] == ["i-2"]
+
+
+def test_process_events_polls(tmp_path, monkeypatch):
+    # Daemon polls share a cache: accounts are looked up once, and a dry run doesn't process the same events again
+    moto = pytest.importorskip("moto")
+    import boto3
+    import yaml
+    import main
+    import utils.aws.accounts as accounts
+    from tests.slack_standin import QuietSlack
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with open(os.path.join("config", "default_config.yaml"), "r") as f:
+        config = yaml.safe_load(f)
+    config["instances"] = {"ec2": config["instances"]["ec2"]}
+    get_accounts = accounts.get_accounts
+    lookups = list()
+    monkeypatch.setattr(accounts, "get_accounts", lambda *args: lookups.append(args) or get_accounts(*args))
+
+    path = str(tmp_path / "events.jsonl")
+    with moto.mock_aws():
+        ids = dict()
+        with open(path, "w") as f:
+            for region in ("us-east-1", "us-west-2"):
+                ec2 = boto3.client("ec2", region_name=region)
+                ids[region] = ec2.run_instances(ImageId="ami-12c6146b", MinCount=1, MaxCount=1)["Instances"][0]["InstanceId"]
+                state_change = event("aws.ec2", "EC2 Instance State-change Notification", {"instance-id": ids[region]})
+                f.write(json.dumps(state_change | {"region": region}) + "\n")
+
+        slack = QuietSlack()
+        cache = {"slack": (config["slack"], slack)}
+        summary = main.process_events(config, path, dry_run=True, regions=["us-east-1"], cache=cache)
+        assert summary.data["events"] == 2
+        assert [text for text in slack.texts if ids["us-east-1"] in text]
+        assert not [text for text in slack.texts if ids["us-west-2"] in text]
+
+        slack.texts.clear()
+        summary = main.process_events(config, path, dry_run=True, regions=["us-east-1"], cache=cache)
+        assert summary.data["events"] == 0
+        assert slack.texts == list()
+        assert len(lookups) == 1
+    assert not os.path.exists("{}.offset".format(path))
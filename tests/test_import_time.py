@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Import-time benchmarks for the Lambda cold start path: importing the handler module, and
+# importing main on the first invocation, must not pull in boto3/requests and must stay cheap.
+#
+import os
+import sys
+import pytest
+import subprocess
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heavy modules that may only be imported once a client is actually created
+HEAVY_MODULES = ("boto3", "botocore", "requests")
+
+# Cumulative import time budgets (microseconds), generous enough for slow CI machines
+IMPORT_BUDGETS = {
+    "lambda_function": 50000,
+    "main": 400000,
+}
+
+
+def import_module(module: str):
+    """
+    Import module in a fresh interpreter; returns (cumulative import time in us, heavy modules loaded)
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "import sys, {}; print(','.join([m for m in {} if m in sys.modules]))".format(module, HEAVY_MODULES),
+        ],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [f.strip() for f in line.split(":", 1)[-1].split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            cumulative = int(fields[1])
+    return cumulative, [m for m in result.stdout.strip().split(",") if m]
+
+
+@pytest.mark.parametrize("module", IMPORT_BUDGETS)
+def test_import_is_lazy(module):
+    cumulative, heavy = import_module(module)
+    print("import {}: {:.1f}ms".format(module, cumulative / 1000))
+    assert heavy == []
+
+
+@pytest.mark.parametrize("module", IMPORT_BUDGETS)
+def test_import_time_budget(module):
+    # Best of three, to keep noise out
+    best = min([import_module(module)[0] for _ in range(3)])
+    assert best < IMPORT_BUDGETS[module]
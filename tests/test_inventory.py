@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import yaml
+import datetime
+
+from benchmarks.inventory import generate_inventory
+
+with open(os.path.join("config", "default_config.yaml"), "r") as f:
+    instances_config = yaml.safe_load(f)["instances"]
+
+run_date = datetime.date(2020, 12, 1)
+
+
+def test_deterministic():
+    assert generate_inventory(200, instances_config, run_date, seed=3) == generate_inventory(200, instances_config, run_date, seed=3)
+    assert generate_inventory(200, instances_config, run_date, seed=3) != generate_inventory(200, instances_config, run_date, seed=4)
+
+
+def test_distributions():
+    inventory = generate_inventory(
+        1000,
+        instances_config,
+        run_date,
+        inventory_config={
+            "types": {"ec2": 1.0},
+            "states": {"ec2": {"running": 1.0}},
+            "histories": {"new": 0.5, "due": 0.5},
+        },
+    )
+    assert {r["type"] for r in inventory} == {"ec2"}
+    assert 400 < len([r for r in inventory if r["history"] == "new"]) < 600
+    for r in inventory:
+        if r["history"] == "new":
+            assert "aws_cleaner/stop/date" not in r["tags"]
+        else:
+            # Due: action date reached, every notification already sent
+            assert datetime.date.fromisoformat(r["tags"]["aws_cleaner/stop/date"]) <= run_date
+            assert "aws_cleaner/stop/notifications/3" in r["tags"]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import datetime
+
+from utils.journal import Journal, load_journal
+from utils.aws.generic_instance import GenericInstance
+
+unit = {
+    "key": "123456789012|us-east-1/ec2",
+    "account": {"id": "123456789012", "name": None, "role_arn": None},
+    "region": "us-east-1",
+    "instance_type": "ec2",
+}
+
+
+def instance(n):
+    return GenericInstance(
+        type="ec2",
+        id="i-{}".format(n),
+        region="us-east-1",
+        name="test-{}".format(n),
+        email="owner@example.com",
+        state="running",
+        exceptions=list(),
+        tags=dict(),
+    )
+
+
+def write_intent(journal, n, action=None):
+    journal.intent(
+        "{}|i-{}".format(unit["key"], n),
+        unit=unit,
+        instance=instance(n),
+        action=action,
+        updated_tags={"aws_cleaner/stop/date": {"old": None, "new": datetime.date(2020, 12, 31)}},
+        messages=[{"text": "message", "log": False, "dm": True, "dm_text": "message", "email": "owner@example.com", "result": "SEND_NOTIFICATION"}],
+    )
+
+
+def test_pending_and_completed(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path, "2020-12-01")
+    write_intent(journal, 1, action="stop")
+    write_intent(journal, 2)
+    journal.sync()
+    for part in ("action", "tags", "message:0"):
+        journal.done("{}|i-1".format(unit["key"]), part)
+    journal.done("{}|i-2".format(unit["key"]), "tags")
+    journal.unit_done("other-unit")
+    journal.close()
+
+    state = load_journal(path, "2020-12-01")
+    assert state["resumable"]
+    assert state["completed"] == {"{}|i-1".format(unit["key"])}
+    assert state["completed_units"] == ["other-unit"]
+    assert [(p["instance"]["id"], p["remaining"]) for p in state["pending"]] == [("i-2", ["message:0"])]
+    assert state["pending"][0]["updated_tags"]["aws_cleaner/stop/date"]["new"] == "2020-12-31"
+
+
+def test_other_day_and_torn_line(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path, "2020-12-01")
+    write_intent(journal, 1)
+    journal.close()
+    with open(path, "a") as f:
+        f.write('{"op": "done", "id": ')
+
+    assert not load_journal(path, "2020-12-02")["resumable"]
+    state = load_journal(path, "2020-12-01")
+    assert len(state["pending"]) == 1
+
+    # Resuming appends to the journal rather than starting a new one
+    Journal(path, "2020-12-01", resume=True).close()
+    assert len(load_journal(path, "2020-12-01")["pending"]) == 1
+    assert not load_journal(str(tmp_path / "missing.jsonl"), "2020-12-01")["resumable"]
+
+
+class FakeClient:
+    def __init__(self):
+        self.tagged = list()
+
+    def do_actions(self, action, instances):
+        return {instance.id: "IncorrectInstanceState" for instance in instances if instance.id == "i-1"}
+
+    def update_tags_batch(self, items):
+        self.tagged += [instance.id for instance, updated_tags in items]
+        return dict()
+
+
+class FakeSlack:
+    def __init__(self):
+        self.texts = list()
+
+    def send_text(self, text, log=False, dedupe=None):
+        self.texts.append(text)
+
+    def send_dm(self, email, text, dedupe=None):
+        self.texts.append(text)
+
+
+def test_replay_marks_only_successful_parts_done(tmp_path):
+    import main
+    from utils.summary import RunSummary
+
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path, "2020-12-01")
+    write_intent(journal, 1, action="stop")
+    write_intent(journal, 2, action="stop")
+    journal.close()
+
+    aws_client = FakeClient()
+    slack_client = FakeSlack()
+    run_summary = RunSummary(run_date="2020-12-01", dry_run=False)
+    journal = Journal(path, "2020-12-01", resume=True)
+    main.replay_journal(
+        load_journal(path, "2020-12-01")["pending"],
+        accounts=[unit["account"]],
+        slack_client=slack_client,
+        session_cache=None,
+        aws_clients={(unit["key"], False): aws_client},
+        journal=journal,
+        notify_messages_config=dict(),
+        email_tags_config=list(),
+        run_summary=run_summary,
+    )
+    journal.close()
+
+    # Tags and messages of the instance whose action failed aren't written or sent
+    assert aws_client.tagged == ["i-2"]
+    assert len(slack_client.texts) == 3
+    assert "Failed to update ec2 instance i-1" in slack_client.texts[0]
+    assert run_summary.data["errors"] == {"action": 1}
+    state = load_journal(path, "2020-12-01")
+    assert [(p["instance"]["id"], p["remaining"]) for p in state["pending"]] == [("i-1", ["action", "tags", "message:0"])]
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import datetime
+
+from utils.ledger import DeliveryLedger
+
+day = datetime.date(2020, 12, 1)
+
+
+def test_keys(tmp_path):
+    ledger_a = DeliveryLedger(str(tmp_path / "a"), day)
+    ledger_b = DeliveryLedger(str(tmp_path / "b"), day + datetime.timedelta(days=1))
+    key = ledger_a.key("C1", "i-1", "SEND_NOTIFICATION")
+    assert len(key) == 20
+    assert key != ledger_a.key("C2", "i-1", "SEND_NOTIFICATION")
+    assert key != ledger_a.key("C1", "i-1", "COMPLETE_ACTION")
+    assert key != ledger_b.key("C1", "i-1", "SEND_NOTIFICATION")
+
+
+def test_persistence_and_retention(tmp_path):
+    path = str(tmp_path / "ledger")
+    ledger = DeliveryLedger(path, day)
+    ledger.record(ledger.key("C1", "i-1", "SEND_NOTIFICATION"))
+    ledger.close()
+    with open(path, "a") as f:
+        f.write("2020-12-01 cut-sh")
+
+    ledger = DeliveryLedger(path, day)
+    assert ledger.delivered(ledger.key("C1", "i-1", "SEND_NOTIFICATION"))
+    assert not ledger.delivered(ledger.key("C1", "i-2", "SEND_NOTIFICATION"))
+    ledger.close()
+
+    # The next day nothing counts as delivered; a week later the entry is dropped from the file
+    ledger = DeliveryLedger(path, day + datetime.timedelta(days=1))
+    assert not ledger.delivered(ledger.key("C1", "i-1", "SEND_NOTIFICATION"))
+    ledger.close()
+    DeliveryLedger(path, day + datetime.timedelta(days=8)).close()
+    with open(path, "r") as f:
+        assert f.read() == ""
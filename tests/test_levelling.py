@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import datetime
+
+import pytest
+
+from utils.levelling import ActionLeveller
+
+d_run_date = datetime.date(2020, 12, 1)
+
+
+def day(n):
+    return d_run_date + datetime.timedelta(days=n)
+
+
+def test_spreads_over_budget():
+    leveller = ActionLeveller(daily_budget=2, window_days=3)
+    leveller.observe(day(31))
+    leveller.observe(None)
+    dates = [leveller.assign(d_run_date, 31, 62) for _ in range(7)]
+    assert dates == [day(31), day(32), day(32), day(33), day(33), day(34), day(34)]
+    assert leveller.levelled == 6
+
+    # Window full: least loaded day of the window
+    assert leveller.assign(d_run_date, 31, 62) == day(31)
+
+
+def test_never_past_max_days():
+    leveller = ActionLeveller(daily_budget=1, window_days=14)
+    dates = [leveller.assign(d_run_date, 31, 33) for _ in range(5)]
+    assert max(dates) == day(33)
+    assert set(dates) == {day(31), day(32), day(33)}
+
+
+def test_levelled_run(monkeypatch):
+    # The dates already scheduled are counted before the first decision, even within the same page
+    moto = pytest.importorskip("moto")
+    import boto3
+    import yaml
+    import main
+    from tests.slack_standin import QuietSlack
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with open(os.path.join("config", "default_config.yaml"), "r") as f:
+        config = yaml.safe_load(f)
+    config["instances"] = {"ec2": config["instances"]["ec2"]}
+    config["global"] = (config.get("global") or dict()) | {"action_levelling": {"daily_budget": 2}}
+
+    with moto.mock_aws():
+        ec2 = boto3.client("ec2", region_name="us-east-1")
+        ids = [i["InstanceId"] for i in ec2.run_instances(ImageId="ami-12c6146b", MinCount=4, MaxCount=4)["Instances"]]
+        ec2.create_tags(Resources=ids[2:], Tags=[{"Key": "aws_cleaner/stop/date", "Value": str(day(31))}])
+        main.run(config, run_date=d_run_date, regions=["us-east-1"], cache={"slack": (config["slack"], QuietSlack())})
+        dates = {
+            i["InstanceId"]: {tag["Key"]: tag["Value"] for tag in i.get("Tags", list())}.get("aws_cleaner/stop/date")
+            for r in ec2.describe_instances()["Reservations"]
+            for i in r["Instances"]
+        }
+
+    assert [dates[id] for id in ids] == [str(day(32)), str(day(32)), str(day(31)), str(day(31))]
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import time
+
+from utils.metrics import Metrics
+
+
+def test_phases_and_labels():
+    metrics = Metrics()
+    metrics.observe("get_instances", 0.02, items=100, region="us-east-1", type="ec2")
+    metrics.observe("get_instances", 0.3, items=50, region="us-east-1", type="ec2")
+    metrics.observe("get_instances", 0.1, items=10, region="us-west-2", type="ec2")
+    with metrics.timer("decision", items=3):
+        pass
+
+    phases = {(p["phase"], tuple(p["labels"].items())): p for p in metrics.to_dict()}
+    east = phases[("get_instances", (("region", "us-east-1"), ("type", "ec2")))]
+    assert east["count"] == 2
+    assert east["items"] == 150
+    assert east["histogram"]["0.025"] == 1
+    assert east["histogram"]["0.5"] == 1
+    assert phases[("decision", ())]["items"] == 3
+
+
+def test_prometheus_histogram_is_cumulative():
+    metrics = Metrics()
+    for seconds in (0.001, 0.2, 0.2, 45):
+        metrics.observe("slack_send", seconds)
+    text = metrics.to_prometheus()
+    assert 'aws_cleaner_call_duration_seconds_bucket{phase="slack_send",le="0.005"} 1' in text
+    assert 'aws_cleaner_call_duration_seconds_bucket{phase="slack_send",le="0.25"} 3' in text
+    assert 'aws_cleaner_call_duration_seconds_bucket{phase="slack_send",le="+Inf"} 4' in text
+    assert 'aws_cleaner_call_duration_seconds_count{phase="slack_send"} 4' in text
+
+
+def test_write(tmp_path):
+    metrics = Metrics()
+    metrics.observe("run", 1.5)
+    metrics.write(
+        prometheus_file=str(tmp_path / "cleaner.prom"),
+        json_file=str(tmp_path / "metrics.json"),
+    )
+    assert 'aws_cleaner_phase_seconds_total{phase="run"} 1.500000' in (tmp_path / "cleaner.prom").read_text()
+    assert json.loads((tmp_path / "metrics.json").read_text())[0]["phase"] == "run"
+
+
+def test_overhead():
+    # Recording must stay in the microsecond range (API calls take tens of milliseconds)
+    metrics = Metrics()
+    start = time.perf_counter()
+    for _ in range(10000):
+        with metrics.timer("decision", type="ec2"):
+            pass
+    assert (time.perf_counter() - start) / 10000 < 0.0001
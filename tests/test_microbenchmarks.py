@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pytest
+
+from utils import determine_action
+from benchmarks.micro import (
+    DETERMINE_ACTION_CASES,
+    RUN_DATE,
+    cases,
+    compare,
+    load_config,
+    load_baseline,
+    measure,
+)
+
+config = load_config()
+benchmarks = cases(config)
+baseline = load_baseline()
+
+
+@pytest.mark.parametrize("result", list(DETERMINE_ACTION_CASES))
+def test_cases_cover_every_branch(result):
+    # Always run: each determine_action benchmark must exercise the branch it is named after
+    action_date, idn_notification = DETERMINE_ACTION_CASES[result]
+    r = determine_action(
+        d_run_date=RUN_DATE,
+        idn_action_date=action_date,
+        i_default_days=31,
+        i_max_days=62,
+        idn_notification=idn_notification,
+        notify_messages_config=config["notify_messages"],
+    )
+    assert r["result"] == result
+
+
+def test_compare_relative_costs():
+    # Always run: only the cost relative to the calibration loop is compared
+    recorded = {"benchmarks": {"case": 100.0}, "relative": {"case": 2.0}}
+    assert compare("case", 2.5, recorded, 0.3) == (2.0, False)
+    assert compare("case", 2.7, recorded, 0.3) == (2.0, True)
+    assert compare("missing", 2.7, recorded, 0.3) == (None, False)
+
+
+@pytest.mark.parametrize("name", list(benchmarks))
+def test_microbenchmark(name, request):
+    if not request.config.getoption("benchmark"):
+        pytest.skip("microbenchmarks only run with --benchmark")
+    ns, relative = measure(benchmarks[name])
+    base, regressed = compare(name, relative, baseline, request.config.getoption("benchmark_threshold"))
+    assert base is not None, "no baseline for {}, run python -m benchmarks.micro --save-baseline".format(name)
+    assert not regressed, "{} costs {:.4g}x the calibration loop ({:.1f} ns per call), baseline is {:.4g}x".format(
+        name,
+        relative,
+        ns,
+        base,
+    )
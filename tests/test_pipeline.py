@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+
+from utils.pipeline import Pipeline
+
+
+def test_pipeline_passes_every_item_through():
+    results = list()
+    lock = threading.Lock()
+
+    def collect(item):
+        with lock:
+            results.append(item)
+
+    pipeline = Pipeline(queue_size=2)
+    pipeline.add_stage("pages", lambda n: [[n * 10 + i for i in range(3)]], workers=3)
+    pipeline.add_stage("split", lambda page: page, workers=2)
+    pipeline.add_stage("collect", collect, workers=2)
+    pipeline.run(range(20))
+
+    assert sorted(results) == sorted(n * 10 + i for n in range(20) for i in range(3))
+
+
+def test_pipeline_batches():
+    batches = list()
+
+    def collect(batch):
+        batches.append(batch)
+        return batch
+
+    pipeline = Pipeline(queue_size=100)
+    pipeline.add_stage("batch", collect, workers=1, batch_size=4)
+    pipeline.run(range(10))
+
+    assert sum(len(batch) for batch in batches) == 10
+    assert max(len(batch) for batch in batches) <= 4
+
+
+def test_pipeline_error_does_not_stop_stage():
+    results = list()
+
+    def fail_on_three(n):
+        if n == 3:
+            raise ValueError("boom")
+        return [n]
+
+    pipeline = Pipeline()
+    pipeline.add_stage("fail", fail_on_three)
+    pipeline.add_stage("collect", lambda n: results.append(n))
+    pipeline.run(range(5))
+
+    assert sorted(results) == [0, 1, 2, 4]
+
+
+def test_pipeline_should_stop():
+    results = list()
+    pipeline = Pipeline()
+    pipeline.add_stage("collect", lambda n: results.append(n))
+
+    assert pipeline.run(range(10), should_stop=lambda: True) == 0
+    assert pipeline.run(range(10)) == 10
+
+
+def test_urgency_order():
+    from main import urgency
+    from utils.result import Result
+
+    def record(*results):
+        return {"messages": [{"details": {"result": result}} for result in results]}
+
+    records = [
+        record(Result.LOG_NO_NOTIFICATION),
+        record(Result.ADD_ACTION_DATE),
+        record(Result.SEND_NOTIFICATION),
+        record(),
+        record(Result.COMPLETE_ACTION, Result.TRANSITION_ACTION),
+        record(Result.PAST_BUMP_NOTIFICATION),
+    ]
+    assert [urgency(r) for r in sorted(records, key=urgency)] == [0, 1, 1, 2, 3, 3]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import boto3
+import pytest
+
+from utils.plan import Plan, load_plan, tags_fingerprint
+from utils.aws.generic_instance import GenericInstance
+
+unit = {
+    "key": "123456789012|us-east-1/ec2",
+    "account": {"id": "123456789012", "name": None, "role_arn": None},
+    "region": "us-east-1",
+    "instance_type": "ec2",
+}
+
+
+def instance(id, tags):
+    return GenericInstance(
+        type="ec2",
+        id=id,
+        region="us-east-1",
+        name=None,
+        email="owner@example.com",
+        state="running",
+        exceptions=list(),
+        tags=tags,
+    )
+
+
+def test_fingerprint():
+    assert tags_fingerprint({"a": "1", "b": "2"}) == tags_fingerprint({"b": "2", "a": "1"})
+    assert tags_fingerprint({"a": "1"}) != tags_fingerprint({"a": "2"})
+    assert tags_fingerprint(None) == tags_fingerprint(dict())
+
+
+def test_plan_round_trip(tmp_path):
+    path = str(tmp_path / "out.plan")
+    plan = Plan(path, "2020-12-01")
+    plan.add(
+        {
+            "journal_id": "{}|i-1".format(unit["key"]),
+            "unit": unit,
+            "instance": instance("i-1", {"email": "owner@example.com"}),
+            "action": "stop",
+            "updated_tags": dict(),
+            "messages": list(),
+        },
+        messages=list(),
+    )
+    plan.close()
+
+    run_date, intents = load_plan(path)
+    assert run_date == "2020-12-01"
+    assert [(i["instance"]["id"], i["action"]) for i in intents] == [("i-1", "stop")]
+    assert intents[0]["fingerprint"] == tags_fingerprint({"email": "owner@example.com"})
+
+    with open(path, "a") as f:
+        f.write('{"op": "intent", ')
+    with pytest.raises(ValueError):
+        load_plan(path)
+
+
+def test_ec2_get_tags(monkeypatch):
+    moto = pytest.importorskip("moto")
+    from utils.aws.ec2_client import EC2Client
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        ec2 = boto3.client("ec2", region_name="us-east-1")
+        ids = [i["InstanceId"] for i in ec2.run_instances(ImageId="ami-12c6146b", MinCount=3, MaxCount=3)["Instances"]]
+        ec2.create_tags(Resources=ids[:1], Tags=[{"Key": "email", "Value": "owner@example.com"}])
+
+        client = EC2Client("us-east-1", email_tags=["email"])
+        tags = client.get_tags([instance(id, dict()) for id in ids + ["i-00000000000000000"]])
+        assert tags == {ids[0]: {"email": "owner@example.com"}, ids[1]: dict(), ids[2]: dict()}
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import time
+import pstats
+import threading
+
+from utils import date_or_none
+from utils.pipeline import Pipeline
+from utils.profiling import Profiler, thread_phase, PROCESS_WIDE_PROFILER, ALL_PHASES
+
+
+def work(seconds=0.0):
+    for _ in range(100):
+        date_or_none({"aws_cleaner/stop/date": "2020-12-31"}, "aws_cleaner/stop/date")
+    time.sleep(seconds)
+
+
+def run_in_stage(name, seconds=0.0):
+    thread = threading.Thread(target=work, args=(seconds,), name=name)
+    thread.start()
+    thread.join()
+
+
+def test_thread_phase():
+    assert thread_phase("decision-0") == "decision"
+    assert thread_phase("notification-12") == "notification"
+    assert thread_phase("MainThread") == "main"
+
+
+def test_deterministic(tmp_path):
+    profiler = Profiler("deterministic")
+    with profiler:
+        work()
+        run_in_stage("decision-0")
+    report = profiler.write(str(tmp_path / "run.pstats"))
+
+    if PROCESS_WIDE_PROFILER:
+        assert report["hot_spots"][("date_or_none", ALL_PHASES)]["calls"] == 200
+    else:
+        assert report["hot_spots"][("date_or_none", "main")]["calls"] == 100
+        assert report["hot_spots"][("date_or_none", "decision")]["calls"] == 100
+    stats = pstats.Stats(str(tmp_path / "run.pstats"))
+    assert sum([v[1] for k, v in stats.stats.items() if k[2] == "date_or_none"]) == 200
+
+
+def test_deterministic_pipeline(tmp_path):
+    processed = list()
+    pipeline = Pipeline(queue_size=4)
+    pipeline.add_stage("decision", lambda n: work() or [n], workers=3)
+    pipeline.add_stage("notification", processed.append, workers=2)
+    profiler = Profiler("deterministic")
+    with profiler:
+        pipeline.run(range(12))
+    report = profiler.write(str(tmp_path / "run.pstats"))
+
+    # Every worker ran (none failed to start a profiler of its own)
+    assert sorted(processed) == list(range(12))
+    assert sum(values["calls"] for (name, phase), values in report["hot_spots"].items() if name == "date_or_none") == 1200
+    stats = pstats.Stats(str(tmp_path / "run.pstats"))
+    assert sum([v[1] for k, v in stats.stats.items() if k[2] == "date_or_none"]) == 1200
+
+
+def test_sampling(tmp_path):
+    profiler = Profiler("sampling", interval=0.001)
+    with profiler:
+        run_in_stage("decision-0", seconds=0.2)
+    report = profiler.write(str(tmp_path / "run.collapsed"))
+
+    assert report["phases"]["decision"] > 0
+    lines = (tmp_path / "run.collapsed").read_text().splitlines()
+    assert any([line.startswith("decision;") and line.rsplit(" ", 1)[1].isdigit() for line in lines])
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+import utils.aws.aws_client as aws_client
+from utils.aws.generic_instance import GenericInstance
+
+moto = pytest.importorskip("moto")
+
+instance_config = {"tags": {"t_standalone_stopped": "aws_cleaner/stop/log"}, "exceptions": list(), "filters": None}
+
+
+@pytest.fixture()
+def rds(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        rds = boto3.client("rds", region_name="us-east-1")
+        for n in range(25):
+            rds.create_db_instance(DBInstanceIdentifier="db{}".format(n), DBInstanceClass="db.t3.micro", Engine="postgres")
+        yield rds
+
+
+def rds_client(dry_run=False):
+    from utils.aws.rds_client import RDSClient
+
+    return RDSClient("us-east-1", dry_run=dry_run, max_results=20, service_name="rds", email_tags=["email"])
+
+
+def test_pagination(rds):
+    pages = list(rds_client().get_instance_pages(instance_config))
+    assert [len(page) for page in pages] == [20, 5]
+
+
+def test_actions_and_tags_capture_errors(rds):
+    client = rds_client()
+    instances = [instance for page in client.get_instance_pages(instance_config) for instance in page][:5]
+    missing = GenericInstance(
+        type="rds",
+        id="arn:aws:rds:us-east-1:123456789012:db:missing",
+        region="us-east-1",
+        name="missing",
+        email=None,
+        state="standalone:available",
+        exceptions=list(),
+        tags=dict(),
+    )
+
+    failed = client.do_actions("stop", instances + [missing])
+    assert list(failed) == [missing.id]
+    assert {i["DBInstanceStatus"] for i in rds.describe_db_instances()["DBInstances"][:5]} == {"stopped"}
+
+    assert client.update_tags_batch([(instance, {"aws_cleaner/stop/log": {"old": None, "new": "stop"}}) for instance in instances]) == dict()
+    assert client.get_tags(instances)[instances[0].id] == {"aws_cleaner/stop/log": "stop"}
+
+
+def test_run_concurrently_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(aws_client, "RETRY_BACKOFF_SECONDS", 0)
+    client = aws_client.AWSClient("us-east-1")
+    calls = dict()
+
+    def flaky(key, status):
+        calls[key] = calls.get(key, 0) + 1
+        if calls[key] < 2:
+            raise ClientError({"Error": {"Code": "Error"}, "ResponseMetadata": {"HTTPStatusCode": status}}, "Call")
+
+    failed = client.run_concurrently([(key, flaky, {"key": key, "status": status}) for key, status in (("a", 500), ("b", 400))])
+    assert calls == {"a": 2, "b": 1}
+    assert list(failed) == ["b"]
+
+
+def test_tagging_api_writer(rds):
+    from utils.aws.rds_client import RDSClient
+
+    client = RDSClient("us-east-1", dry_run=False, service_name="rds", email_tags=["email"], tag_writer="tagging_api")
+    instances = [instance for page in client.get_instance_pages(instance_config) for instance in page]
+    unsupported = GenericInstance(
+        type="rds",
+        id="arn:aws:autoscaling:us-east-1:123456789012:autoScalingGroup:x:autoScalingGroupName/y",
+        region="us-east-1",
+        name="y",
+        email=None,
+        state="standalone:available",
+        exceptions=list(),
+        tags=dict(),
+    )
+    calls = list()
+    tag_resources = client.tagging_client().tag_resources
+
+    def counting_tag_resources(**kwargs):
+        calls.append(len(kwargs["ResourceARNList"]))
+        return tag_resources(**kwargs)
+
+    client.tagging_client().tag_resources = counting_tag_resources
+    items = [(instance, {"aws_cleaner/stop/date": {"old": None, "new": "2020-12-31"}}) for instance in instances[:21]]
+    items += [(instance, {"aws_cleaner/stop/date": {"old": None, "new": "2021-01-01"}}) for instance in instances[21:]]
+
+    failed = client.update_tags_batch(items + [(unsupported, {"aws_cleaner/stop/date": {"old": None, "new": "2021-01-01"}})])
+    # One call per tag set and 20 ARNs; the ARN the tagging API refused is retried on its own (and fails again)
+    assert calls == [20, 1, 5]
+    assert list(failed) == [unsupported.id]
+    tags = client.get_tags(instances)
+    assert tags[instances[0].id]["aws_cleaner/stop/date"] == "2020-12-31"
+    assert tags[instances[-1].id]["aws_cleaner/stop/date"] == "2021-01-01"
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import json
+import time
+import threading
+
+import pytest
+
+from utils import Result
+from utils.shard import unit_key, parse_shard, in_shard, LeaseManager
+from utils.summary import RunSummary
+from tests.slack_standin import QuietSlack
+
+keys = [
+    unit_key(account, region, instance_type)
+    for account in ("111111111111", "222222222222", None)
+    for region in ("us-east-1", "us-west-2", "eu-west-1", "ap-southeast-1")
+    for instance_type in ("ec2", "rds", "autoscaling")
+]
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    with pytest.raises(ValueError):
+        parse_shard("0/4")
+    with pytest.raises(ValueError):
+        parse_shard("5/4")
+    with pytest.raises(ValueError):
+        parse_shard("two")
+
+
+def test_every_unit_in_exactly_one_shard():
+    for key in keys:
+        assert sum([1 for k in range(1, 5) if in_shard(key, (k, 4))]) == 1
+    assert all([in_shard(key, None) for key in keys])
+
+
+def test_lease_exclusive(tmp_path):
+    first = LeaseManager(str(tmp_path))
+    second = LeaseManager(str(tmp_path))
+    assert first.acquire(keys[0])
+    assert not second.acquire(keys[0])
+    first.release_all()
+    assert second.acquire(keys[0])
+
+
+def test_expired_lease_taken_over(tmp_path):
+    first = LeaseManager(str(tmp_path), ttl=-1)
+    second = LeaseManager(str(tmp_path))
+    assert first.acquire(keys[0])
+    assert second.acquire(keys[0])
+
+
+def test_expired_lease_taken_over_once(tmp_path):
+    LeaseManager(str(tmp_path), ttl=-1).acquire(keys[0])
+    managers = [LeaseManager(str(tmp_path)) for _ in range(8)]
+    barrier = threading.Barrier(len(managers))
+    acquired = list()
+
+    def take_over(manager):
+        barrier.wait()
+        acquired.append(manager.acquire(keys[0]))
+
+    threads = [threading.Thread(target=take_over, args=(manager,)) for manager in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(acquired) == [False] * 7 + [True]
+
+
+def test_lease_renewal(tmp_path):
+    manager = LeaseManager(str(tmp_path), ttl=2)
+    assert manager.acquire(keys[0])
+    path = manager._path(keys[0])
+    with open(path) as f:
+        expires = json.load(f)["expires"]
+    # Not renewed before half the ttl has passed
+    assert manager.renew(keys[0])
+    with open(path) as f:
+        assert json.load(f)["expires"] == expires
+    time.sleep(1.1)
+    assert manager.renew(keys[0])
+    with open(path) as f:
+        assert json.load(f)["expires"] > expires
+
+    # Lost once another process took it over
+    with open(path, "w") as f:
+        json.dump({"owner": "other:1", "expires": time.time() + 60}, f)
+    manager._held[keys[0]] = 0
+    assert not manager.renew(keys[0])
+    assert not manager.renew(keys[0])
+    manager.release_all()
+    assert os.path.exists(path)
+
+
+def test_merge_summaries(tmp_path):
+    shards = list()
+    for k, key in enumerate(keys[:2]):
+        summary = RunSummary(shard="{}/2".format(k + 1))
+        summary.add_unit(key, "dev", "us-east-1", "ec2", {"running": 2}, {"pending": 1})
+        summary.add_result(Result.ADD_ACTION_DATE)
+        summary.finish()
+        summary.save(str(tmp_path / "{}.json".format(k)))
+        shards.append(RunSummary.load(str(tmp_path / "{}.json".format(k))))
+
+    merged = RunSummary.merge(shards)
+    assert merged.data["shards"] == ["1/2", "2/2"]
+    assert sorted(merged.data["units"]) == sorted(keys[:2])
+    assert merged.data["results"] == {"ADD_ACTION_DATE": 2}
+    assert merged.unit_lines(keys[0]) == [
+        "[dev] Total ec2 instances found in region us-east-1: 3",
+        "[dev] 2 will be processed: 2 running",
+        "[dev] 1 will not be processed (not currently handled by script): 1 pending",
+    ]
+
+
+def test_unit_completed_callback():
+    completed = list()
+    summary = RunSummary(on_unit_completed=completed.append)
+    summary.add_processed(keys[0])
+    assert completed == list()
+    summary.add_unit(keys[0], "dev", "us-east-1", "ec2", {"running": 2}, dict())
+    assert completed == list()
+    assert summary.add_processed(keys[0])
+    summary.add_unit(keys[1], "dev", "us-east-1", "rds", dict(), dict())
+    assert completed == keys[:2]
+
+
+def test_stop_before_actuation(monkeypatch):
+    # Records already decided when the run has to stop are neither acted on nor notified, and their unit stays
+    # incomplete so it is checkpointed as unfinished
+    moto = pytest.importorskip("moto")
+    import boto3
+    import yaml
+    import main
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with open(os.path.join("config", "default_config.yaml"), "r") as f:
+        config = yaml.safe_load(f)
+    config["instances"] = {"ec2": config["instances"]["ec2"]}
+
+    stop = list()
+    decide = main.decide
+
+    def decide_then_stop(*args, **kwargs):
+        records = list(decide(*args, **kwargs))
+        stop.append(True)
+        return records
+
+    monkeypatch.setattr(main, "decide", decide_then_stop)
+    with moto.mock_aws():
+        ec2 = boto3.client("ec2", region_name="us-east-1")
+        ec2.run_instances(ImageId="ami-12c6146b", MinCount=3, MaxCount=3)
+        slack = QuietSlack()
+        completed = list()
+        summary = main.run(
+            config,
+            regions=["us-east-1"],
+            cache={"slack": (config["slack"], slack)},
+            should_stop=lambda: bool(stop),
+            on_unit_completed=completed.append,
+        )
+        tags = [tag["Key"] for r in ec2.describe_instances()["Reservations"] for i in r["Instances"] for tag in i.get("Tags", list())]
+
+    assert stop
+    assert summary.data["deferred"] == 3
+    assert summary.data["results"] == dict()
+    assert completed == list()
+    assert [key for key in tags if key.startswith("aws_cleaner/")] == list()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import datetime
+import boto3
+import pytest
+
+from utils.slack_client import SlackClient
+from tests.slack_standin import SlackStandIn
+
+moto = pytest.importorskip("moto")
+
+
+@pytest.fixture()
+def slack_client_for(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        boto3.client("secretsmanager", region_name="us-east-1").create_secret(
+            Name="slack",
+            SecretString=json.dumps({"token": "xoxb-test", "channel_id": "C1", "log_channel_id": "C2"}),
+        )
+
+        def slack_client_for(standin):
+            return SlackClient(
+                {
+                    "channel_key": "channel_id",
+                    "log_channel_key": "log_channel_id",
+                    "token_secret_key": "token",
+                    "token_secret_name": "slack",
+                    "token_secret_region": "us-east-1",
+                    "chat_post_message_endpoint": standin.url("chat.postMessage"),
+                    "user_lookup_endpoint": standin.url("users.lookupByEmail"),
+                    "post_interval_seconds": 0,
+                }
+            )
+
+        yield slack_client_for
+
+
+def test_send_text_and_dm(slack_client_for):
+    with SlackStandIn(token="xoxb-test", channel_rate=None) as standin:
+        slack_client = slack_client_for(standin)
+        slack_client.dlog_and_send_text("Running cleaner")
+        slack_client.send_dm("Notification #1", "owner@example.com")
+        slack_client.send_dm("Notification #2", "owner@example.com")
+
+    assert [(m["channel"], m["text"]) for m in standin.messages[:2]] == [("C1", "Running cleaner"), ("C2", "Running cleaner")]
+    assert standin.messages[2]["channel"] == standin.users["owner@example.com"]
+    # The user ID is looked up once
+    assert standin.calls["users.lookupByEmail"] == 1
+
+
+def test_retry_after(slack_client_for):
+    with SlackStandIn(channel_rate=5, channel_burst=1) as standin:
+        slack_client = slack_client_for(standin)
+        responses = [slack_client.send_text("Message {}".format(n)) for n in range(3)]
+
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert standin.rate_limited["chat.postMessage"] >= 1
+    assert [m["text"] for m in standin.messages] == ["Message 0", "Message 1", "Message 2"]
+
+
+def test_errors_are_not_retried(slack_client_for):
+    with SlackStandIn(error_rate=1.0) as standin:
+        slack_client = slack_client_for(standin)
+        response = slack_client.send_text("Message")
+
+    assert response.status_code == 500
+    assert standin.calls["chat.postMessage"] == 1
+    assert standin.messages == list()
+
+
+def test_delivery_ledger(slack_client_for, tmp_path):
+    from utils.ledger import DeliveryLedger
+
+    run_date = datetime.date(2020, 12, 1)
+    with SlackStandIn(channel_rate=None) as standin:
+        slack_client = slack_client_for(standin)
+        slack_client.ledger = DeliveryLedger(str(tmp_path / "ledger"), run_date)
+        slack_client.send_text("Notification #1", dedupe=("i-1", "SEND_NOTIFICATION"))
+        slack_client.send_dm("Notification #1", "owner@example.com", dedupe=("i-1", "SEND_NOTIFICATION"))
+        slack_client.ledger.close()
+
+        # Rerun on the same day: nothing is sent again, and no user lookup is needed
+        slack_client = slack_client_for(standin)
+        slack_client.ledger = DeliveryLedger(str(tmp_path / "ledger"), run_date)
+        assert slack_client.send_text("Notification #1", dedupe=("i-1", "SEND_NOTIFICATION")) is None
+        assert slack_client.send_dm("Notification #1", "owner@example.com", dedupe=("i-1", "SEND_NOTIFICATION")) is None
+        slack_client.send_text("Notification #1", dedupe=("i-2", "SEND_NOTIFICATION"))
+        slack_client.send_text("Running cleaner")
+        assert slack_client.ledger.skipped == 2
+
+    assert [m["text"] for m in standin.messages] == [
+        "Notification #1",
+        "Notification #1 [Details: <#C1>]",
+        "Notification #1",
+        "Running cleaner",
+    ]
+    assert standin.calls["users.lookupByEmail"] == 1
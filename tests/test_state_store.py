@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import datetime
+
+import utils.state_store as state_store
+from utils.state_store import StateStore
+from utils.aws.generic_instance import GenericInstance
+
+RUN_DATE = datetime.date(2020, 12, 1)
+unit = {
+    "type_config": {
+        "states": {
+            "running": {"action": "stop", "action_tag": "aws_cleaner/stop/date"},
+            "stopped": {"action": "terminate", "action_tag": "aws_cleaner/terminate/date"},
+        },
+    },
+}
+
+
+def record(id, state, email, tags, updated_tags=None, errors=None):
+    return {
+        "instance": GenericInstance(
+            type="ec2",
+            id=id,
+            region="us-east-1",
+            name=id,
+            email=email,
+            state=state,
+            exceptions=list(),
+            tags=tags,
+        ),
+        "action": None,
+        "updated_tags": updated_tags or dict(),
+        "messages": [{"details": {"result": "ADD_ACTION_DATE"}}] if updated_tags else list(),
+        "unit": unit,
+        "errors": errors or dict(),
+    }
+
+
+def new_date(days):
+    return {"aws_cleaner/terminate/date": {"old": None, "new": RUN_DATE + datetime.timedelta(days=days)}}
+
+
+def test_state_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(state_store, "STATE_STORE_BATCH_SIZE", 2)
+    path = str(tmp_path / "state.db")
+    store = StateStore(path, RUN_DATE)
+    store.observe(
+        [
+            record("i-1", "stopped", "b@example.com", dict(), new_date(3)),
+            record("i-2", "stopped", "a@example.com", {"aws_cleaner/terminate/date": "2020-12-05"}),
+            record("i-3", "stopped", "a@example.com", dict(), new_date(30)),
+            # Tags not written: still no date
+            record("i-4", "stopped", "a@example.com", dict(), new_date(1), errors={"tags": "denied"}),
+            record("i-5", "running", "a@example.com", {"aws_cleaner/stop/date": "2020-12-02"}),
+        ]
+    )
+    store.notified("i-1", "ADD_ACTION_DATE", email="b@example.com", dm=True)
+    store.close()
+
+    store = StateStore(path, RUN_DATE + datetime.timedelta(days=1), retention_days=None)
+    upcoming = store.upcoming(7, action="terminate", today=RUN_DATE)
+    assert [(row["email"], row["id"], row["action_date"]) for row in upcoming] == [
+        ("a@example.com", "i-2", "2020-12-05"),
+        ("b@example.com", "i-1", "2020-12-04"),
+    ]
+    assert [row["id"] for row in store.upcoming(7, today=RUN_DATE)] == ["i-5", "i-2", "i-1"]
+    assert store._db.execute("SELECT COUNT(*) FROM decisions").fetchone() == (3,)
+    assert store._db.execute("SELECT resource_id, dm FROM notifications").fetchall() == [("i-1", 1)]
+    store.close()
+
+    # History past the retention is dropped when the store is opened
+    store = StateStore(path, RUN_DATE + datetime.timedelta(days=100), retention_days=90)
+    assert store._db.execute("SELECT COUNT(*) FROM decisions").fetchone() == (0,)
+    assert store._db.execute("SELECT COUNT(*) FROM resources").fetchone() == (5,)
+    store.close()
+
+
+def test_state_after_action(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"), RUN_DATE)
+    states = unit["type_config"]["states"] | {"running": unit["type_config"]["states"]["running"] | {"next_state": "stopped"}}
+    stopped = record("i-1", "running", "a@example.com", {"aws_cleaner/stop/date": "2020-12-01"}, new_date(31))
+    terminated = record("i-2", "stopped", "a@example.com", {"aws_cleaner/terminate/date": "2020-12-01"})
+    for r, action in ((stopped, "stop"), (terminated, "terminate")):
+        r["action"] = action
+        r["unit"] = {"type_config": {"states": states}}
+    store.observe([stopped, terminated])
+    assert store._db.execute("SELECT id, state, action, action_date FROM resources ORDER BY id").fetchall() == [
+        ("i-1", "stopped", "terminate", "2021-01-01"),
+        ("i-2", "terminate", None, None),
+    ]
+    store.close()
+
+
+def test_applied_plan_records(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"), RUN_DATE)
+    planned = record("i-1", "running", "a@example.com", {"email": "a@example.com"}, new_date(31))
+    # Records of --apply carry the plan's intent (journal format messages) instead of decision messages
+    del planned["messages"]
+    planned["intent"] = {"messages": [{"result": "ADD_ACTION_DATE", "email": "a@example.com", "dm": True}]}
+    store.observe([planned])
+    assert store._db.execute("SELECT resource_id, result FROM decisions").fetchall() == [("i-1", "ADD_ACTION_DATE")]
+    assert store._db.execute("SELECT tags FROM resources").fetchall() == [
+        ('{"aws_cleaner/terminate/date": "2021-01-01", "email": "a@example.com"}',)
+    ]
+    store.close()
+
+
+def test_upcoming_uses_an_index(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"), RUN_DATE)
+    plan = store._db.execute(
+        "EXPLAIN QUERY PLAN SELECT email, action_date, action, type, id, name, region, account FROM resources "
+        "WHERE action_date >= ? AND action_date <= ? ORDER BY email, action_date, id",
+        ("2020-12-01", "2020-12-08"),
+    ).fetchall()
+    assert any("resources_upcoming" in row[-1] for row in plan)
+    store.close()
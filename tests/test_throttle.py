@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import time
+import threading
+
+from utils.aws.throttle import Throttle, ThrottleRegistry, api_family
+
+
+def test_api_family():
+    assert api_family("DescribeInstances") == "read"
+    assert api_family("ListTagsForResource") == "read"
+    assert api_family("CreateTags") == "write"
+    assert api_family("StopDBInstance") == "write"
+
+
+def test_aimd():
+    throttle = Throttle(rate=10, increase=1, decrease=0.5, min_rate=2, max_rate=12, cooldown=0)
+    throttle.on_success()
+    assert throttle.rate == 11
+    throttle.on_success()
+    throttle.on_success()
+    assert throttle.rate == 12
+    throttle.on_throttle()
+    assert throttle.rate == 6
+    throttle.on_throttle()
+    throttle.on_throttle()
+    assert throttle.rate == 2
+    assert throttle.throttles == 3
+
+
+def test_throttle_cooldown():
+    throttle = Throttle(rate=10, decrease=0.5, cooldown=60)
+    assert throttle.on_throttle()
+    assert not throttle.on_throttle()
+    assert throttle.rate == 5
+
+
+def test_rate_shared_across_threads():
+    # 20 calls across 4 threads with no burst at 100/s take at least ~0.2s in total
+    throttle = Throttle(rate=100, burst=0, increase=0)
+    start = time.monotonic()
+    threads = [threading.Thread(target=lambda: [throttle.acquire() for _ in range(5)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start >= 0.18
+    assert throttle.calls == 20
+
+
+def test_registry_shares_throttles():
+    registry = ThrottleRegistry({"rate": 3})
+    assert registry.get("us-east-1", "ec2", "read") is registry.get("us-east-1", "ec2", "read")
+    assert registry.get("us-east-1", "ec2", "read") is not registry.get("us-east-1", "ec2", "write")
+    assert registry.get("us-east-1", "rds", "read").rate == 3
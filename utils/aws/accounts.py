@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import boto3
+import logging
+import threading
+import botocore.session
+from botocore.credentials import RefreshableCredentials
+
+from .aws_client import _client_lock
+
+
+class SessionCache:
+    """
+    One boto3 session per role ARN, shared by every client of that account.
+    Assumed-role credentials are refreshable: botocore only calls AssumeRole again
+    shortly before the current credentials expire.
+    """
+
+    def __init__(
+        self,
+        session_name: str = "aws-cleaner",
+        external_id: str = None,
+        duration_seconds: int = 3600,
+    ) -> None:
+        self._session_name = session_name
+        self._external_id = external_id
+        self._duration_seconds = duration_seconds
+        self._sessions = dict()
+        self._lock = threading.Lock()
+        # Ambient credentials, used to call STS/Organizations and for accounts without a role
+        self.default_session = boto3.Session()
+        self._sts = None
+
+    def get_session(
+        self,
+        role_arn: str = None,
+    ):
+        if not role_arn:
+            return self.default_session
+        with self._lock:
+            session = self._sessions.get(role_arn)
+        if session is None:
+            # Assume roles outside the lock so accounts don't wait on each other
+            session = self._assume_role_session(role_arn)
+            with self._lock:
+                session = self._sessions.setdefault(role_arn, session)
+        return session
+
+    def _sts_client(
+        self,
+    ):
+        # Created once, under the lock every client of a shared session is created with (sessions aren't thread-safe);
+        # the client itself is
+        with _client_lock:
+            if self._sts is None:
+                self._sts = self.default_session.client("sts")
+            return self._sts
+
+    def _assume_role(
+        self,
+        role_arn: str,
+    ):
+        logging.info("Assuming role {}".format(role_arn))
+        params = {
+            "RoleArn": role_arn,
+            "RoleSessionName": self._session_name,
+            "DurationSeconds": self._duration_seconds,
+        }
+        if self._external_id:
+            params["ExternalId"] = self._external_id
+        credentials = self._sts_client().assume_role(**params)["Credentials"]
+        return {
+            "access_key": credentials["AccessKeyId"],
+            "secret_key": credentials["SecretAccessKey"],
+            "token": credentials["SessionToken"],
+            "expiry_time": credentials["Expiration"].isoformat(),
+        }
+
+    def _assume_role_session(
+        self,
+        role_arn: str,
+    ):
+        credentials = RefreshableCredentials.create_from_metadata(
+            metadata=self._assume_role(role_arn),
+            refresh_using=lambda: self._assume_role(role_arn),
+            method="sts-assume-role",
+        )
+        botocore_session = botocore.session.get_session()
+        botocore_session._credentials = credentials
+        return boto3.Session(botocore_session=botocore_session)
+
+
+def arn_account_id(
+    arn: str,
+):
+    """
+    Returns the account ID of an ARN (arn:aws:iam::<id>:role/...), or None
+    """
+    parts = (arn or "").split(":")
+    return parts[4] if len(parts) > 5 and parts[4] else None
+
+
+def get_accounts(
+    accounts_config: dict,
+    session_cache: SessionCache,
+):
+    """
+    Returns a list of accounts to process, each a dict with "id", "name" and "role_arn".
+    Accounts come from accounts.list in the config and, if accounts.organizations is set,
+    from Organizations list_accounts (active accounts only).
+    role_arn defaults to arn:aws:iam::<id>:role/<accounts.role_name>; with no role the ambient credentials are used.
+    An account given only as role_arn takes its id from the ARN.
+    Without an accounts config, a single account using the ambient credentials is returned.
+    """
+    if not accounts_config:
+        return [{"id": None, "name": None, "role_arn": None}]
+
+    role_name = accounts_config.get("role_name")
+    accounts = dict()
+
+    for account in accounts_config.get("list") or list():
+        account_id = str(account.get("id")) if account.get("id") else arn_account_id(account.get("role_arn"))
+        accounts[account_id or account.get("role_arn")] = {
+            "id": account_id,
+            "name": account.get("name") or account_id or account.get("role_arn"),
+            "role_arn": account.get("role_arn"),
+        }
+
+    if accounts_config.get("organizations"):
+        excluded = [str(account_id) for account_id in accounts_config.get("exclude") or list()]
+        paginator = session_cache.default_session.client("organizations").get_paginator("list_accounts")
+        for page in paginator.paginate():
+            for account in page.get("Accounts", list()):
+                if account["Status"] == "ACTIVE" and account["Id"] not in excluded and account["Id"] not in accounts:
+                    accounts[account["Id"]] = {
+                        "id": account["Id"],
+                        "name": account["Name"],
+                        "role_arn": None,
+                    }
+
+    for account in accounts.values():
+        if not account["role_arn"] and account["id"] and role_name:
+            account["role_arn"] = "arn:aws:iam::{}:role/{}".format(account["id"], role_name)
+
+    return list(accounts.values())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import time
+import logging
+import threading
+
+from utils.metrics import METRICS
+from .throttle import THROTTLE_ERROR_CODES
+
+
+class ApiBudgetExceeded(Exception):
+    pass
+
+
+class ApiCallCounter:
+    """
+    Counts every AWS API call per (region, service, operation): calls, errors, retries,
+    throttling responses and latency (including retries).
+    With a budget, should_stop() turns True once calls reach budget - headroom (so in-flight work
+    can finish), and calls beyond the budget itself are refused with ApiBudgetExceeded.
+    """
+
+    def __init__(
+        self,
+    ) -> None:
+        self._lock = threading.Lock()
+        self.configure()
+        self.reset()
+
+    def configure(
+        self,
+        budget: int = None,
+        headroom: int = None,
+    ):
+        self.budget = budget
+        # Default headroom: 10% of the budget
+        self.headroom = headroom if headroom is not None else int((budget or 0) * 0.1)
+
+    def reset(
+        self,
+    ):
+        with self._lock:
+            self.total = 0
+            self._operations = dict()
+            self._budget_logged = False
+
+    def should_stop(
+        self,
+    ):
+        if not self.budget or self.total < self.budget - self.headroom:
+            return False
+        if not self._budget_logged:
+            self._budget_logged = True
+            logging.warning(
+                "{} AWS API calls made, close to the budget of {}: not starting new work".format(
+                    self.total,
+                    self.budget,
+                )
+            )
+        return True
+
+    def _operation(
+        self,
+        key: tuple,
+    ):
+        # Caller holds the lock
+        values = self._operations.get(key)
+        if values is None:
+            values = self._operations[key] = {
+                "calls": 0,
+                "errors": 0,
+                "retries": 0,
+                "throttles": 0,
+                "seconds": 0.0,
+            }
+        return values
+
+    def to_dict(
+        self,
+    ):
+        with self._lock:
+            return {
+                "total": self.total,
+                "budget": self.budget,
+                "operations": {
+                    "/".join(key): dict(values, seconds=round(values["seconds"], 3))
+                    for key, values in sorted(self._operations.items())
+                },
+            }
+
+    def totals_line(
+        self,
+    ):
+        with self._lock:
+            values = list(self._operations.values())
+        return "AWS API calls: {} ({} retries, {} throttled, {} errors){}".format(
+            self.total,
+            sum([v["retries"] for v in values]),
+            sum([v["throttles"] for v in values]),
+            sum([v["errors"] for v in values]),
+            " of a budget of {}".format(self.budget) if self.budget else "",
+        )
+
+    def log_report(
+        self,
+    ):
+        logging.info(self.totals_line())
+        for key, values in self.to_dict()["operations"].items():
+            logging.info(
+                "AWS API {}: {calls} calls, {retries} retries, {throttles} throttled, {errors} errors, {seconds}s".format(
+                    key,
+                    **values,
+                )
+            )
+
+    def attach(
+        self,
+        client,
+    ):
+        region = client.meta.region_name
+        service = client.meta.service_model.service_name
+
+        def before_call(model, context, **kwargs):
+            with self._lock:
+                if self.budget and self.total >= self.budget:
+                    raise ApiBudgetExceeded(
+                        "AWS API call budget of {} reached, refusing {} {}".format(self.budget, service, model.name)
+                    )
+                self.total += 1
+                self._operation((region, service, model.name))["calls"] += 1
+            context["aws_cleaner_start"] = time.perf_counter()
+            return None
+
+        def needs_retry(response, operation, **kwargs):
+            if response is not None and response[1].get("Error", dict()).get("Code") in THROTTLE_ERROR_CODES:
+                with self._lock:
+                    self._operation((region, service, operation.name))["throttles"] += 1
+            return None
+
+        def after_call(parsed, model, context, **kwargs):
+            seconds = time.perf_counter() - context.get("aws_cleaner_start", time.perf_counter())
+            with self._lock:
+                values = self._operation((region, service, model.name))
+                values["seconds"] += seconds
+                values["retries"] += parsed.get("ResponseMetadata", dict()).get("RetryAttempts", 0)
+                if "Error" in parsed:
+                    values["errors"] += 1
+            METRICS.observe("aws_api", seconds, region=region, service=service, operation=model.name)
+            return None
+
+        # Registered with wildcards, which botocore runs ahead of plain prefix handlers (such as a Stubber's)
+        client.meta.events.register("before-call.*.*", before_call)
+        client.meta.events.register("needs-retry.*.*", needs_retry)
+        client.meta.events.register("after-call.*.*", after_call)
+        return client
+
+
+# Process wide counter used by AWSClient, reset at the start of each run
+API_CALLS = ApiCallCounter()
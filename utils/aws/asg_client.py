@@ -19,12 +19,36 @@ import logging
 from .aws_client import AWSClient
 from .generic_instance import GenericInstance
 
+# Maximum number of AutoScalingGroupNames per describe call
+ASG_NAMES_PER_CALL = 100
+# Tags per create_or_update_tags call (the tags of several groups go in one call)
+ASG_TAGS_PER_CALL = 100
+
 class ASGClient(AWSClient):
-    def get_instances(
+    # A group is scaled to zero once it has no instances left; a deleted group is no longer found
+    CONFIRMED_STATES = {
+        "scaletozero": ("scaledtozero", "deleting", None),
+        "delete": ("deleting", None),
+    }
+
+    def __init__(
+            self,
+            *args,
+            **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        # Groups deleted by this client during the current run, whose tags can't be written any more
+        self._deleted = set()
+
+    def reset(
+            self,
+    ):
+        self._deleted = set()
+
+    def get_instance_pages(
             self, 
             instance_config
     ):
-        instances = list()
         params = {
             "MaxRecords": self._max_results,
             "Filters": instance_config.get("filters") or list(),
@@ -35,6 +59,7 @@ class ASGClient(AWSClient):
         
         while True:
             describe_asgs = self.client.describe_auto_scaling_groups(**params)
+            instances = list()
             for instance in describe_asgs.get("AutoScalingGroups", list()):
                 # for instance in reservation.get("Instances", list()):
                 if "Tags" not in instance:
@@ -78,10 +103,13 @@ class ASGClient(AWSClient):
                     state=state,
                     exceptions=exceptions,
                     tags=tags,
+                    account=self._account,
                 )
                 
                 instances.append(instance)
 
+            yield instances
+
             # Pagination
             next_token = describe_asgs.get("NextToken")
             if next_token:
@@ -89,7 +117,86 @@ class ASGClient(AWSClient):
             else:
                 break
 
-        return instances
+    def _describe(
+            self,
+            instances,
+    ):
+        """
+        Yield the descriptions of the given groups, ASG_NAMES_PER_CALL per call
+        """
+        names = [instance.name for instance in instances]
+        for n in range(0, len(names), ASG_NAMES_PER_CALL):
+            params = {
+                "AutoScalingGroupNames": names[n:n + ASG_NAMES_PER_CALL],
+                "MaxRecords": self._max_results,
+            }
+            while True:
+                describe_asgs = self.client.describe_auto_scaling_groups(**params)
+                yield from describe_asgs.get("AutoScalingGroups", list())
+                next_token = describe_asgs.get("NextToken")
+                if next_token:
+                    params["NextToken"] = next_token
+                else:
+                    break
+
+    def get_tags(
+            self,
+            instances,
+            instance_config=None,
+    ):
+        return {
+            asg["AutoScalingGroupARN"]: {tag["Key"]: tag["Value"] for tag in asg.get("Tags", list())}
+            for asg in self._describe(instances)
+        }
+
+    def get_states(
+            self,
+            instances,
+    ):
+        states = dict()
+        for asg in self._describe(instances):
+            if asg.get("Status") == "Delete in progress":
+                state = "deleting"
+            elif not asg.get("Instances"):
+                state = "scaledtozero"
+            else:
+                state = "running"
+            states[asg["AutoScalingGroupARN"]] = state
+        return states
+
+    def _tag(
+            self,
+            name,
+            tag,
+            value,
+    ):
+        return {
+            "ResourceId": name,
+            "ResourceType": "auto-scaling-group",
+            "Key": tag,
+            # str(value) takes care of converting datetime.date to string in isoformat '2024-01-01'
+            "Value": str(value),
+            "PropagateAtLaunch": False,
+        }
+
+    def _log_tags(
+            self,
+            id,
+            name,
+            updated_tags,
+    ):
+        for tag, values in updated_tags.items():
+            logging.info(
+                "{}Updating tag on {} [{}] in region {}: changing {} from {} to {}".format(
+                    self._dry_run_label,
+                    name,
+                    id,
+                    self._region_name,
+                    tag,
+                    values["old"],
+                    values["new"],
+                )
+            )
 
     def update_tags(
             self,
@@ -98,7 +205,110 @@ class ASGClient(AWSClient):
             updated_tags,
             **kwargs
     ):
-        pass
+        self._log_tags(id, name, updated_tags)
+        if not self._dry_run:
+            self.client.create_or_update_tags(
+                Tags=[self._tag(name, tag, values["new"]) for tag, values in updated_tags.items()],
+            )
+
+    def update_tags_batch(
+            self,
+            items,
+    ):
+        # create_or_update_tags takes the tags of many groups per call; a call fails as a whole
+        # (e.g. one group was deleted), in which case its groups are retried one at a time (see run_batch)
+        batches = [list()]
+        for instance, updated_tags in items:
+            if instance.name in self._deleted:
+                logging.info("Not updating tags of deleted asg {} [{}] in region {}".format(instance.name, instance.id, self._region_name))
+                continue
+            self._log_tags(instance.id, instance.name, updated_tags)
+            if batches[-1] and sum(len(tags) for _, tags in batches[-1]) + len(updated_tags) > ASG_TAGS_PER_CALL:
+                batches.append(list())
+            batches[-1].append((instance, updated_tags))
+        if self._dry_run:
+            return dict()
+
+        failed = dict()
+        for batch in batches:
+            if not batch:
+                continue
+            failed.update(
+                self.run_batch(
+                    self.client.create_or_update_tags,
+                    {
+                        "Tags": [
+                            self._tag(instance.name, tag, values["new"])
+                            for instance, updated_tags in batch
+                            for tag, values in updated_tags.items()
+                        ],
+                    },
+                    [self.tag_call(instance, updated_tags) for instance, updated_tags in batch],
+                )
+            )
+        for id, error in failed.items():
+            logging.info("Exception updating tags on asg [{}] in region {}: {}".format(id, self._region_name, error))
+        return failed
+
+    def tag_call(
+            self,
+            instance,
+            updated_tags,
+    ):
+        return (
+            instance.id,
+            self.client.create_or_update_tags,
+            {"Tags": [self._tag(instance.name, tag, values["new"]) for tag, values in updated_tags.items()]},
+        )
+
+    def _action_call(
+        self,
+        action: str,
+        id: str,
+        name: str,
+    ):
+        """
+        (key, function, kwargs) of a scaletozero or delete, for run_concurrently
+        """
+        logging.info(
+            "{}{} asg {} [{}] in region {}".format(
+                self._dry_run_label,
+                "Scaling to zero" if action == "scaletozero" else "Deleting",
+                name,
+                id,
+                self._region_name,
+            )
+        )
+        if action == "scaletozero":
+            return (
+                id,
+                self.client.update_auto_scaling_group,
+                {"AutoScalingGroupName": name, "MinSize": 0, "DesiredCapacity": 0},
+            )
+        # Groups are deleted once scaled to zero; ForceDelete also terminates any instance left
+        return (
+            id,
+            self.client.delete_auto_scaling_group,
+            {"AutoScalingGroupName": name, "ForceDelete": True},
+        )
+
+    def do_actions(
+        self,
+        action: str,
+        instances: list,
+    ):
+        if action not in ("scaletozero", "delete"):
+            return dict()
+        calls = [self._action_call(action, instance.id, instance.name) for instance in instances]
+        if self._dry_run:
+            return dict()
+        failed = self.run_concurrently(calls)
+        for id, error in failed.items():
+            logging.info("Exception on {} of asg [{}] in region {}: {}".format(action, id, self._region_name, error))
+        if action == "delete":
+            self._deleted |= {instance.name for instance in instances if instance.id not in failed}
+        # Groups take a while to drain; global.action_confirmation waits until they have (see CONFIRMED_STATES)
+        return failed
 
     def do_action(
         self,
@@ -108,18 +318,33 @@ class ASGClient(AWSClient):
         name: str,
         **kwargs, # Ignore extra args
     ):
-        pass
-    
+        if action == "scaletozero":
+            self.stop(
+                id=id,
+                name=name,
+            )
+        elif action == "delete":
+            self.terminate(
+                id=id,
+                name=name,
+            )
+
     def stop(
         self,
         id: str,
         name: str,
     ):
-        pass
-    
+        call = self._action_call("scaletozero", id, name)
+        if not self._dry_run:
+            for id, error in self.run_concurrently([call]).items():
+                logging.info("Exception scaling asg {} [{}] to zero in region {}: {}".format(name, id, self._region_name, error))
+
     def terminate(
         self,
         id: str,
         name: str,
     ):
-        pass
\ No newline at end of file
+        call = self._action_call("delete", id, name)
+        if not self._dry_run:
+            for id, error in self.run_concurrently([call]).items():
+                logging.info("Exception deleting asg {} [{}] in region {}: {}".format(name, id, self._region_name, error))
@@ -16,12 +16,82 @@
 # limitations under the License.
 #
 
+import time
 import boto3
+import datetime
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from .throttle import THROTTLES
+from .api_calls import API_CALLS, ApiBudgetExceeded
 # import datetime
 # from utils.generic_instance import GenericInstance
 
+# Creating clients from a shared session isn't thread-safe
+_client_lock = threading.Lock()
+
+# Throttled calls are retried (standard mode backs off exponentially); the shared throttles keep
+# the request rate of all clients just under the account limits
+CLIENT_CONFIG = Config(
+    retries={
+        "max_attempts": 8,
+        "mode": "standard",
+    },
+)
+
+# Maximum number of ARNs per Resource Groups Tagging API tag_resources call
+TAG_RESOURCES_BATCH_SIZE = 20
+# Calls in flight at once per client, for services without multi-resource APIs (see run_concurrently)
+MAX_CONCURRENCY = 8
+# Maximum number of queries per CloudWatch get_metric_data call
+METRIC_QUERIES_PER_CALL = 500
+# Attempts per call on transient errors (after botocore's own retries), with exponential backoff
+CALL_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 1
+
+
+def retryable(
+    error: Exception,
+):
+    """
+    Connection errors, server errors and throttling are worth another attempt; other client errors
+    (e.g. instance not found, or in the wrong state) are not
+    """
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", dict()).get("Code", "")
+        status = error.response.get("ResponseMetadata", dict()).get("HTTPStatusCode", 500)
+        return status >= 500 or "Throttl" in code or code == "RequestLimitExceeded"
+    return isinstance(error, BotoCoreError)
+
+
+def call_with_retries(
+    func,
+    kwargs: dict,
+):
+    """
+    Call func(**kwargs), retrying transient errors CALL_ATTEMPTS times with exponential backoff.
+    Returns None, or the error of the last attempt; calls refused by the API call budget aren't retried.
+    """
+    for n in range(CALL_ATTEMPTS):
+        try:
+            func(**kwargs)
+            return None
+        except ApiBudgetExceeded as e:
+            return e
+        except (BotoCoreError, ClientError) as e:
+            if n + 1 == CALL_ATTEMPTS or not retryable(e):
+                return e
+            time.sleep(RETRY_BACKOFF_SECONDS * 2 ** n)
+
+
 class AWSClient:
+    # Action -> states of an instance once the action took effect (None: the instance is gone), see unconfirmed
+    CONFIRMED_STATES = dict()
+    # Action -> CloudWatch (namespace, metric, idle_check threshold key) showing an instance is in use, see busy
+    IDLE_METRICS = dict()
+
     def __init__(
         self,
         region_name: str,
@@ -30,6 +100,9 @@ class AWSClient:
         service_name: str = "ec2",
         email_tags: list = None,
         notify_messages_config: dict = None,
+        session: boto3.Session = None,
+        account: str = None,
+        tag_writer: str = None,
     ) -> None:
         self._service_name = service_name
         self._region_name = region_name
@@ -38,11 +111,25 @@ class AWSClient:
         self._notify_messages_config = notify_messages_config
         self._dry_run = dry_run
         self._dry_run_label = "[DRY RUN] " if dry_run else ""
+        self._account = account
+        self._session = session
+        self._tag_writer = tag_writer
+        self._service_clients = dict()
 
-        self.client = boto3.client(
-            service_name,
-            region_name=region_name,
-        )
+        with _client_lock:
+            self.client = (session or boto3).client(
+                service_name,
+                region_name=region_name,
+                config=CLIENT_CONFIG,
+            )
+        THROTTLES.attach(self.client)
+        API_CALLS.attach(self.client)
+
+    def reset(self):
+        """
+        Forget what the client kept from the previous run (clients are kept between daemon runs)
+        """
+        pass
 
     def get_regions(self):
         logging.info("Getting regions")
@@ -50,12 +137,232 @@ class AWSClient:
             region["RegionName"] for region in self.client.describe_regions()["Regions"]
         ]
     
+    def get_instance_pages(self, instance_config):
+        """
+        Yield lists of GenericInstance, one list per describe page
+        """
+        return iter([])
+
     def get_instances(self, instance_config):
-        return []
+        return [
+            instance for page in self.get_instance_pages(instance_config) for instance in page
+        ]
     
+    def get_instances_by_id(self, ids, instance_config):
+        """
+        GenericInstance of each of the given IDs that still exists (and matches instance_config's filters)
+        Returns None if the client can't look instances up by ID.
+        """
+        return None
+
+    def get_tags(self, instances, instance_config=None):
+        """
+        Current tags of the given instances, as {id: tags}; instances that no longer exist are left out.
+        With an instance_config, only the tags its discovery sees (see EC2Client.get_tag_pages).
+        Returns None if the client can't look them up.
+        """
+        return None
+
+    def get_states(self, instances):
+        """
+        Current state of the given instances, as {id: state}; instances that no longer exist are left out.
+        Returns None if the client can't look them up.
+        """
+        return None
+
+    def unconfirmed(self, action, instances):
+        """
+        Instances an action was run on whose state doesn't show it took effect yet, as {id: state} (None if not found),
+        from one batched lookup. Nothing is unconfirmed in dry run mode, or for clients that can't look up states.
+        """
+        confirmed_states = self.CONFIRMED_STATES.get(action)
+        if not confirmed_states or self._dry_run or not instances:
+            return dict()
+        states = self.get_states(instances)
+        if states is None:
+            return dict()
+        return {
+            instance.id: states.get(instance.id)
+            for instance in instances
+            if states.get(instance.id) not in confirmed_states
+        }
+
     def update_tags(self, id, name, updated_tags, **kwargs):
         pass
 
+    def update_tags_batch(self, items):
+        """
+        items is a list of (instance, updated_tags); clients with a multi-resource API override this
+        Clients that capture errors per instance return {instance id: error message} of the failures.
+        """
+        for instance, updated_tags in items:
+            self.update_tags(
+                **instance,
+                updated_tags=updated_tags,
+            )
+
+    def run_concurrently(self, calls):
+        """
+        Run calls, a list of (key, function, kwargs), up to MAX_CONCURRENCY at a time; transient errors are
+        retried. Returns {key: error message} of the calls that failed (including calls refused by the API call budget).
+        """
+        def attempt(call):
+            key, func, kwargs = call
+            error = call_with_retries(func, kwargs)
+            return key, str(error) if error else None
+
+        if not calls:
+            return dict()
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENCY, len(calls))) as executor:
+            return {key: error for key, error in executor.map(attempt, calls) if error}
+
+    def run_batch(self, func, kwargs, calls):
+        """
+        Run one multi-resource call, func(**kwargs), retrying transient errors. If it fails because of a resource
+        (a client error that isn't transient), run calls instead, the (key, function, kwargs) of each resource on its
+        own, with run_concurrently. Returns {key: error message} of the resources that failed.
+        """
+        error = call_with_retries(func, kwargs)
+        if error is None:
+            return dict()
+        if isinstance(error, ClientError) and not retryable(error):
+            return self.run_concurrently(calls)
+        return {key: str(error) for key, func, kwargs in calls}
+
+    def service_client(self, service_name):
+        """
+        Client of another service in the same region (and account), created on first use
+        """
+        if service_name not in self._service_clients:
+            with _client_lock:
+                client = (self._session or boto3).client(
+                    service_name,
+                    region_name=self._region_name,
+                    config=CLIENT_CONFIG,
+                )
+            THROTTLES.attach(client)
+            API_CALLS.attach(client)
+            self._service_clients[service_name] = client
+        return self._service_clients[service_name]
+
+    def tagging_client(self):
+        return self.service_client("resourcegroupstaggingapi")
+
+    def metric_dimension(self, instance):
+        """
+        (name, value) of the CloudWatch dimension of an instance's metrics
+        """
+        return "InstanceId", instance.id
+
+    def busy(self, action, instances, idle_check):
+        """
+        Instances whose recent metrics show they are in use, as {id: reason}: an IDLE_METRICS metric of the action peaked
+        above its idle_check threshold over the last lookback_hours. Metrics of all the instances are fetched together,
+        METRIC_QUERIES_PER_CALL queries per get_metric_data call. If they can't be fetched, no instance is busy.
+        """
+        queries = dict()
+        for instance in instances:
+            dimension_name, dimension_value = self.metric_dimension(instance)
+            for namespace, metric, threshold_key in self.IDLE_METRICS.get(action, list()):
+                if idle_check.get(threshold_key) is None:
+                    continue
+                query = {
+                    "Id": "q{}".format(len(queries)),
+                    "MetricStat": {
+                        "Metric": {
+                            "Namespace": namespace,
+                            "MetricName": metric,
+                            "Dimensions": [{"Name": dimension_name, "Value": dimension_value}],
+                        },
+                        "Period": idle_check.get("period_seconds", 3600),
+                        "Stat": "Maximum",
+                    },
+                }
+                queries[query["Id"]] = (query, instance, metric, idle_check[threshold_key])
+
+        lookback_hours = idle_check.get("lookback_hours", 24)
+        # On a whole minute, after the latest data points
+        end = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        busy = dict()
+        ids = list(queries)
+        for n in range(0, len(ids), METRIC_QUERIES_PER_CALL):
+            params = {
+                "MetricDataQueries": [queries[id][0] for id in ids[n:n + METRIC_QUERIES_PER_CALL]],
+                "StartTime": end - datetime.timedelta(hours=lookback_hours),
+                "EndTime": end,
+            }
+            try:
+                while True:
+                    get_metric_data = self.service_client("cloudwatch").get_metric_data(**params)
+                    for result in get_metric_data.get("MetricDataResults", list()):
+                        query, instance, metric, threshold = queries[result["Id"]]
+                        peak = max(result.get("Values", list()), default=None)
+                        if peak is not None and peak > threshold and instance.id not in busy:
+                            busy[instance.id] = "{} peaked at {:g} over the last {} hours".format(metric, peak, lookback_hours)
+                    next_token = get_metric_data.get("NextToken")
+                    if next_token:
+                        params["NextToken"] = next_token
+                    else:
+                        break
+            except (BotoCoreError, ClientError, ApiBudgetExceeded) as e:
+                logging.warning("Can't get metrics in region {}, not checking if instances are idle: {}".format(self._region_name, e))
+        return busy
+
+    def tag_call(self, instance, updated_tags):
+        """
+        (key, function, kwargs) writing the tags of one instance, for run_concurrently
+        """
+        return (
+            instance.id,
+            self.update_tags,
+            {"id": instance.id, "name": instance.name, "updated_tags": updated_tags},
+        )
+
+    def tag_resources(self, items):
+        """
+        Write tags of ARN-addressed instances with the Resource Groups Tagging API: one tag_resources call per
+        identical tag set and TAG_RESOURCES_BATCH_SIZE ARNs. ARNs it reports as failed are retried one at a
+        time with the service's own call (tag_call). Returns {instance id: error message} of the failures.
+        """
+        groups = dict()
+        for instance, updated_tags in items:
+            key = tuple(sorted((tag, str(values["new"])) for tag, values in updated_tags.items()))
+            groups.setdefault(key, list()).append((instance, updated_tags))
+
+        retry = list()
+        for key, group in groups.items():
+            for n in range(0, len(group), TAG_RESOURCES_BATCH_SIZE):
+                batch = group[n:n + TAG_RESOURCES_BATCH_SIZE]
+                try:
+                    failed = self.tagging_client().tag_resources(
+                        ResourceARNList=[instance.id for instance, updated_tags in batch],
+                        Tags=dict(key),
+                    ).get("FailedResourcesMap", dict())
+                except (BotoCoreError, ClientError, ApiBudgetExceeded) as e:
+                    failed = {instance.id: {"ErrorMessage": str(e)} for instance, updated_tags in batch}
+                for instance, updated_tags in batch:
+                    if instance.id in failed:
+                        logging.info(
+                            "tag_resources failed for {} in region {} ({}), retrying on its own".format(
+                                instance.id,
+                                self._region_name,
+                                failed[instance.id].get("ErrorMessage"),
+                            )
+                        )
+                        retry.append((instance, updated_tags))
+        return self.run_concurrently([self.tag_call(instance, updated_tags) for instance, updated_tags in retry])
+
+    def do_actions(self, action, instances):
+        """
+        Run the same action on a list of instances; clients with a multi-resource API override this
+        Clients that capture errors per instance return {instance id: error message} of the failures.
+        """
+        for instance in instances:
+            self.do_action(
+                action=action,
+                **instance,
+            )
+
     def do_action(
         self,
         action: str,
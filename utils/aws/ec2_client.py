@@ -15,16 +15,52 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import fnmatch
 import logging
 from .aws_client import AWSClient
 from .generic_instance import GenericInstance
 
+# Maximum number of resources per create_tags / stop_instances / terminate_instances call
+EC2_BATCH_SIZE = 1000
+# Maximum number of values of a describe filter
+EC2_FILTER_VALUES = 200
+# Page size of describe_tags (its maximum), in tag-only discovery
+EC2_TAGS_PAGE_SIZE = 1000
+
 class EC2Client(AWSClient):
-    def get_instances(
+    # Stopped instances can be started again by anyone, so stopping doesn't count; terminating can't be undone
+    CONFIRMED_STATES = {
+        "stop": ("stopped",),
+        "terminate": ("shutting-down", "terminated", None),
+    }
+    IDLE_METRICS = {
+        "stop": (("AWS/EC2", "CPUUtilization", "cpu_percent"),),
+    }
+
+    def get_instance_pages(
             self, 
             instance_config
     ):
-        instances = list()
+        if instance_config.get("discovery") == "tags":
+            if not instance_config.get("filters"):
+                return self.get_tag_pages(instance_config)
+            logging.warning("Filters need full ec2 discovery, ignoring discovery: tags in region {}".format(self._region_name))
+        return self.get_describe_pages(instance_config)
+
+    def _tag_keys(
+            self,
+            instance_config
+    ):
+        """
+        Keys (describe_tags patterns) of the tags the cleaner reads: its own aws_cleaner/* tags, Name, email and exception tags
+        """
+        exceptions_config = instance_config.get("exceptions") or list()
+        return list(dict.fromkeys(["aws_cleaner/*", "Name"] + list(self._email_tags or list()) + list(exceptions_config)))
+
+    def get_describe_pages(
+            self,
+            instance_config
+    ):
         params = {
             "MaxResults": self._max_results,
             "Filters": instance_config.get("filters") or list(),
@@ -32,41 +68,173 @@ class EC2Client(AWSClient):
         exceptions_config = instance_config.get("exceptions") or list()
         while True:
             describe_instances = self.client.describe_instances(**params)
+            instances = list()
             for reservation in describe_instances.get("Reservations", list()):
                 for instance in reservation.get("Instances", list()):
-                    if "Tags" not in instance:
-                        tags = dict()
-                    else:
-                        tags = {tag["Key"]: tag["Value"] for tag in instance["Tags"]}
-
-                    # Get tags matching any of the exception tags; if any exist, don't process.
-                    # returns a list of tuples; each tuple is ('tag', 'value')
-                    # using a list becuase it's ordered
-                    exceptions = [(e_tag, tags.get(e_tag)) for e_tag in exceptions_config if tags.get(e_tag)]
-                    emails = [tags.get(tag) for tag in self._email_tags]
-
-                    instance = GenericInstance(
+                    instances.append(self._instance(instance, exceptions_config))
+
+            yield instances
+
+            # Pagination
+            next_token = describe_instances.get("NextToken")
+            if next_token:
+                params["NextToken"] = next_token
+            else:
+                break
+    
+    def _instance(
+            self,
+            instance,
+            exceptions_config,
+    ):
+        """
+        GenericInstance of a describe_instances instance
+        """
+        if "Tags" not in instance:
+            tags = dict()
+        else:
+            tags = {tag["Key"]: tag["Value"] for tag in instance["Tags"]}
+
+        # Get tags matching any of the exception tags; if any exist, don't process.
+        # returns a list of tuples; each tuple is ('tag', 'value')
+        # using a list becuase it's ordered
+        exceptions = [(e_tag, tags.get(e_tag)) for e_tag in exceptions_config if tags.get(e_tag)]
+        emails = [tags.get(tag) for tag in self._email_tags]
+
+        return GenericInstance(
+            type="ec2",
+            id=instance["InstanceId"],
+            region=self._region_name,
+            name=tags.get("Name"),
+            email=next((email for email in emails if email), None), # List coalesce to None
+            state=instance["State"]["Name"],
+            exceptions=exceptions,
+            tags=tags,
+            account=self._account,
+        )
+
+    def get_instances_by_id(
+            self,
+            ids,
+            instance_config,
+    ):
+        exceptions_config = instance_config.get("exceptions") or list()
+        return [
+            self._instance(instance, exceptions_config)
+            for instance in self._describe(ids, filters=instance_config.get("filters"))
+        ]
+
+    def get_tag_pages(
+            self,
+            instance_config
+    ):
+        """
+        Lightweight discovery: only the tags the cleaner reads (its own aws_cleaner/* tags, Name, email and
+        exception tags) from describe_tags, and states from describe_instance_status, instead of full descriptions.
+        Pages follow describe_instance_status; instances without any of these tags are included, with no tags.
+        """
+        exceptions_config = instance_config.get("exceptions") or list()
+        all_tags = dict()
+        params = {
+            "Filters": [
+                {"Name": "resource-type", "Values": ["instance"]},
+                {"Name": "key", "Values": self._tag_keys(instance_config)},
+            ],
+            "MaxResults": EC2_TAGS_PAGE_SIZE,
+        }
+        while True:
+            describe_tags = self.client.describe_tags(**params)
+            for tag in describe_tags.get("Tags", list()):
+                all_tags.setdefault(tag["ResourceId"], dict())[tag["Key"]] = tag["Value"]
+            next_token = describe_tags.get("NextToken")
+            if next_token:
+                params["NextToken"] = next_token
+            else:
+                break
+
+        params = {
+            "IncludeAllInstances": True,
+            "MaxResults": self._max_results,
+        }
+        while True:
+            describe_instance_status = self.client.describe_instance_status(**params)
+            instances = list()
+            for status in describe_instance_status.get("InstanceStatuses", list()):
+                tags = all_tags.get(status["InstanceId"], dict())
+                exceptions = [(e_tag, tags.get(e_tag)) for e_tag in exceptions_config if tags.get(e_tag)]
+                emails = [tags.get(tag) for tag in self._email_tags]
+
+                instances.append(
+                    GenericInstance(
                         type="ec2",
-                        id=instance["InstanceId"],
+                        id=status["InstanceId"],
                         region=self._region_name,
                         name=tags.get("Name"),
                         email=next((email for email in emails if email), None), # List coalesce to None
-                        state=instance["State"]["Name"],
+                        state=status["InstanceState"]["Name"],
                         exceptions=exceptions,
                         tags=tags,
+                        account=self._account,
                     )
+                )
 
-                    instances.append(instance)
+            yield instances
 
             # Pagination
-            next_token = describe_instances.get("NextToken")
+            next_token = describe_instance_status.get("NextToken")
             if next_token:
                 params["NextToken"] = next_token
             else:
                 break
 
-        return instances
-    
+    def _describe(
+            self,
+            ids,
+            filters=None,
+    ):
+        """
+        Yield the descriptions of the given instance IDs (that match `filters`), EC2_FILTER_VALUES per call
+        """
+        # A filter (unlike InstanceIds) doesn't fail the whole call when one of the instances is gone
+        for n in range(0, len(ids), EC2_FILTER_VALUES):
+            params = {
+                "Filters": (filters or list()) + [{"Name": "instance-id", "Values": ids[n:n + EC2_FILTER_VALUES]}],
+                "MaxResults": self._max_results,
+            }
+            while True:
+                describe_instances = self.client.describe_instances(**params)
+                for reservation in describe_instances.get("Reservations", list()):
+                    yield from reservation.get("Instances", list())
+                next_token = describe_instances.get("NextToken")
+                if next_token:
+                    params["NextToken"] = next_token
+                else:
+                    break
+
+    def get_tags(
+            self,
+            instances,
+            instance_config=None,
+    ):
+        keys = None
+        if instance_config and instance_config.get("discovery") == "tags" and not instance_config.get("filters"):
+            # The same tags as tag-only discovery
+            keys = self._tag_keys(instance_config)
+        return {
+            instance["InstanceId"]: {
+                tag["Key"]: tag["Value"]
+                for tag in instance.get("Tags", list())
+                if keys is None or any(fnmatch.fnmatchcase(tag["Key"], key) for key in keys)
+            }
+            for instance in self._describe([instance.id for instance in instances])
+        }
+
+    def get_states(
+            self,
+            instances,
+    ):
+        return {instance["InstanceId"]: instance["State"]["Name"] for instance in self._describe([instance.id for instance in instances])}
+
     def update_tags(
             self,
             id,
@@ -96,6 +264,84 @@ class EC2Client(AWSClient):
                 Tags=formatted_tags,
             )
 
+    def update_tags_batch(
+            self,
+            items,
+    ):
+        # create_tags takes many resources per call, as long as they share the same tag set
+        groups = dict()
+        for instance, updated_tags in items:
+            for tag, values in updated_tags.items():
+                logging.info(
+                    "{}Updating tag on {} [{}] in region {}: changing {} from {} to {}".format(
+                        self._dry_run_label,
+                        instance.name,
+                        instance.id,
+                        self._region_name,
+                        tag,
+                        values["old"],
+                        values["new"],
+                    )
+                )
+            key = tuple(sorted((tag, str(values["new"])) for tag, values in updated_tags.items()))
+            groups.setdefault(key, list()).append(instance.id)
+
+        if self._dry_run:
+            return dict()
+
+        # A call fails as a whole (e.g. one instance is gone), in which case its instances are retried one at a time
+        failed = dict()
+        for key, ids in groups.items():
+            tags = [{"Key": tag, "Value": value} for tag, value in key]
+            for n in range(0, len(ids), EC2_BATCH_SIZE):
+                batch = ids[n:n + EC2_BATCH_SIZE]
+                failed.update(
+                    self.run_batch(
+                        self.client.create_tags,
+                        {"Resources": batch, "Tags": tags},
+                        [(id, self.client.create_tags, {"Resources": [id], "Tags": tags}) for id in batch],
+                    )
+                )
+        for id, error in failed.items():
+            logging.info("Exception updating tags on ec2 instance [{}] in region {}: {}".format(id, self._region_name, error))
+        return failed
+
+    def do_actions(
+        self,
+        action: str,
+        instances: list,
+    ):
+        if action not in ("stop", "terminate"):
+            return dict()
+        for instance in instances:
+            logging.info(
+                "{}{} ec2 instance {} [{}] in region {}".format(
+                    self._dry_run_label,
+                    "Stopping" if action == "stop" else "Terminating",
+                    instance.name,
+                    instance.id,
+                    self._region_name,
+                )
+            )
+        if self._dry_run:
+            return dict()
+
+        call = self.client.stop_instances if action == "stop" else self.client.terminate_instances
+        # One bad instance fails the whole call, in which case its instances are retried one at a time (see run_batch)
+        failed = dict()
+        for n in range(0, len(instances), EC2_BATCH_SIZE):
+            batch = instances[n:n + EC2_BATCH_SIZE]
+            failed.update(
+                self.run_batch(
+                    call,
+                    {"InstanceIds": [instance.id for instance in batch]},
+                    [(instance.id, call, {"InstanceIds": [instance.id]}) for instance in batch],
+                )
+            )
+        for id, error in failed.items():
+            logging.info("Exception on {} of ec2 instance [{}] in region {}: {}".format(action, id, self._region_name, error))
+        return failed
+
     def do_action(
         self,
         action: str,
@@ -10,6 +10,7 @@ class GenericInstance(dict):
         state: str,
         exceptions: dict,
         tags: dict,
+        account: str = None,
     ) -> None:
         self.type = type
         self.id = id
@@ -19,6 +20,7 @@ class GenericInstance(dict):
         self.state = state
         self.exceptions = exceptions if exceptions else dict()
         self.tags = tags if tags else dict()
+        self.account = account
 
     # Allow dot access
     __getattr__ = dict.get
@@ -20,81 +20,158 @@ import datetime
 from .aws_client import AWSClient
 from .generic_instance import GenericInstance
 
+# Maximum number of values of a describe filter
+RDS_FILTER_VALUES = 100
+
 class RDSClient(AWSClient):
-    def get_instances(
+    # A stop can't be cancelled once the instance is stopping; stopping takes several minutes
+    CONFIRMED_STATES = {
+        "stop": ("stopping", "stopped"),
+        "delete": ("deleting", None),
+    }
+    IDLE_METRICS = {
+        "stop": (
+            ("AWS/RDS", "CPUUtilization", "cpu_percent"),
+            ("AWS/RDS", "DatabaseConnections", "connections"),
+        ),
+    }
+
+    def get_instance_pages(
             self, 
             instance_config
     ):
-        instances = list()
         params = {
             "MaxRecords": self._max_results,
         }
-        tags_config = instance_config.get("tags")
-        exceptions_config = instance_config.get("exceptions") or list()
-        filters = instance_config.get("filters") or list()
         while True:
             describe_db_instances = self.client.describe_db_instances(**params)
+            instances = list()
             for instance in describe_db_instances.get("DBInstances", list()):
-                # for instance in reservation.get("Instances", list()):
-                if "TagList" not in instance:
-                    tags = dict()
-                else:
-                    tags = {tag["Key"]: tag["Value"] for tag in instance["TagList"]}
-
-                # Get tags matching any of the exception tags; if any exist, don't process.
-                # returns a list of tuples; each tuple is ('tag', 'value')
-                # using a list becuase it's ordered
-                exceptions = [(e_tag, tags.get(e_tag)) for e_tag in exceptions_config if tags.get(e_tag)]
-                emails = [tags.get(tag) for tag in self._email_tags]
-
-                if instance.get("DBClusterIdentifier") is None:
-                    if instance["DBInstanceStatus"] == "stopped" or (
-                        instance["DBInstanceStatus"] == "available" and tags.get(tags_config.get("t_standalone_stopped"))
-                    ):
-                        state = "standalone:stopped"
-                    elif instance["DBInstanceStatus"] == "available":
-                        state = "standalone:available"
-                    else:
-                        state = "standalone:{}".format(instance["DBInstanceStatus"])
-                else:
-                    state = "clustered"
-
-                instance = GenericInstance(
-                    type="rds",
-                    id=instance["DBInstanceArn"],
-                    region=self._region_name,
-                    name=instance["DBInstanceIdentifier"],
-                    email=next((email for email in emails if email), None), # List coalesce to None
-                    state=state,
-                    exceptions=exceptions,
-                    tags=tags,
-                )
-                if len(filters) > 0:
-                    add = False
-                    for filter in filters:
-                        if tags.get(filter.get("Name").removeprefix("tag:")) in filter.get("Values"):
-                            add = True
-                else:
-                    add = True
-                if add:
+                instance = self._instance(instance, instance_config)
+                if instance:
                     instances.append(instance)
 
-            # Pagination
-            next_token = describe_db_instances.get("NextToken")
-            if next_token:
-                params["NextToken"] = next_token
+            yield instances
+
+            # Pagination (RDS uses Marker rather than NextToken)
+            marker = describe_db_instances.get("Marker")
+            if marker:
+                params["Marker"] = marker
             else:
                 break
-
-        return instances
     
 
-    def update_tags(
+    def _instance(
+            self,
+            instance,
+            instance_config,
+    ):
+        """
+        GenericInstance of a describe_db_instances instance, or None if it doesn't match the configured (tag) filters
+        """
+        tags_config = instance_config.get("tags")
+        exceptions_config = instance_config.get("exceptions") or list()
+        filters = instance_config.get("filters") or list()
+        if "TagList" not in instance:
+            tags = dict()
+        else:
+            tags = {tag["Key"]: tag["Value"] for tag in instance["TagList"]}
+
+        # Get tags matching any of the exception tags; if any exist, don't process.
+        # returns a list of tuples; each tuple is ('tag', 'value')
+        # using a list becuase it's ordered
+        exceptions = [(e_tag, tags.get(e_tag)) for e_tag in exceptions_config if tags.get(e_tag)]
+        emails = [tags.get(tag) for tag in self._email_tags]
+
+        if instance.get("DBClusterIdentifier") is None:
+            if instance["DBInstanceStatus"] == "stopped" or (
+                instance["DBInstanceStatus"] == "available" and tags.get(tags_config.get("t_standalone_stopped"))
+            ):
+                state = "standalone:stopped"
+            elif instance["DBInstanceStatus"] == "available":
+                state = "standalone:available"
+            else:
+                state = "standalone:{}".format(instance["DBInstanceStatus"])
+        else:
+            state = "clustered"
+
+        if len(filters) > 0:
+            add = False
+            for filter in filters:
+                if tags.get(filter.get("Name").removeprefix("tag:")) in filter.get("Values"):
+                    add = True
+            if not add:
+                return None
+
+        return GenericInstance(
+            type="rds",
+            id=instance["DBInstanceArn"],
+            region=self._region_name,
+            name=instance["DBInstanceIdentifier"],
+            email=next((email for email in emails if email), None), # List coalesce to None
+            state=state,
+            exceptions=exceptions,
+            tags=tags,
+            account=self._account,
+        )
+
+    def get_instances_by_id(
+            self,
+            ids,
+            instance_config,
+    ):
+        instances = [self._instance(instance, instance_config) for instance in self._describe(ids)]
+        return [instance for instance in instances if instance]
+
+    def _describe(
+            self,
+            ids,
+    ):
+        """
+        Yield the descriptions of the given instance ARNs (or identifiers), RDS_FILTER_VALUES per call
+        """
+        # The db-instance-id filter takes ARNs too, up to 100 per call
+        for n in range(0, len(ids), RDS_FILTER_VALUES):
+            params = {
+                "Filters": [{"Name": "db-instance-id", "Values": ids[n:n + RDS_FILTER_VALUES]}],
+                "MaxRecords": self._max_results,
+            }
+            while True:
+                describe_db_instances = self.client.describe_db_instances(**params)
+                yield from describe_db_instances.get("DBInstances", list())
+                marker = describe_db_instances.get("Marker")
+                if marker:
+                    params["Marker"] = marker
+                else:
+                    break
+
+    def metric_dimension(
+            self,
+            instance,
+    ):
+        return "DBInstanceIdentifier", instance.name
+
+    def get_tags(
+            self,
+            instances,
+            instance_config=None,
+    ):
+        return {
+            instance["DBInstanceArn"]: {tag["Key"]: tag["Value"] for tag in instance.get("TagList", list())}
+            for instance in self._describe([instance.id for instance in instances])
+        }
+
+    def get_states(
+            self,
+            instances,
+    ):
+        return {instance["DBInstanceArn"]: instance["DBInstanceStatus"] for instance in self._describe([instance.id for instance in instances])}
+
+    def _log_tags(
             self,
             id,
             name,
             updated_tags,
-            **kwargs
     ):
         for tag, values in updated_tags.items():
             logging.info(
@@ -108,16 +185,108 @@ class RDSClient(AWSClient):
                     values["new"],
                 )
             )
+
+    def update_tags(
+            self,
+            id,
+            name,
+            updated_tags,
+            **kwargs
+    ):
+        self._log_tags(id, name, updated_tags)
         formatted_tags = [{"Key": tag, "Value": str(values["new"])} for tag, values in updated_tags.items()]
         if not self._dry_run:
-            # This is super sloppy; right now we're relying on the fact that this is called after ec2_client has created for the relevant region
-            # Later could either pass it in, or create an array of clients for regions
             # str(value) takes care of converting datetime.date to string in isoformat '2024-01-01'
             self.client.add_tags_to_resource(
                 ResourceName=id,
                 Tags=formatted_tags,
             )
 
+    def tag_call(
+            self,
+            instance,
+            updated_tags,
+    ):
+        return (
+            instance.id,
+            self.client.add_tags_to_resource,
+            {
+                "ResourceName": instance.id,
+                "Tags": [{"Key": tag, "Value": str(values["new"])} for tag, values in updated_tags.items()],
+            },
+        )
+
+    def update_tags_batch(
+            self,
+            items,
+    ):
+        # RDS has no multi-resource tagging call: either the tagging API (tag_writer: tagging_api),
+        # or one add_tags_to_resource per instance, run concurrently
+        for instance, updated_tags in items:
+            self._log_tags(instance.id, instance.name, updated_tags)
+        if self._dry_run:
+            return dict()
+        if self._tag_writer == "tagging_api":
+            failed = self.tag_resources(items)
+        else:
+            failed = self.run_concurrently([self.tag_call(instance, updated_tags) for instance, updated_tags in items])
+        for id, error in failed.items():
+            logging.info("Exception updating tags on rds instance [{}] in region {}: {}".format(id, self._region_name, error))
+        return failed
+
+    def _action_call(
+        self,
+        action: str,
+        id: str,
+        name: str,
+    ):
+        """
+        (key, function, kwargs) of a stop or delete, for run_concurrently
+        """
+        logging.info(
+            "{}{} rds instance {} [{}] in region {}".format(
+                self._dry_run_label,
+                "Stopping" if action == "stop" else "Deleting",
+                name,
+                id,
+                self._region_name,
+            )
+        )
+        if action == "stop":
+            return (
+                id,
+                self.client.stop_db_instance,
+                {
+                    "DBInstanceIdentifier": name,
+                    "DBSnapshotIdentifier": "{}-stop-{}".format(name, datetime.date.today()),
+                },
+            )
+        return (
+            id,
+            self.client.delete_db_instance,
+            {
+                "DBInstanceIdentifier": name,
+                "SkipFinalSnapshot": False,
+                "FinalDBSnapshotIdentifier": "{}-delete-{}".format(name, datetime.date.today())[:63],
+                "DeleteAutomatedBackups": False,
+            },
+        )
+
+    def do_actions(
+        self,
+        action: str,
+        instances: list,
+    ):
+        if action not in ("stop", "delete"):
+            return dict()
+        calls = [self._action_call(action, instance.id, instance.name) for instance in instances]
+        if self._dry_run:
+            return dict()
+        failed = self.run_concurrently(calls)
+        for id, error in failed.items():
+            logging.info("Exception on {} of rds instance [{}] in region {}: {}".format(action, id, self._region_name, error))
+        return failed
+
     def do_action(
         self,
         action: str,
@@ -143,62 +312,17 @@ class RDSClient(AWSClient):
         name: str,
         **kwargs,
     ):
-        logging.info(
-            "{}Stopping rds instance {} [{}] in region {}".format(
-                self._dry_run_label,
-                name,
-                id,
-                self._region_name,
-            )
-        )
+        call = self._action_call("stop", id, name)
         if not self._dry_run:
-            try:
-                self.client.stop_db_instance(
-                    DBInstanceIdentifier=name,
-                    DBSnapshotIdentifier="{}-stop-{}".format(name,datetime.date.today()),
-                )
-            except:
-                logging.info(
-                    "Exception stopping rds instance {} [{}] in region {}".format(
-                        name,
-                        id,
-                        self._region_name,
-                    )
-                )
+            for id, error in self.run_concurrently([call]).items():
+                logging.info("Exception stopping rds instance {} [{}] in region {}: {}".format(name, id, self._region_name, error))
 
     def delete(
         self,
         id: str,
         name: str,
     ):
-        logging.info(
-            "{}Deleting rds instance {} [{}] in region {}".format(
-                self._dry_run_label,
-                name,
-                id,
-                self._region_name,
-            )
-        )
-        print("{}-delete-snapshot-{}".format(
-                    name,
-                    datetime.date.today(),
-                )[:63])
+        call = self._action_call("delete", id, name)
         if not self._dry_run:
-            try:
-                self.client.delete_db_instance(
-                    DBInstanceIdentifier=name,
-                    SkipFinalSnapshot=False,
-                    FinalDBSnapshotIdentifier="{}-delete-{}".format(
-                        name,
-                        datetime.date.today(),
-                    )[:63],
-                    DeleteAutomatedBackups=False,
-                )
-            except:
-                logging.info(
-                    "Exception terminating rds instance {} [{}] in region {}".format(
-                        name,
-                        id,
-                        self._region_name,
-                    )
-                )
\ No newline at end of file
+            for id, error in self.run_concurrently([call]).items():
+                logging.info("Exception deleting rds instance {} [{}] in region {}: {}".format(name, id, self._region_name, error))
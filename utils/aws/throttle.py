@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import time
+import logging
+import threading
+
+
+# Error codes AWS services use for request rate limiting
+THROTTLE_ERROR_CODES = (
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "RequestThrottled",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+    "SlowDown",
+)
+
+THROTTLE_DEFAULTS = {
+    "rate": 10.0,       # initial requests per second, per (region, service, API family)
+    "burst": 10,        # bucket capacity
+    "min_rate": 0.5,
+    "max_rate": 100.0,
+    "increase": 0.1,    # additive increase (requests per second) per successful call
+    "decrease": 0.5,    # multiplicative decrease on a throttling response
+    "cooldown": 1.0,    # seconds between two decreases (a burst of throttles counts once)
+}
+
+
+def api_family(
+    operation: str,
+):
+    """
+    EC2 (and most services) meter read-only and mutating API calls separately
+    """
+    return "read" if operation.startswith(("Describe", "List", "Get")) else "write"
+
+
+class Throttle:
+    """
+    Token bucket whose rate adapts with AIMD: it grows by `increase` on each success and is
+    multiplied by `decrease` on a throttling response (at most once per `cooldown` seconds).
+    Callers that find the bucket empty reserve a token and sleep outside the lock, so they are served in order.
+    """
+
+    def __init__(
+        self,
+        rate: float = THROTTLE_DEFAULTS["rate"],
+        burst: int = THROTTLE_DEFAULTS["burst"],
+        min_rate: float = THROTTLE_DEFAULTS["min_rate"],
+        max_rate: float = THROTTLE_DEFAULTS["max_rate"],
+        increase: float = THROTTLE_DEFAULTS["increase"],
+        decrease: float = THROTTLE_DEFAULTS["decrease"],
+        cooldown: float = THROTTLE_DEFAULTS["cooldown"],
+    ) -> None:
+        self.rate = rate
+        self._capacity = burst
+        self._tokens = burst
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase = increase
+        self._decrease = decrease
+        self._cooldown = cooldown
+        self._last = time.monotonic()
+        self._last_decrease = 0
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttles = 0
+        self.wait_seconds = 0.0
+
+    def acquire(
+        self,
+    ):
+        """
+        Take one token, sleeping until it is available. Returns the time slept (seconds).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            self.calls += 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            self.wait_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_success(
+        self,
+    ):
+        with self._lock:
+            self.rate = min(self._max_rate, self.rate + self._increase)
+
+    def on_throttle(
+        self,
+    ):
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self._cooldown:
+                self.rate = max(self._min_rate, self.rate * self._decrease)
+                # Drop any burst allowance, the limit has been reached
+                self._tokens = min(self._tokens, 0)
+                self._last_decrease = now
+                return True
+        return False
+
+
+class ThrottleRegistry:
+    """
+    Throttles shared by every client (and thread) of the process, one per (region, service, API family)
+    """
+
+    def __init__(
+        self,
+        throttle_config: dict = None,
+    ) -> None:
+        self._lock = threading.Lock()
+        self._throttles = dict()
+        self.configure(throttle_config)
+
+    def configure(
+        self,
+        throttle_config: dict = None,
+    ):
+        self._config = THROTTLE_DEFAULTS | (throttle_config or dict())
+
+    def get(
+        self,
+        region: str,
+        service: str,
+        family: str,
+    ):
+        key = (region, service, family)
+        with self._lock:
+            if key not in self._throttles:
+                self._throttles[key] = Throttle(**self._config)
+            return self._throttles[key]
+
+    def stats(
+        self,
+    ):
+        with self._lock:
+            return {
+                "/".join(key): {
+                    "rate": round(throttle.rate, 2),
+                    "calls": throttle.calls,
+                    "throttles": throttle.throttles,
+                    "wait_seconds": round(throttle.wait_seconds, 3),
+                }
+                for key, throttle in self._throttles.items()
+            }
+
+    def attach(
+        self,
+        client,
+    ):
+        """
+        Route every request (including retries) of a boto3 client through the shared throttles
+        """
+        region = client.meta.region_name
+        service = client.meta.service_model.service_name
+
+        def before_send(event_name, **kwargs):
+            # event_name is before-send.<service id>.<operation>
+            self.get(region, service, api_family(event_name.rsplit(".", 1)[-1])).acquire()
+
+        def needs_retry(response, operation, **kwargs):
+            if response is None:
+                return None
+            throttle = self.get(region, service, api_family(operation.name))
+            code = response[1].get("Error", dict()).get("Code")
+            if code in THROTTLE_ERROR_CODES:
+                if throttle.on_throttle():
+                    logging.info(
+                        "Throttled ({}) on {} {} in region {}, reducing rate to {:.2f}/s".format(
+                            code,
+                            service,
+                            operation.name,
+                            region,
+                            throttle.rate,
+                        )
+                    )
+            elif "Error" not in response[1]:
+                throttle.on_success()
+            return None
+
+        client.meta.events.register("before-send", before_send)
+        client.meta.events.register("needs-retry", needs_retry)
+        return client
+
+
+# Process wide registry used by AWSClient
+THROTTLES = ThrottleRegistry()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import json
+import logging
+
+
+def _split_s3(
+    location: str,
+):
+    bucket, _, key = location[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def load_checkpoint(
+    location: str,
+    run_date: str,
+):
+    """
+    Returns the work units completed so far for run_date (empty if there is no checkpoint, or it is for another day)
+    location is a local path or s3://bucket/key
+    """
+    try:
+        if location.startswith("s3://"):
+            import boto3
+
+            bucket, key = _split_s3(location)
+            checkpoint = json.loads(boto3.client("s3").get_object(Bucket=bucket, Key=key)["Body"].read())
+        else:
+            with open(location, "r") as f:
+                checkpoint = json.load(f)
+    except Exception:
+        logging.info("No checkpoint found at {}".format(location))
+        return list()
+
+    if checkpoint.get("run_date") != run_date:
+        return list()
+    logging.info("Checkpoint {}: {} work units already completed".format(location, len(checkpoint.get("completed_units", list()))))
+    return checkpoint.get("completed_units", list())
+
+
+def save_checkpoint(
+    location: str,
+    run_date: str,
+    completed_units: list,
+):
+    checkpoint = json.dumps(
+        {
+            "run_date": run_date,
+            "completed_units": sorted(set(completed_units)),
+        }
+    )
+    if location.startswith("s3://"):
+        import boto3
+
+        bucket, key = _split_s3(location)
+        boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=checkpoint.encode("utf-8"))
+    else:
+        tmp_location = "{}.tmp".format(location)
+        with open(tmp_location, "w") as f:
+            f.write(checkpoint)
+        os.replace(tmp_location, location)
+    logging.info("Saved checkpoint {} ({} work units completed)".format(location, len(completed_units)))
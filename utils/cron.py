@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import datetime
+
+
+# (name, min, max) of the five cron fields
+CRON_FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),  # Sunday is 0 or 7
+)
+
+
+def parse_cron_field(
+    field: str,
+    low: int,
+    high: int,
+):
+    """
+    Expand one cron field (*, */n, a, a-b, a-b/n, comma separated lists) into a set of values
+    """
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/")
+            step = int(step)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = [int(v) for v in part.split("-")]
+        else:
+            start = end = int(part)
+            if step > 1:
+                end = high
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError("Invalid cron field '{}'".format(field))
+        values |= set(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """
+    Standard five field cron expression (minute hour day month weekday), in local time.
+    As in cron, if both day and weekday are restricted, a time matches if either matches.
+    """
+
+    def __init__(
+        self,
+        expression: str,
+    ) -> None:
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("Invalid cron expression '{}', expected 5 fields".format(expression))
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            parse_cron_field(field, low, high) for field, (name, low, high) in zip(fields, CRON_FIELDS)
+        ]
+        self.weekdays = {v % 7 for v in self.weekdays}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(
+        self,
+        dt: datetime.datetime,
+    ):
+        day = dt.day in self.days
+        # datetime.weekday() is 0 for Monday, cron uses 0 for Sunday
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(
+        self,
+        dt: datetime.datetime,
+    ):
+        """
+        First matching minute strictly after dt
+        """
+        t = dt.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError("Cron expression '{}' never matches".format(self.expression))
+
+
+def parse_deadline(
+    value: str,
+    now: datetime.datetime = None,
+):
+    """
+    Deadline of a run: a number of seconds from now, or a local time of day (HH:MM, the next one to come)
+    """
+    now = now or datetime.datetime.now()
+    if ":" not in value:
+        return now + datetime.timedelta(seconds=float(value))
+    t = datetime.datetime.strptime(value, "%H:%M").time()
+    deadline = datetime.datetime.combine(now.date(), t)
+    if deadline <= now:
+        deadline += datetime.timedelta(days=1)
+    return deadline
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import sys
+import json
+import time
+import yaml
+import logging
+import datetime
+
+from utils import sys_exc, datetime_handler
+from utils.cron import CronSchedule
+
+
+DAEMON_DEFAULTS = {
+    "schedule": "0 6 * * *",
+    "status_file": None,
+    "poll_seconds": 30,
+}
+
+
+def write_status(
+    path: str,
+    status: dict,
+):
+    """
+    Atomically replace the health/status file
+    """
+    if not path:
+        return
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "w") as f:
+        json.dump(status, f, indent=3, default=datetime_handler)
+    os.replace(tmp_path, path)
+
+
+def run_daemon(
+    config_path: str,
+    run,
+    poll=None,
+):
+    """
+    Run the cleaner on the schedule in the daemon section of the config, until interrupted.
+    run(config, cache) is called for every scheduled run; cache (a dict) is kept between runs,
+    so clients, sessions and Slack user lookups stay warm.
+    poll(config, cache), if given, is called every poll_seconds between runs (e.g. to process queued events).
+    The YAML config is reloaded whenever its modification time changes (AWS clients are then rebuilt,
+    the Slack client only if the slack section changed).
+    """
+    config = None
+    config_mtime = None
+    cache = dict()
+    status = {
+        "pid": os.getpid(),
+        "state": "starting",
+        "started": datetime.datetime.now(),
+        "config": config_path,
+        "config_loaded": None,
+        "schedule": None,
+        "next_run": None,
+        "runs": 0,
+        "last_run": None,
+    }
+
+    while True:
+        # Hot reload
+        mtime = os.stat(config_path).st_mtime
+        if mtime != config_mtime:
+            try:
+                with open(config_path, "r") as f:
+                    new_config = yaml.safe_load(f)
+                new_daemon_config = DAEMON_DEFAULTS | (new_config.get("daemon") or dict())
+                new_schedule = CronSchedule(new_daemon_config["schedule"])
+            except Exception:
+                if config is None:
+                    raise
+                logging.error("Unable to reload config {}, keeping previous one: {}".format(config_path, sys_exc(sys.exc_info())))
+            else:
+                if config is not None:
+                    logging.info("Config {} changed, reloading".format(config_path))
+                    cache.pop("aws_clients", None)
+                    if new_config.get("accounts") != config.get("accounts"):
+                        cache.pop("session_cache", None)
+                config = new_config
+                daemon_config = new_daemon_config
+                schedule = new_schedule
+                status["config_loaded"] = datetime.datetime.now()
+                status["schedule"] = schedule.expression
+                status["next_run"] = schedule.next_after(datetime.datetime.now())
+                logging.info("Next run at {}".format(status["next_run"]))
+            config_mtime = mtime
+
+        if datetime.datetime.now() >= status["next_run"]:
+            status["state"] = "running"
+            status["last_run"] = {"started": datetime.datetime.now()}
+            write_status(daemon_config["status_file"], status)
+            try:
+                run_summary = run(config, cache)
+                status["last_run"]["ok"] = True
+                status["last_run"]["results"] = run_summary.data["results"] if run_summary else None
+            except Exception:
+                logging.error("Scheduled run failed: {}".format(sys_exc(sys.exc_info())))
+                status["last_run"]["ok"] = False
+                status["last_run"]["error"] = sys_exc(sys.exc_info())
+            status["last_run"]["finished"] = datetime.datetime.now()
+            status["runs"] += 1
+            status["next_run"] = schedule.next_after(datetime.datetime.now())
+            logging.info("Next run at {}".format(status["next_run"]))
+
+        if poll:
+            try:
+                poll(config, cache)
+            except Exception:
+                logging.error("Poll between runs failed: {}".format(sys_exc(sys.exc_info())))
+
+        status["state"] = "idle"
+        status["heartbeat"] = datetime.datetime.now()
+        write_status(daemon_config["status_file"], status)
+
+        wait = (status["next_run"] - datetime.datetime.now()).total_seconds()
+        time.sleep(max(0, min(daemon_config["poll_seconds"], wait)))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import json
+import fnmatch
+import logging
+
+# Events taken from the queue (and processed together) at a time
+EVENTS_PER_BATCH = 100
+# Messages per SQS receive_message / delete_message_batch call (their maximum)
+SQS_BATCH_SIZE = 10
+
+# CloudTrail calls (EventBridge "AWS API Call via CloudTrail" events) that change the tags of an instance
+EC2_TAG_CALLS = ("CreateTags", "DeleteTags")
+RDS_TAG_CALLS = ("AddTagsToResource", "RemoveTagsFromResource")
+# Prefix of the tags the cleaner writes; tagging events changing only these are its own tag writes coming back
+OWN_TAG_PREFIX = "aws_cleaner/"
+
+
+def tag_keys(
+    detail: dict,
+):
+    """
+    Keys of the tags a CloudTrail tagging call changes (None if it doesn't say)
+    """
+    parameters = detail.get("requestParameters") or dict()
+    if detail.get("eventName") in EC2_TAG_CALLS:
+        items = (parameters.get("tagSet") or dict()).get("items")
+        return [item.get("key") for item in items] if items else None
+    if detail.get("eventName") == "AddTagsToResource":
+        tags = parameters.get("tags")
+        return [tag.get("key") for tag in tags] if tags else None
+    return parameters.get("tagKeys") or None
+
+
+def parse_event(
+    event: dict,
+    ignored_principals: list = None,
+):
+    """
+    Instances an EventBridge event is about, as a list of {"account", "region", "instance_type", "id"}:
+    * EC2 Instance State-change Notification: the instance
+    * RDS DB Instance Event: the instance (by ARN)
+    * CloudTrail CreateTags / DeleteTags (ec2) and AddTagsToResource / RemoveTagsFromResource (rds): the tagged instances,
+      unless the call only changed aws_cleaner/* tags or was made by one of ignored_principals (ARN patterns)
+    Other events are about no instance.
+    """
+    source = event.get("source")
+    detail_type = event.get("detail-type")
+    detail = event.get("detail") or dict()
+    ids = list()
+    if detail_type == "AWS API Call via CloudTrail":
+        # The cleaner's own tag writes
+        principal = (detail.get("userIdentity") or dict()).get("arn") or ""
+        if any(fnmatch.fnmatchcase(principal, pattern) for pattern in ignored_principals or list()):
+            return list()
+        keys = tag_keys(detail)
+        if keys and all((key or "").startswith(OWN_TAG_PREFIX) for key in keys):
+            return list()
+    if source == "aws.ec2":
+        instance_type = "ec2"
+        if detail_type == "EC2 Instance State-change Notification":
+            ids = [detail.get("instance-id")]
+        elif detail_type == "AWS API Call via CloudTrail" and detail.get("eventName") in EC2_TAG_CALLS:
+            items = (((detail.get("requestParameters") or dict()).get("resourcesSet") or dict()).get("items")) or list()
+            ids = [item.get("resourceId") for item in items if (item.get("resourceId") or "").startswith("i-")]
+    elif source == "aws.rds":
+        instance_type = "rds"
+        if detail_type == "RDS DB Instance Event":
+            ids = [detail.get("SourceArn")]
+        elif detail_type == "AWS API Call via CloudTrail" and detail.get("eventName") in RDS_TAG_CALLS:
+            resource_name = (detail.get("requestParameters") or dict()).get("resourceName") or ""
+            ids = [resource_name] if ":db:" in resource_name else list()
+    return [
+        {
+            "account": event.get("account"),
+            "region": event.get("region"),
+            "instance_type": instance_type,
+            "id": id,
+        }
+        for id in ids
+        if id
+    ]
+
+
+class FileEventQueue:
+    """
+    Local stand-in for an SQS queue: a file of events, one JSON object per line, appended by someone else.
+    Lines are handed out in order; the offset of the last deleted one is kept in "<path>.offset".
+    """
+
+    def __init__(
+        self,
+        path: str,
+    ) -> None:
+        self.path = path
+        self._offset_path = "{}.offset".format(path)
+        self._offset = 0
+        if os.path.exists(self._offset_path):
+            with open(self._offset_path, "r") as f:
+                self._offset = int(f.read().strip() or 0)
+        self._received = self._offset
+
+    def receive(
+        self,
+        max_messages: int,
+    ):
+        """
+        Up to max_messages (handle, body) not received yet; a line still being written isn't
+        """
+        messages = list()
+        if not os.path.exists(self.path):
+            return messages
+        with open(self.path, "rb") as f:
+            f.seek(self._received)
+            while len(messages) < max_messages:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                self._received = f.tell()
+                if line.strip():
+                    messages.append((self._received, line.decode()))
+        return messages
+
+    def delete(
+        self,
+        handles: list,
+    ):
+        if not handles:
+            return
+        self._offset = max(self._offset, *handles)
+        tmp_path = "{}.tmp".format(self._offset_path)
+        with open(tmp_path, "w") as f:
+            f.write(str(self._offset))
+        os.replace(tmp_path, self._offset_path)
+
+
+class SQSEventQueue:
+    """
+    SQS queue receiving EventBridge events (the event is the message body)
+    """
+
+    def __init__(
+        self,
+        url: str,
+        session=None,
+        wait_seconds: int = 0,
+    ) -> None:
+        import boto3
+
+        self.url = url
+        self.wait_seconds = wait_seconds
+        # https://sqs.<region>.amazonaws.com/<account>/<name>
+        host = url.split("/")[2]
+        region_name = host.split(".")[1] if host.startswith("sqs.") else None
+        self.client = (session or boto3).client("sqs", region_name=region_name)
+
+    def receive(
+        self,
+        max_messages: int,
+    ):
+        response = self.client.receive_message(
+            QueueUrl=self.url,
+            MaxNumberOfMessages=max(1, min(SQS_BATCH_SIZE, max_messages)),
+            WaitTimeSeconds=self.wait_seconds,
+        )
+        return [(message["ReceiptHandle"], message["Body"]) for message in response.get("Messages", list())]
+
+    def delete(
+        self,
+        handles: list,
+    ):
+        for n in range(0, len(handles), SQS_BATCH_SIZE):
+            response = self.client.delete_message_batch(
+                QueueUrl=self.url,
+                Entries=[{"Id": str(m), "ReceiptHandle": handle} for m, handle in enumerate(handles[n:n + SQS_BATCH_SIZE])],
+            )
+            for failed in response.get("Failed", list()):
+                logging.warning("Unable to delete event from {}: {}".format(self.url, failed.get("Message")))
+
+
+def open_event_queue(
+    source: str,
+    session=None,
+    wait_seconds: int = 0,
+):
+    """
+    SQSEventQueue for an SQS queue URL, else FileEventQueue of a local file
+    """
+    if source.startswith("https://"):
+        return SQSEventQueue(source, session=session, wait_seconds=wait_seconds)
+    return FileEventQueue(source)
+
+
+def receive_events(
+    queue,
+    max_messages: int,
+    ignored_principals: list = None,
+):
+    """
+    Returns (handles, instance references) of up to max_messages queued messages; unreadable messages are logged
+    (and deleted with the others, since they would never become readable)
+    """
+    handles = list()
+    refs = list()
+    for handle, body in queue.receive(max_messages):
+        handles.append(handle)
+        try:
+            refs += parse_event(json.loads(body), ignored_principals=ignored_principals)
+        except (ValueError, AttributeError):
+            logging.warning("Ignoring unreadable event: {}".format(body[:200]))
+    return handles, refs
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import json
+import logging
+import threading
+
+from utils import datetime_handler
+
+
+class Journal:
+    """
+    Append-only write-ahead journal of a run's mutations, one JSON object per line:
+    * {"op": "run", "run_date": ...}: first line
+    * {"op": "intent", "id": ..., "unit": ..., "account": ..., "instance": ..., "action": ..., "updated_tags": ..., "messages": [...]}:
+      everything a decision record will change, written (and fsynced) before any of it is done
+    * {"op": "done", "id": ..., "part": "action" | "tags" | "message:<n>"}: one part of an intent completed
+    * {"op": "unit_done", "unit": ...}: every instance of a work unit processed
+
+    Lines are buffered and fsynced by sync(), which callers invoke once per batch of intents;
+    "done" lines that never reached the disk only cause that part to be redone on resume.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        run_date: str,
+        resume: bool = False,
+    ) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        # A new run starts a new journal; a resumed run appends to the one it resumes
+        self._file = open(path, "a" if resume else "w")
+        if not resume or self._file.tell() == 0:
+            self._write({"op": "run", "run_date": run_date})
+        self.sync()
+
+    def _write(
+        self,
+        entry: dict,
+    ):
+        with self._lock:
+            self._file.write(json.dumps(entry, default=datetime_handler, separators=(",", ":")) + "\n")
+
+    def intent(
+        self,
+        entry_id: str,
+        unit: dict,
+        instance: dict,
+        action: str,
+        updated_tags: dict,
+        messages: list,
+        **fields,
+    ):
+        # Extra fields (e.g. a plan's tag fingerprints) are stored with the intent
+        self._write(
+            {
+                "op": "intent",
+                "id": entry_id,
+                "unit": unit["key"],
+                "account": {k: unit["account"].get(k) for k in ("id", "name", "role_arn")},
+                "region": unit["region"],
+                "instance_type": unit["instance_type"],
+                "instance": {k: instance.get(k) for k in ("type", "id", "region", "name", "email", "state", "account")},
+                "action": action,
+                "updated_tags": updated_tags,
+                "messages": messages,
+            }
+            | fields
+        )
+
+    def done(
+        self,
+        entry_id: str,
+        part: str,
+    ):
+        self._write({"op": "done", "id": entry_id, "part": part})
+
+    def unit_done(
+        self,
+        key: str,
+    ):
+        self._write({"op": "unit_done", "unit": key})
+
+    def sync(
+        self,
+    ):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(
+        self,
+    ):
+        self.sync()
+        self._file.close()
+
+
+def intent_parts(
+    intent: dict,
+):
+    parts = list()
+    if intent["action"]:
+        parts.append("action")
+    if intent["updated_tags"]:
+        parts.append("tags")
+    parts += ["message:{}".format(n) for n in range(len(intent["messages"]))]
+    return parts
+
+
+def load_journal(
+    path: str,
+    run_date: str,
+):
+    """
+    State of an earlier run of run_date:
+    {"resumable": bool, "completed_units": [...], "completed": {entry id, ...}, "pending": [intent, ...]}
+    Each pending intent has a "remaining" list of parts still to be done.
+    Not resumable (and empty) if the journal is missing or for another day.
+    """
+    state = {"resumable": False, "completed_units": list(), "completed": set(), "pending": list()}
+    if not os.path.exists(path):
+        logging.info("No journal found at {}, nothing to resume".format(path))
+        return state
+
+    intents = dict()
+    done = dict()
+    with open(path, "r") as f:
+        for n, line in enumerate(f):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line may be cut short by a crash
+                logging.warning("Ignoring unreadable line {} of journal {}".format(n + 1, path))
+                continue
+            if entry["op"] == "run" and entry["run_date"] != run_date:
+                logging.info("Journal {} is for {}, nothing to resume".format(path, entry["run_date"]))
+                return state
+            elif entry["op"] == "intent":
+                intents[entry["id"]] = entry
+            elif entry["op"] == "done":
+                done.setdefault(entry["id"], set()).add(entry["part"])
+            elif entry["op"] == "unit_done":
+                state["completed_units"].append(entry["unit"])
+
+    state["resumable"] = True
+    for entry_id, intent in intents.items():
+        remaining = [part for part in intent_parts(intent) if part not in done.get(entry_id, set())]
+        if remaining:
+            state["pending"].append(intent | {"remaining": remaining})
+        else:
+            state["completed"].add(entry_id)
+    logging.info(
+        "Journal {}: {} work units and {} instances completed, {} instances pending".format(
+            path,
+            len(state["completed_units"]),
+            len(state["completed"]),
+            len(state["pending"]),
+        )
+    )
+    return state
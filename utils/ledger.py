@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import hashlib
+import datetime
+import threading
+
+
+class DeliveryLedger:
+    """
+    Slack messages already delivered, so a rerun on the same day doesn't send them again.
+    A message is identified by a hash of (channel, instance ID, result, run date); the file holds one
+    "<run date> <hash>" line per delivery. Entries older than retention_days are dropped when it is opened.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        run_date: datetime.date,
+        retention_days: int = 7,
+    ) -> None:
+        self.path = path
+        self.run_date = str(run_date)
+        self._lock = threading.Lock()
+        self._delivered = set()
+        self.skipped = 0
+
+        oldest = str(run_date - datetime.timedelta(days=retention_days))
+        lines = list()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    fields = line.split()
+                    # Skips lines cut short by a crash, and expired entries
+                    if len(fields) == 2 and fields[0] >= oldest:
+                        lines.append(line)
+                        if fields[0] == self.run_date:
+                            self._delivered.add(fields[1])
+
+        # Rewrite without the expired entries, then append to it
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, "w") as f:
+            f.writelines(lines)
+        os.replace(tmp_path, path)
+        self._file = open(path, "a")
+
+    def key(
+        self,
+        channel: str,
+        instance_id: str,
+        result: str,
+    ):
+        result = getattr(result, "value", result)
+        return hashlib.sha256("{}|{}|{}|{}".format(channel, instance_id, result, self.run_date).encode()).hexdigest()[:20]
+
+    def delivered(
+        self,
+        key: str,
+    ):
+        with self._lock:
+            if key in self._delivered:
+                self.skipped += 1
+                return True
+            return False
+
+    def record(
+        self,
+        key: str,
+    ):
+        with self._lock:
+            self._delivered.add(key)
+            self._file.write("{} {}\n".format(self.run_date, key))
+            self._file.flush()
+
+    def close(
+        self,
+    ):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import datetime
+import threading
+import collections
+
+
+class ActionLeveller:
+    """
+    Spreads the action dates given to newly seen instances (ADD_ACTION_DATE), so no day gets more than
+    daily_budget actions. Discovery counts the action dates already scheduled (observe); each new date is then
+    the first day from run date + default days, up to window_days later (never past run date + max days),
+    still under budget. If every day of the window is full, the least loaded one is used.
+    """
+
+    def __init__(
+        self,
+        daily_budget: int,
+        window_days: int = 14,
+    ) -> None:
+        self.daily_budget = daily_budget
+        self.window_days = window_days
+        self.scheduled = collections.Counter()
+        self.levelled = 0
+        self._lock = threading.Lock()
+
+    def observe(
+        self,
+        d_action_date: datetime.date,
+    ):
+        if d_action_date is not None:
+            with self._lock:
+                self.scheduled[d_action_date] += 1
+
+    def assign(
+        self,
+        d_run_date: datetime.date,
+        i_default_days: int,
+        i_max_days: int,
+    ):
+        """
+        Action date for a newly seen instance (counted as scheduled)
+        """
+        earliest = d_run_date + datetime.timedelta(days=i_default_days)
+        days = [
+            earliest + datetime.timedelta(days=n)
+            for n in range(max(0, min(self.window_days, i_max_days - i_default_days)) + 1)
+        ]
+        with self._lock:
+            d_action_date = next(
+                (day for day in days if self.scheduled[day] < self.daily_budget),
+                min(days, key=lambda day: self.scheduled[day]),
+            )
+            self.scheduled[d_action_date] += 1
+            if d_action_date != earliest:
+                self.levelled += 1
+        return d_action_date
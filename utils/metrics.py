@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import json
+import time
+import bisect
+import threading
+import contextlib
+
+
+# Upper bounds (seconds) of the per-call latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metrics:
+    """
+    Wall time, counts and latency histograms per phase (secret fetch, discovery, decision, tag writes,
+    actions, Slack sends, ...), with optional labels such as region and type.
+    Recording is a couple of perf_counter calls and a dict update under a lock, so it stays far below
+    the cost of the API calls it measures.
+    """
+
+    def __init__(
+        self,
+    ) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(
+        self,
+    ):
+        with self._lock:
+            # (phase, ((label, value), ...)) -> {"count", "seconds", "items", "buckets"}
+            self._phases = dict()
+
+    def observe(
+        self,
+        phase: str,
+        seconds: float,
+        items: int = 1,
+        **labels,
+    ):
+        """
+        Record one call of a phase that took `seconds` and handled `items` items (instances, messages, ...)
+        """
+        key = (phase, tuple(sorted(labels.items())))
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            values = self._phases.get(key)
+            if values is None:
+                values = self._phases[key] = {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "items": 0,
+                    "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+                }
+            values["count"] += 1
+            values["seconds"] += seconds
+            values["items"] += items
+            values["buckets"][bucket] += 1
+
+    @contextlib.contextmanager
+    def timer(
+        self,
+        phase: str,
+        items: int = 1,
+        **labels,
+    ):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start, items=items, **labels)
+
+    def to_dict(
+        self,
+    ):
+        """
+        JSON friendly summary: one entry per phase and label set
+        """
+        with self._lock:
+            phases = sorted(self._phases.items())
+        return [
+            {
+                "phase": phase,
+                "labels": dict(labels),
+                "count": values["count"],
+                "items": values["items"],
+                "seconds": round(values["seconds"], 6),
+                "histogram": {
+                    str(le): n for le, n in zip(list(LATENCY_BUCKETS) + ["+Inf"], values["buckets"])
+                },
+            }
+            for (phase, labels), values in phases
+        ]
+
+    def to_prometheus(
+        self,
+        prefix: str = "aws_cleaner",
+    ):
+        """
+        Prometheus text exposition format (for the node_exporter textfile collector)
+        """
+        with self._lock:
+            phases = sorted(self._phases.items())
+
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{{{}}}".format(",".join(['{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in pairs]))
+
+        lines = [
+            "# HELP {}_phase_seconds_total Wall time spent per phase".format(prefix),
+            "# TYPE {}_phase_seconds_total counter".format(prefix),
+        ]
+        for (phase, labels), values in phases:
+            lines.append("{}_phase_seconds_total{} {:.6f}".format(prefix, label_text((("phase", phase),) + labels), values["seconds"]))
+        lines += [
+            "# HELP {}_phase_items_total Items (instances, messages, ...) handled per phase".format(prefix),
+            "# TYPE {}_phase_items_total counter".format(prefix),
+        ]
+        for (phase, labels), values in phases:
+            lines.append("{}_phase_items_total{} {}".format(prefix, label_text((("phase", phase),) + labels), values["items"]))
+        lines += [
+            "# HELP {}_call_duration_seconds Latency of individual calls per phase".format(prefix),
+            "# TYPE {}_call_duration_seconds histogram".format(prefix),
+        ]
+        for (phase, labels), values in phases:
+            base = (("phase", phase),) + labels
+            cumulative = 0
+            for le, n in zip(list(LATENCY_BUCKETS) + ["+Inf"], values["buckets"]):
+                cumulative += n
+                lines.append("{}_call_duration_seconds_bucket{} {}".format(prefix, label_text(base, (("le", le),)), cumulative))
+            lines.append("{}_call_duration_seconds_sum{} {:.6f}".format(prefix, label_text(base), values["seconds"]))
+            lines.append("{}_call_duration_seconds_count{} {}".format(prefix, label_text(base), values["count"]))
+        return "\n".join(lines) + "\n"
+
+    def write(
+        self,
+        prometheus_file: str = None,
+        json_file: str = None,
+    ):
+        # Written to a temporary file and renamed, so the textfile collector never reads a partial file
+        for path, content in (
+            (prometheus_file, self.to_prometheus),
+            (json_file, lambda: json.dumps(self.to_dict(), indent=3)),
+        ):
+            if path:
+                tmp_path = "{}.tmp".format(path)
+                with open(tmp_path, "w") as f:
+                    f.write(content())
+                os.replace(tmp_path, path)
+
+
+# Process wide metrics, reset at the start of each run
+METRICS = Metrics()
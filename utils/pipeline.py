@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import sys
+import queue
+import logging
+import threading
+
+from utils import sys_exc
+
+
+# Marks the end of a stage's input (one per worker)
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues.
+
+    Each stage runs its own pool of worker threads. A stage function receives one item
+    (or a list of items if the stage has a batch_size) and returns an iterable of items
+    for the next stage (or None). Generators are consumed lazily, so a stage blocks on
+    a full downstream queue (backpressure) rather than buffering its whole output.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = 100,
+    ) -> None:
+        self._queue_size = queue_size
+        self._stages = list()
+
+    def add_stage(
+        self,
+        name: str,
+        func,
+        workers: int = 1,
+        batch_size: int = None,
+    ):
+        self._stages.append(
+            {
+                "name": name,
+                "func": func,
+                "workers": max(1, workers or 1),
+                "batch_size": batch_size,
+            }
+        )
+        return self
+
+    def run(
+        self,
+        items,
+        should_stop=None,
+    ):
+        """
+        Feed items into the first stage and block until every stage has drained.
+        If should_stop() returns True, no more items are fed (items already in flight are finished).
+        Returns the number of items fed.
+        """
+        # queues[n] is the input of stage n; the last stage's output is discarded
+        queues = [queue.Queue(maxsize=self._queue_size) for _ in self._stages]
+        remaining = [stage["workers"] for stage in self._stages]
+        lock = threading.Lock()
+        threads = list()
+
+        for n, stage in enumerate(self._stages):
+            for w in range(stage["workers"]):
+                thread = threading.Thread(
+                    target=self._worker,
+                    name="{}-{}".format(stage["name"], w),
+                    args=(n, queues, remaining, lock),
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        fed = 0
+        for item in items:
+            if should_stop and should_stop():
+                logging.info("Pipeline stopping early, not feeding remaining items")
+                break
+            queues[0].put(item)
+            fed += 1
+        for _ in range(self._stages[0]["workers"]):
+            queues[0].put(_DONE)
+
+        # Join with a timeout so KeyboardInterrupt still reaches the main thread
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+        return fed
+
+    def _worker(
+        self,
+        n: int,
+        queues: list,
+        remaining: list,
+        lock: threading.Lock,
+    ):
+        stage = self._stages[n]
+        in_queue = queues[n]
+        out_queue = queues[n + 1] if n + 1 < len(queues) else None
+
+        done = False
+        while not done:
+            item = in_queue.get()
+            if item is _DONE:
+                break
+
+            if stage["batch_size"]:
+                batch = [item]
+                # Take whatever is already waiting, without lingering for more
+                while len(batch) < stage["batch_size"]:
+                    try:
+                        item = in_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        done = True
+                        break
+                    batch.append(item)
+                item = batch
+
+            try:
+                for output in stage["func"](item) or list():
+                    if out_queue is not None:
+                        out_queue.put(output)
+            except Exception:
+                logging.error(
+                    "Error in pipeline stage {}: {}".format(
+                        stage["name"],
+                        sys_exc(sys.exc_info()),
+                    )
+                )
+
+        # Last worker out closes the next stage's input
+        with lock:
+            remaining[n] -= 1
+            last = remaining[n] == 0
+        if last and out_queue is not None:
+            for _ in range(self._stages[n + 1]["workers"]):
+                out_queue.put(_DONE)
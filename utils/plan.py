@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import hashlib
+
+from utils.journal import Journal
+
+
+def tags_fingerprint(
+    tags: dict,
+):
+    """
+    Short hash of a resource's tags, to tell at apply time whether they changed since planning
+    """
+    return hashlib.sha256(json.dumps(tags or dict(), sort_keys=True).encode()).hexdigest()[:16]
+
+
+class Plan(Journal):
+    """
+    Mutation plan written by --plan and run by --apply: the journal format, with only a "run" line and intents.
+    Each intent also holds the fingerprint of the resource's tags when it was planned.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        run_date: str,
+    ) -> None:
+        super().__init__(path, run_date)
+
+    def add(
+        self,
+        record: dict,
+        messages: list,
+    ):
+        """
+        Plan a decision record; messages are in the journal's format
+        """
+        self.intent(
+            record["journal_id"],
+            unit=record["unit"],
+            instance=record["instance"],
+            action=record["action"],
+            updated_tags=record["updated_tags"],
+            messages=messages,
+            fingerprint=tags_fingerprint(record["instance"].tags),
+        )
+
+
+def load_plan(
+    path: str,
+):
+    """
+    Returns (run date, list of intents) of a plan file
+    Unlike a journal, a plan must be intact: any unreadable line is an error.
+    """
+    run_date = None
+    intents = list()
+    with open(path, "r") as f:
+        for n, line in enumerate(f):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                raise ValueError("Plan {} is damaged (line {} is unreadable)".format(path, n + 1))
+            if entry["op"] == "run":
+                run_date = entry["run_date"]
+            elif entry["op"] == "intent":
+                intents.append(entry)
+    if run_date is None:
+        raise ValueError("{} is not a plan file".format(path))
+    return run_date, intents
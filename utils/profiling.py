@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+
+
+PROFILE_MODES = ("deterministic", "sampling")
+# From Python 3.12 cProfile is built on sys.monitoring: one profiler sees every thread, and a second one can't
+# be enabled while it is active. Per-thread profilers are only possible before that.
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+# Phase of a process-wide profile, whose threads can't be told apart
+ALL_PHASES = "all"
+
+# Functions reported on their own: name -> (file name, function)
+HOT_SPOTS = {
+    "decide_instance": ("main.py", "decide_instance"),
+    "determine_action": ("__init__.py", "determine_action"),
+    "date_or_none": ("__init__.py", "date_or_none"),
+    "log_item": ("__init__.py", "log_item"),
+    "GenericInstance": ("generic_instance.py", "__init__"),
+    "slack_send_text": ("slack_client.py", "send_text"),
+    "slack_rate_limit": ("slack_client.py", "rate_limit"),
+}
+
+
+def thread_phase(
+    name: str,
+):
+    """
+    Pipeline workers are named <stage>-<n> (discovery-0, notification-1, ...), anything else runs in the main flow
+    """
+    stage, _, n = name.rpartition("-")
+    return stage if stage and n.isdigit() else "main"
+
+
+def hot_spot(
+    filename: str,
+    function: str,
+):
+    for name, (hot_file, hot_function) in HOT_SPOTS.items():
+        if function == hot_function and os.path.basename(filename) == hot_file:
+            return name
+    return None
+
+
+class Profiler:
+    """
+    Profiles every thread of a run, so pipeline stages are covered as well as the main thread.
+
+    * deterministic: one cProfile per thread, merged into a pstats file (from Python 3.12, one cProfile for the
+      whole process, whose time is reported as a single "all" phase)
+    * sampling: stacks of all threads sampled every `interval` seconds, written as collapsed stacks
+      (one "phase;file:function;... count" line per stack, the input of flamegraph.pl / speedscope)
+
+    Either way, time is also reported per phase (pipeline stage) and hot spot (HOT_SPOTS).
+    """
+
+    def __init__(
+        self,
+        mode: str = "deterministic",
+        interval: float = 0.005,
+    ) -> None:
+        if mode not in PROFILE_MODES:
+            raise ValueError("Unknown profile mode {}, use one of {}".format(mode, ", ".join(PROFILE_MODES)))
+        self.mode = mode
+        self._interval = interval
+        self._lock = threading.Lock()
+        # deterministic: (phase, cProfile.Profile) per thread
+        self._profiles = list()
+        # sampling: collapsed stack -> samples
+        self._stacks = dict()
+        self._sampler = None
+        self._stopped = threading.Event()
+
+    def start(
+        self,
+    ):
+        if self.mode == "deterministic" and PROCESS_WIDE_PROFILER:
+            profile = cProfile.Profile()
+            self._profiles.append((ALL_PHASES, profile))
+            profile.enable()
+        elif self.mode == "deterministic":
+            threading.setprofile(self._start_thread)
+            self._start_thread()
+        else:
+            self._stopped.clear()
+            self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+            self._sampler.start()
+        return self
+
+    def stop(
+        self,
+    ):
+        if self.mode == "deterministic" and PROCESS_WIDE_PROFILER:
+            self._profiles[0][1].disable()
+        elif self.mode == "deterministic":
+            threading.setprofile(None)
+            # Each profiler is disabled from this thread, the main thread's last (disable() clears the calling thread's hook)
+            for _, profile in reversed(self._profiles):
+                profile.disable()
+        else:
+            self._stopped.set()
+            self._sampler.join()
+
+    def __enter__(
+        self,
+    ):
+        return self.start()
+
+    def __exit__(
+        self,
+        *args,
+    ):
+        self.stop()
+
+    def _start_thread(
+        self,
+        *args,
+    ):
+        # Installed with threading.setprofile: runs on the first event of each new thread and replaces itself
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append((thread_phase(threading.current_thread().name), profile))
+        profile.enable()
+
+    def _sample(
+        self,
+    ):
+        own_ident = threading.get_ident()
+        while not self._stopped.wait(self._interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = list()
+                while frame is not None:
+                    stack.append("{}:{}".format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                    frame = frame.f_back
+                key = ";".join([thread_phase(names.get(ident, ""))] + stack[::-1])
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+
+    def report(
+        self,
+    ):
+        """
+        Returns {"phases": {phase: value}, "hot_spots": {(name, phase): {...}}}:
+        seconds / calls / cumulative seconds when deterministic, samples when sampling
+        """
+        phases = dict()
+        hot_spots = dict()
+        if self.mode == "deterministic":
+            for phase, profile in self._profiles:
+                stats = pstats.Stats(profile)
+                phases[phase] = phases.get(phase, 0) + stats.total_tt
+                for (filename, _, function), (_, calls, own, cumulative, _) in stats.stats.items():
+                    name = hot_spot(filename, function)
+                    if name:
+                        values = hot_spots.setdefault((name, phase), {"calls": 0, "seconds": 0.0, "cumulative_seconds": 0.0})
+                        values["calls"] += calls
+                        values["seconds"] += own
+                        values["cumulative_seconds"] += cumulative
+        else:
+            for key, samples in self._stacks.items():
+                phase, *frames = key.split(";")
+                phases[phase] = phases.get(phase, 0) + samples
+                # A sample counts once per hot spot on its stack (inclusive time)
+                for name in {hot_spot(*f.rsplit(":", 1)) for f in frames} - {None}:
+                    values = hot_spots.setdefault((name, phase), {"samples": 0})
+                    values["samples"] += samples
+        return {"phases": phases, "hot_spots": hot_spots}
+
+    def write(
+        self,
+        path: str,
+    ):
+        """
+        Write the pstats (deterministic) or collapsed stack (sampling) file, and log the phase / hot spot report
+        """
+        if self.mode == "deterministic":
+            stats = None
+            for _, profile in self._profiles:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            stats.dump_stats(path)
+        else:
+            with open(path, "w") as f:
+                for key, samples in sorted(self._stacks.items()):
+                    f.write("{} {}\n".format(key, samples))
+
+        report = self.report()
+        unit = "s" if self.mode == "deterministic" else " samples"
+        logging.info("Profile written to {}".format(path))
+        for phase, value in sorted(report["phases"].items()):
+            logging.info("Profile phase {}: {}{}".format(phase, round(value, 3), unit))
+        for (name, phase), values in sorted(report["hot_spots"].items()):
+            logging.info(
+                "Profile hot spot {} [{}]: {}".format(
+                    name,
+                    phase,
+                    ", ".join(["{} {}".format(round(v, 3), k.replace("_", " ")) for k, v in values.items()]),
+                )
+            )
+        return report
+
+
+def profile_path(
+    path: str,
+    daemon: bool = False,
+):
+    """
+    In daemon mode each run gets its own file: cleaner.pstats -> cleaner-20201231T060000.pstats
+    """
+    if not daemon:
+        return path
+    root, ext = os.path.splitext(path)
+    return "{}-{}{}".format(root, time.strftime("%Y%m%dT%H%M%S"), ext)
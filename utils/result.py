@@ -33,3 +33,18 @@ class Result(str, enum.Enum):
     IGNORE_OTHER_STATES = "IGNORE_OTHER_STATES"
     IGNORE_ASG = "IGNORE_ASG"
     SKIP_EXCEPTION = "SKIP_EXCEPTION"
+    DEFER_BUSY = "DEFER_BUSY"
+
+
+# Processing order when a run is prioritised (lowest first): due actions, then notifications,
+# then tag-only changes, then results that only log
+URGENCY = {
+    Result.COMPLETE_ACTION: 0,
+    Result.TRANSITION_ACTION: 0,
+    Result.PAST_BUMP_NOTIFICATION: 1,
+    Result.SEND_NOTIFICATION: 1,
+    Result.ADD_ACTION_DATE: 2,
+    Result.RESET_ACTION_DATE: 2,
+    Result.RESET_NOTIFICATIONS: 2,
+}
+LEAST_URGENT = 3
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import json
+import time
+import fcntl
+import socket
+import hashlib
+import logging
+import threading
+import contextlib
+
+
+def unit_key(
+    account_id: str,
+    region: str,
+    instance_type: str,
+):
+    """
+    Stable identifier of an (account, region, type) work unit
+    """
+    return "{}/{}/{}".format(account_id or "default", region, instance_type)
+
+
+def parse_shard(
+    shard: str,
+):
+    """
+    Parse a K/N shard specification (1 <= K <= N) into (K, N)
+    """
+    try:
+        k, n = [int(v) for v in shard.split("/")]
+    except Exception:
+        raise ValueError("Invalid shard, please use K/N (e.g. 1/4)")
+    if not (1 <= k <= n):
+        raise ValueError("Invalid shard, K must be between 1 and N")
+    return k, n
+
+
+def in_shard(
+    key: str,
+    shard: tuple,
+):
+    """
+    Deterministically assign a work unit key to one of N shards (same result on every host and run)
+    """
+    if not shard:
+        return True
+    k, n = shard
+    return int(hashlib.sha256(key.encode("utf-8")).hexdigest(), 16) % n == k - 1
+
+
+# Default lifetime of a work unit lease; leases are renewed while their unit is discovered
+LEASE_TTL_SECONDS = 4 * 3600
+
+
+class LeaseManager:
+    """
+    File based leases, one file per work unit, so two processes sharing a disk never act on the same unit.
+    A lease is created atomically (O_EXCL); leases older than ttl seconds are considered abandoned and taken over.
+    Taking over (and renewing) a lease happens under an exclusive flock on the lease directory's lock file, so two
+    processes can't both take over the same abandoned lease.
+    """
+
+    def __init__(
+        self,
+        lease_dir: str,
+        ttl: int = LEASE_TTL_SECONDS,
+    ) -> None:
+        self._lease_dir = lease_dir
+        self._ttl = ttl
+        self._owner = "{}:{}".format(socket.gethostname(), os.getpid())
+        # Key -> expiry time of the leases held
+        self._held = dict()
+        self._lock = threading.Lock()
+        os.makedirs(lease_dir, exist_ok=True)
+        self._lock_path = os.path.join(lease_dir, ".lock")
+
+    def _path(
+        self,
+        key: str,
+    ):
+        return os.path.join(self._lease_dir, "{}.lease".format(key.replace("/", "__")))
+
+    @contextlib.contextmanager
+    def _locked(
+        self,
+    ):
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(
+        self,
+        path: str,
+    ):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            return {"owner": None, "expires": 0}
+
+    def _write(
+        self,
+        key: str,
+        fd: int,
+    ):
+        expires = time.time() + self._ttl
+        with os.fdopen(fd, "w") as f:
+            json.dump({"owner": self._owner, "expires": expires}, f)
+        with self._lock:
+            self._held[key] = expires
+
+    def acquire(
+        self,
+        key: str,
+    ):
+        path = self._path(key)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            pass
+        else:
+            self._write(key, fd)
+            return True
+
+        with self._locked():
+            # Read again under the lock: another process may have taken the lease over meanwhile
+            lease = self._read(path)
+            if lease is not None:
+                if lease.get("expires", 0) > time.time():
+                    logging.info("Work unit {} is leased by {}, skipping".format(key, lease.get("owner")))
+                    return False
+                logging.info("Taking over expired lease on work unit {} from {}".format(key, lease.get("owner")))
+                os.remove(path)
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                # Created afresh (not taken over) by another process since
+                logging.info("Work unit {} was just leased by another process, skipping".format(key))
+                return False
+            self._write(key, fd)
+            return True
+
+    def renew(
+        self,
+        key: str,
+    ):
+        """
+        Extend a lease held for another ttl once half of it has passed. Returns False if the lease was lost
+        (taken over by another process after it expired).
+        """
+        with self._lock:
+            expires = self._held.get(key)
+        if expires is None:
+            return False
+        if expires - time.time() > self._ttl / 2:
+            return True
+        path = self._path(key)
+        with self._locked():
+            lease = self._read(path)
+            if lease is None or lease.get("owner") != self._owner:
+                logging.warning("Lease on work unit {} was lost to {}".format(key, (lease or dict()).get("owner")))
+                with self._lock:
+                    self._held.pop(key, None)
+                return False
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            self._write(key, os.open(tmp_path, os.O_CREAT | os.O_TRUNC | os.O_WRONLY))
+            os.replace(tmp_path, path)
+        return True
+
+    def release_all(
+        self,
+    ):
+        with self._lock:
+            held = list(self._held)
+            self._held.clear()
+        if not held:
+            return
+        # Under the lock too, or a lease taken over meanwhile could be removed
+        with self._locked():
+            for key in held:
+                lease = self._read(self._path(key))
+                if lease is not None and lease.get("owner") == self._owner:
+                    os.remove(self._path(key))
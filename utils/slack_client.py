@@ -20,6 +20,9 @@ import boto3
 import logging
 import requests
 import time
+import threading
+
+from utils.metrics import METRICS
 
 
 class SlackClient:
@@ -34,14 +37,23 @@ class SlackClient:
         self._url_user_lookup = slack_config.get("user_lookup_endpoint")
         self._url_post_message = slack_config.get("chat_post_message_endpoint")
         self.tick = time.time_ns()
+        # Minimum time between two posts (Slack allows about one message per second per channel)
+        self._post_interval = slack_config.get("post_interval_seconds", 1)
+        # Retries of a call answered with HTTP 429 (after waiting for its Retry-After)
+        self._max_retries = slack_config.get("max_retries", 3)
+        # DeliveryLedger of messages already sent today (set per run), or None
+        self.ledger = None
+        # Pipeline stages post from several threads; rate limiting has to be shared
+        self._lock = threading.Lock()
         aws_secret_client = boto3.client(
             service_name="secretsmanager",
             region_name=slack_config.get("token_secret_region"),
         )
         try:
-            get_secret_value_response = aws_secret_client.get_secret_value(
-                SecretId=slack_config.get("token_secret_name"),
-            )
+            with METRICS.timer("secret_fetch"):
+                get_secret_value_response = aws_secret_client.get_secret_value(
+                    SecretId=slack_config.get("token_secret_name"),
+                )
             self.token = json.loads(get_secret_value_response.get("SecretString")).get(
                 slack_config.get("token_secret_key")
             )
@@ -71,13 +83,33 @@ class SlackClient:
     def rate_limit(
             self
     ):
-        time_now = time.time_ns()
-        tick_diff = (time_now - self.tick)/1000000000
-        if tick_diff < 1:
-            logging.debug("time.sleep({})".format(tick_diff))
-            time.sleep(1 - tick_diff)
+        with self._lock:
             time_now = time.time_ns()
-        self.tick = time_now
+            tick_diff = (time_now - self.tick)/1000000000
+            if tick_diff < self._post_interval:
+                logging.debug("time.sleep({})".format(tick_diff))
+                time.sleep(self._post_interval - tick_diff)
+                METRICS.observe("slack_rate_limit_sleep", self._post_interval - tick_diff)
+                time_now = time.time_ns()
+            self.tick = time_now
+
+    def post(
+        self,
+        url: str,
+        **kwargs,
+    ):
+        for attempt in range(self._max_retries + 1):
+            response = requests.post(
+                url=url,
+                headers=self.headers,
+                **kwargs,
+            )
+            if response.status_code != 429 or attempt == self._max_retries:
+                return response
+            retry_after = int(response.headers.get("Retry-After", 1))
+            logging.info("Slack rate limited, retrying in {}s".format(retry_after))
+            METRICS.observe("slack_retry_after_sleep", retry_after)
+            time.sleep(retry_after)
 
     def dlog_and_send_text(
         self,
@@ -96,45 +128,88 @@ class SlackClient:
             log=True,
         )
 
+    def _already_delivered(
+        self,
+        channel: str,
+        dedupe: tuple,
+    ):
+        """
+        Returns (skip, ledger key): dedupe is (instance ID, result), None for messages that are always sent
+        """
+        if self.ledger is None or dedupe is None:
+            return False, None
+        key = self.ledger.key(channel, *dedupe)
+        if self.ledger.delivered(key):
+            logging.debug("Already delivered to {} today, not sending again: {}".format(channel, dedupe))
+            return True, None
+        return False, key
+
+    def _record_delivery(
+        self,
+        key: str,
+        response,
+    ):
+        if key and response.status_code == 200 and response.json().get("ok"):
+            self.ledger.record(key)
+
     def send_text(
         self,
         text: str,
         log: bool = False,
         channel_id: str = None,  # will default to self.channel_id if None
+        dedupe: tuple = None,
     ):
         # Channel precedence:
         # If channel_id is provided, use that (i.e. direct message)
         # Otherwise, if log, use self.log_channel_id (logging channel)
         # Otherwise, use self.channel_id (primary channel)
+        channel = channel_id or (self.log_channel_id if log else self.channel_id)
+        skip, key = self._already_delivered(channel, dedupe)
+        if skip:
+            return None
         self.rate_limit()
-        response = requests.post(
-            url=self._url_post_message,
-            headers=self.headers,
-            json={
-                # "channel": self.channel_id if channel_id is None else channel_id,
-                "channel": channel_id or (self.log_channel_id if log else self.channel_id),
-                "text": text,
-            },
-        )
+        with METRICS.timer("slack_send"):
+            response = self.post(
+                url=self._url_post_message,
+                json={
+                    "channel": channel,
+                    "text": text,
+                },
+            )
         logging.debug("[SLACK POST RESPONSE] {}".format(response.text))
+        self._record_delivery(key, response)
         return response
 
     def send_dm(
         self,
         text: str,
         email: str,
+        dedupe: tuple = None,
+    ):
+        # Keyed by email rather than user ID, so a skipped DM costs no user lookup
+        skip, key = self._already_delivered("dm:{}".format(email), dedupe)
+        if skip:
+            return None
+        response = self._send_dm(text, email)
+        self._record_delivery(key, response)
+        return response
+
+    def _send_dm(
+        self,
+        text: str,
+        email: str,
     ):
         user_id = self.user_map.get(email)
         # Get User ID
         if not user_id:
-            r = requests.post(
-                url=self._url_user_lookup,
-                headers=self.headers,
-                # User lookup doesn't support json, has to be data
-                data={
-                    "email": email,
-                },
-            )
+            with METRICS.timer("slack_user_lookup"):
+                r = self.post(
+                    url=self._url_user_lookup,
+                    # User lookup doesn't support json, has to be data
+                    data={
+                        "email": email,
+                    },
+                )
             logging.debug("[SLACK EMAIL LOOKUP RESPONSE] {}".format(r.text))
             user_id = r.json().get("user", dict()).get("id")
             if user_id:
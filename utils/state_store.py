@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Local SQLite store of what the cleaner saw and did: each resource's last seen tags and state (with its scheduled
+# action and date), the decisions of every run, and the Slack notifications delivered. Answers questions such as
+# "what is being terminated in the next 7 days, by owner" without calling AWS:
+#
+#   python -m utils.state_store state.db --upcoming 7 --action terminate
+#
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import datetime
+import threading
+
+# Writes are buffered and committed in one transaction every STATE_STORE_BATCH_SIZE statements (and on close)
+STATE_STORE_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    account TEXT,
+    region TEXT NOT NULL,
+    name TEXT,
+    email TEXT,
+    state TEXT,
+    tags TEXT NOT NULL,
+    action TEXT,
+    action_date TEXT,
+    last_seen TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS resources_action_date ON resources (action, action_date);
+CREATE INDEX IF NOT EXISTS resources_email ON resources (email, action_date);
+CREATE INDEX IF NOT EXISTS resources_upcoming ON resources (action_date, email);
+
+CREATE TABLE IF NOT EXISTS decisions (
+    run_date TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    result TEXT NOT NULL,
+    action TEXT,
+    errors TEXT
+);
+CREATE INDEX IF NOT EXISTS decisions_resource ON decisions (resource_id, run_date);
+CREATE INDEX IF NOT EXISTS decisions_run_date ON decisions (run_date);
+
+CREATE TABLE IF NOT EXISTS notifications (
+    run_date TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    result TEXT NOT NULL,
+    email TEXT,
+    dm INTEGER NOT NULL,
+    sent TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notifications_resource ON notifications (resource_id, run_date);
+CREATE INDEX IF NOT EXISTS notifications_run_date ON notifications (run_date);
+"""
+
+
+class StateStore:
+    """
+    SQLite state store, shared by the pipeline's worker threads. Decisions and notifications older than
+    retention_days (None: kept) are deleted when it is opened; resources are kept as last seen.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        run_date: datetime.date,
+        retention_days: int = 90,
+    ) -> None:
+        self.path = path
+        self.run_date = str(run_date)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # Readers (e.g. reports) don't block the run
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        if retention_days is not None:
+            oldest = str(run_date - datetime.timedelta(days=retention_days))
+            with self._db:
+                self._db.execute("DELETE FROM decisions WHERE run_date < ?", (oldest,))
+                self._db.execute("DELETE FROM notifications WHERE run_date < ?", (oldest,))
+
+    def _write(
+        self,
+        statements: list,
+    ):
+        """
+        Run (sql, parameters) statements; commits once STATE_STORE_BATCH_SIZE of them are pending
+        """
+        with self._lock:
+            for sql, parameters in statements:
+                self._db.execute(sql, parameters)
+            self._pending += len(statements)
+            if self._pending >= STATE_STORE_BATCH_SIZE:
+                self._db.commit()
+                self._pending = 0
+
+    def observe(
+        self,
+        records: list,
+    ):
+        """
+        Store the resources of a batch of actuated decision records, as they are now (tag writes that failed
+        or weren't made are left out), and their decisions
+        """
+        statements = list()
+        for record in records:
+            instance = record["instance"]
+            errors = record.get("errors") or dict()
+            done = not errors and not record.get("busy")
+            tags = dict(instance.tags)
+            if done:
+                for tag, values in record["updated_tags"].items():
+                    if values["new"] is None:
+                        tags.pop(tag, None)
+                    else:
+                        tags[tag] = str(values["new"])
+
+            states = ((record.get("unit") or dict()).get("type_config") or dict()).get("states") or dict()
+            state = instance.state
+            state_config = states.get(state)
+            if record["action"] and done and state_config:
+                # The action moved the resource on to the state's next_state (none after a terminate or delete,
+                # whose resources are stored with the action as their state)
+                state = state_config.get("next_state") or record["action"]
+                state_config = states.get(state)
+            action = state_config["action"] if state_config else None
+            action_date = tags.get(state_config["action_tag"]) if state_config else None
+            statements.append(
+                (
+                    "INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        instance.id,
+                        instance.type,
+                        instance.account,
+                        instance.region,
+                        instance.name,
+                        instance.email,
+                        state,
+                        json.dumps(tags, sort_keys=True),
+                        action,
+                        action_date,
+                        self.run_date,
+                    ),
+                )
+            )
+            if "intent" in record:
+                # Applied from a plan (--apply): the intent holds the messages, in the journal's format
+                results = [message["result"] for message in record["intent"]["messages"]]
+            else:
+                results = [message["details"]["result"] for message in record["messages"]]
+            for result in results:
+                statements.append(
+                    (
+                        "INSERT INTO decisions VALUES (?, ?, ?, ?, ?)",
+                        (
+                            self.run_date,
+                            instance.id,
+                            getattr(result, "value", result),
+                            record["action"],
+                            json.dumps(errors) if errors else None,
+                        ),
+                    )
+                )
+        self._write(statements)
+
+    def notified(
+        self,
+        resource_id: str,
+        result: str,
+        email: str = None,
+        dm: bool = False,
+    ):
+        self._write(
+            [
+                (
+                    "INSERT INTO notifications VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        self.run_date,
+                        resource_id,
+                        getattr(result, "value", result),
+                        email,
+                        int(dm),
+                        datetime.datetime.now().isoformat(timespec="seconds"),
+                    ),
+                )
+            ]
+        )
+
+    def upcoming(
+        self,
+        days: int,
+        action: str = None,
+        today: datetime.date = None,
+    ):
+        """
+        Resources with an action scheduled in the next `days` days (optionally only `action`), by owner then date,
+        as a list of dicts
+        """
+        today = today or datetime.date.today()
+        sql = "SELECT email, action_date, action, type, id, name, region, account FROM resources WHERE action_date >= ? AND action_date <= ?"
+        parameters = [str(today), str(today + datetime.timedelta(days=days))]
+        if action:
+            sql += " AND action = ?"
+            parameters.append(action)
+        sql += " ORDER BY email, action_date, id"
+        with self._lock:
+            cursor = self._db.execute(sql, parameters)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def commit(
+        self,
+    ):
+        """
+        Commit the pending writes, e.g. before leaving the store open while another process or run uses it
+        """
+        with self._lock:
+            self._db.commit()
+            self._pending = 0
+
+    def close(
+        self,
+    ):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AWS Cleaner state store report")
+    parser.add_argument("path", help="State store file (global.state_store_file)")
+    parser.add_argument("--upcoming", help="Resources with an action due in the next N days (default is 7), by owner", type=int, default=7, dest="upcoming")
+    parser.add_argument("--action", help="Only this action (e.g. terminate)", dest="action")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        sys.exit("No state store at {}".format(args.path))
+    store = StateStore(args.path, datetime.date.today(), retention_days=None)
+    email = object()
+    for row in store.upcoming(args.upcoming, action=args.action):
+        if row["email"] != email:
+            email = row["email"]
+            print(email or "(no owner)")
+        print("  {action_date} {action:<12} {type:<4} {id} ({name}) in {region}".format(**row))
+    store.close()
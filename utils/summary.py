@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Confluent Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import datetime
+import threading
+
+from utils import datetime_handler
+
+
+class RunSummary:
+    """
+    Counts collected during a run: instances found per work unit (by state) and decision results.
+    Summaries from several shards of the same run can be merged into one.
+    """
+
+    def __init__(
+        self,
+        run_date: datetime.date = None,
+        dry_run: bool = False,
+        shard: str = None,
+        on_unit_completed=None,
+    ) -> None:
+        self._lock = threading.Lock()
+        # Called with the key of each work unit as it completes (e.g. to checkpoint it)
+        self._on_unit_completed = on_unit_completed
+        self.data = {
+            "run_date": str(run_date) if run_date else None,
+            "dry_run": dry_run,
+            "shards": [shard] if shard else list(),
+            "started": datetime.datetime.now().isoformat(timespec="seconds"),
+            "finished": None,
+            "units": dict(),
+            "results": dict(),
+            "errors": dict(),
+            "completed_units": list(),
+        }
+        # Instances processed (all the way through notification) per work unit
+        self._processed = dict()
+
+    def add_unit(
+        self,
+        key: str,
+        account: str,
+        region: str,
+        instance_type: str,
+        included: dict,
+        excluded: dict,
+    ):
+        """
+        Record the instance counts of a fully discovered work unit. Returns True if this completes the unit.
+        """
+        with self._lock:
+            self.data["units"][key] = {
+                "account": account,
+                "region": region,
+                "instance_type": instance_type,
+                "included": dict(included),
+                "excluded": dict(excluded),
+            }
+            completed = self._check_completed(key)
+        return self._completed(key, completed)
+
+    def add_processed(
+        self,
+        key: str,
+    ):
+        """
+        Count one instance of a work unit as fully processed. Returns True if this completes the unit.
+        """
+        with self._lock:
+            self._processed[key] = self._processed.get(key, 0) + 1
+            completed = self._check_completed(key)
+        return self._completed(key, completed)
+
+    def _completed(
+        self,
+        key: str,
+        completed: bool,
+    ):
+        # Outside the lock, the callback may take a while
+        if completed and self._on_unit_completed:
+            self._on_unit_completed(key)
+        return completed
+
+    def _check_completed(
+        self,
+        key: str,
+    ):
+        # A unit is complete once discovered and all of its instances have been processed
+        unit = self.data["units"].get(key)
+        if unit is None or key in self.data["completed_units"]:
+            return False
+        if self._processed.get(key, 0) >= sum(unit["included"].values()) + sum(unit["excluded"].values()):
+            self.data["completed_units"].append(key)
+            return True
+        return False
+
+    def add_deferred(
+        self,
+        count: int = 1,
+    ):
+        """
+        Count instances left unprocessed because the run stopped early (their units stay incomplete)
+        """
+        with self._lock:
+            self.data["deferred"] = self.data.get("deferred", 0) + count
+
+    def add_result(
+        self,
+        result: str,
+    ):
+        # Result enum members are stored by value, so they survive a round trip through JSON
+        result = getattr(result, "value", result)
+        with self._lock:
+            self.data["results"][result] = self.data["results"].get(result, 0) + 1
+
+    def add_errors(
+        self,
+        errors: dict,
+    ):
+        """
+        Count the failed parts ("action", "tags") of a decision record
+        """
+        with self._lock:
+            for part in errors:
+                self.data["errors"][part] = self.data["errors"].get(part, 0) + 1
+
+    def finish(
+        self,
+    ):
+        self.data["finished"] = datetime.datetime.now().isoformat(timespec="seconds")
+
+    def unit_lines(
+        self,
+        key: str,
+    ):
+        """
+        Slack/log lines for a work unit (total, processed and not processed counts)
+        """
+        unit = self.data["units"][key]
+        label = "[{}] ".format(unit["account"]) if unit["account"] else ""
+        included = sum(unit["included"].values())
+        excluded = sum(unit["excluded"].values())
+
+        lines = [
+            "{label}Total {type} instances found in region {region}: {total}".format(
+                label=label,
+                type=unit["instance_type"],
+                region=unit["region"],
+                total=included + excluded,
+            )
+        ]
+        if included > 0:
+            lines.append(
+                "{label}{total} will be processed: {c}".format(
+                    label=label,
+                    total=included,
+                    c=", ".join(["{} {}".format(v, k) for k,v in unit["included"].items()]),
+                )
+            )
+        if excluded > 0:
+            lines.append(
+                "{label}{total} will not be processed (not currently handled by script): {c}".format(
+                    label=label,
+                    total=excluded,
+                    c=", ".join(["{} {}".format(v, k) for k,v in unit["excluded"].items()]),
+                )
+            )
+        return lines
+
+    def results_line(
+        self,
+    ):
+        line = "Results: {}".format(
+            ", ".join(["{} {}".format(v, k) for k,v in sorted(self.data["results"].items())]) or "none"
+        )
+        errors = self.data.get("errors")
+        if errors:
+            line += " (failed: {})".format(", ".join(["{} {}".format(v, k) for k,v in sorted(errors.items())]))
+        return line
+
+    def save(
+        self,
+        path: str,
+    ):
+        with open(path, "w") as f:
+            json.dump(self.data, f, indent=3, default=datetime_handler)
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+    ):
+        summary = cls()
+        with open(path, "r") as f:
+            summary.data = json.load(f)
+        return summary
+
+    @classmethod
+    def merge(
+        cls,
+        summaries: list,
+    ):
+        """
+        Combine per-shard summaries: units are unioned, result counts are added up
+        """
+        merged = cls()
+        merged.data["started"] = None
+        for summary in summaries:
+            data = summary.data
+            merged.data["run_date"] = merged.data["run_date"] or data.get("run_date")
+            merged.data["dry_run"] = merged.data["dry_run"] or data.get("dry_run", False)
+            merged.data["shards"] += data.get("shards", list())
+            merged.data["units"].update(data.get("units", dict()))
+            merged.data["completed_units"] += data.get("completed_units", list())
+            for result, count in data.get("results", dict()).items():
+                merged.data["results"][result] = merged.data["results"].get(result, 0) + count
+            for part, count in data.get("errors", dict()).items():
+                merged.data["errors"][part] = merged.data["errors"].get(part, 0) + count
+            for field, pick in (("started", min), ("finished", max)):
+                values = [v for v in (merged.data[field], data.get(field)) if v]
+                merged.data[field] = pick(values) if values else None
+        return merged